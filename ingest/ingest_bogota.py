@@ -1,8 +1,23 @@
+'''
+City ingest: OSMnx download -> COPY into per-city staging tables -> atomic partition swap.
+
+Cities come from the command line (`name="Place, Country"` ...), the CITIES env var
+(`bogota=Bogotá, Colombia;medellin=Medellín, Colombia`) or CITY/PLACE_NAME, and are
+processed in parallel worker processes (INGEST_WORKERS).
+
+Per city, nodes and edges are streamed through `COPY ... FROM STDIN` into bare staging
+tables; keys, indexes and constraints are built after the load, and the staging tables
+then replace the city's `nodes`/`edges` partitions in one short transaction that also
+bumps `cities.data_version`. Route engines therefore see either the old or the new city,
+never a half-ingested one.
+'''
+import math
 import os
+import sys
 import time
+import multiprocessing
 import psycopg2
 import osmnx as ox
-import networkx as nx
 
 DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_PORT = int(os.getenv("DB_PORT", "5432"))
@@ -11,6 +26,71 @@ DB_USER = os.getenv("DB_USER", "routeuser")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "routepass")
 CITY = (os.getenv("CITY", "bogota")).lower()
 PLACE_NAME = os.getenv("PLACE_NAME", "Bogotá, Colombia")
+CITIES = os.getenv("CITIES", "")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+# grid size (degrees) of the tile keys on nodes/edges, for engines loading tiles (TILED_CITIES)
+TILE_DEG = float(os.getenv("TILE_DEG", "0.02"))
+
+# same DDL as postgres/init.sql, for databases created before partitioning
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS cities (
+  id SERIAL PRIMARY KEY,
+  name TEXT UNIQUE NOT NULL,
+  data_version BIGINT NOT NULL DEFAULT 0,
+  tile_deg DOUBLE PRECISION NOT NULL DEFAULT 0
+);
+ALTER TABLE cities ADD COLUMN IF NOT EXISTS data_version BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE cities ADD COLUMN IF NOT EXISTS tile_deg DOUBLE PRECISION NOT NULL DEFAULT 0;
+CREATE TABLE IF NOT EXISTS nodes (
+  city_id INTEGER NOT NULL REFERENCES cities(id) ON DELETE CASCADE,
+  osmid BIGINT NOT NULL,
+  x DOUBLE PRECISION NOT NULL,
+  y DOUBLE PRECISION NOT NULL,
+  tile BIGINT NOT NULL DEFAULT 0,
+  PRIMARY KEY (city_id, osmid)
+) PARTITION BY LIST (city_id);
+CREATE TABLE IF NOT EXISTS edges (
+  city_id INTEGER NOT NULL REFERENCES cities(id) ON DELETE CASCADE,
+  u BIGINT NOT NULL,
+  v BIGINT NOT NULL,
+  length DOUBLE PRECISION NOT NULL,
+  travel_time DOUBLE PRECISION NOT NULL,
+  highway TEXT NOT NULL,
+  lit BOOLEAN NOT NULL DEFAULT FALSE,
+  temp_risk DOUBLE PRECISION NOT NULL,
+  security_risk DOUBLE PRECISION NOT NULL,
+  tile BIGINT NOT NULL DEFAULT 0,
+  v_tile BIGINT NOT NULL DEFAULT 0,
+  shape DOUBLE PRECISION[],
+  PRIMARY KEY (city_id, u, v, length)
+) PARTITION BY LIST (city_id);
+ALTER TABLE nodes ADD COLUMN IF NOT EXISTS tile BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE edges ADD COLUMN IF NOT EXISTS tile BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE edges ADD COLUMN IF NOT EXISTS v_tile BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE edges ADD COLUMN IF NOT EXISTS shape DOUBLE PRECISION[];
+CREATE INDEX IF NOT EXISTS idx_edges_uv ON edges(city_id, u, v);
+CREATE INDEX IF NOT EXISTS idx_nodes_tile ON nodes(city_id, tile);
+CREATE INDEX IF NOT EXISTS idx_edges_tile ON edges(city_id, tile);
+"""
+
+# pre-partitioning tables become the DEFAULT partition, so already ingested cities keep
+# serving until they are re-ingested into a partition of their own
+MIGRATE_SQL = """
+ALTER TABLE nodes RENAME TO nodes_legacy;
+ALTER TABLE edges RENAME TO edges_legacy;
+ALTER INDEX nodes_pkey RENAME TO nodes_legacy_pkey;
+ALTER INDEX edges_pkey RENAME TO edges_legacy_pkey;
+ALTER INDEX IF EXISTS idx_edges_uv RENAME TO idx_edges_legacy_uv;
+DROP INDEX IF EXISTS idx_nodes_city;
+DROP INDEX IF EXISTS idx_edges_city;
+ALTER TABLE nodes_legacy ADD COLUMN IF NOT EXISTS tile BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE edges_legacy ADD COLUMN IF NOT EXISTS tile BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE edges_legacy ADD COLUMN IF NOT EXISTS v_tile BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE edges_legacy ADD COLUMN IF NOT EXISTS shape DOUBLE PRECISION[];
+""" + SCHEMA_SQL + """
+ALTER TABLE nodes ATTACH PARTITION nodes_legacy DEFAULT;
+ALTER TABLE edges ATTACH PARTITION edges_legacy DEFAULT;
+"""
 
 def risk_from_tags(highway:str, lit:bool):
     # simple, deterministic scoring for demo purposes
@@ -25,57 +105,181 @@ def risk_from_tags(highway:str, lit:bool):
     security_risk = 0.1 if (hw in ["motorway","trunk","primary"] and lit) else 0.3 if hw in ["secondary","tertiary"] else 0.7
     return temp_risk, security_risk
 
-def main():
-    print(f"[ingest] downloading street network for {PLACE_NAME} ...", flush=True)
-    G = ox.graph_from_place(PLACE_NAME, network_type="drive", simplify=True)
+def connect():
+    return psycopg2.connect(host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD)
+
+def ensure_schema(conn):
+    with conn, conn.cursor() as cur:
+        cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('public.nodes')")
+        row = cur.fetchone()
+        if row is not None and row[0] == "r":
+            print("[ingest] converting nodes/edges to per-city partitions ...", flush=True)
+            cur.execute(MIGRATE_SQL)
+        else:
+            cur.execute(SCHEMA_SQL)
+
+class RowStream:
+    '''Read-only file over an iterator of COPY text lines, so rows stream instead of buffering.'''
+
+    def __init__(self, lines):
+        self._lines = iter(lines)
+        self._buf = ""
+
+    def read(self, size=-1):
+        parts = [self._buf]
+        have = len(self._buf)
+        while size < 0 or have < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            parts.append(line)
+            have += len(line)
+        data = "".join(parts)
+        if size < 0:
+            size = len(data)
+        self._buf = data[size:]
+        return data[:size]
+
+def copy_text(value):
+    # COPY text format: backslash, tab and newline must be escaped
+    return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+def tile_key(lat, lon):
+    # same grid key as route_engine/app/tiles.py tile_key
+    row = math.floor((lat + 90.0) / TILE_DEG)
+    col = math.floor((lon + 180.0) / TILE_DEG)
+    return (row << 20) | col
+
+def node_rows(G, city_id):
+    for n, d in G.nodes(data=True):
+        x, y = float(d['x']), float(d['y'])
+        yield f"{city_id}\t{int(n)}\t{x!r}\t{y!r}\t{tile_key(y, x)}\n"
+
+def shape_text(geometry):
+    # inner points of an edge's LineString (x=lon, y=lat) as a flat lat, lon array literal
+    if geometry is None or len(geometry.coords) <= 2:
+        return "\\N"
+    return "{" + ",".join(f"{float(y)!r},{float(x)!r}" for x, y in geometry.coords[1:-1]) + "}"
+
+def edge_rows(G, city_id):
+    tiles = {n: tile_key(float(d['y']), float(d['x'])) for n, d in G.nodes(data=True)}
+    seen = set()
+    for u, v, k, d in G.edges(keys=True, data=True):
+        hw = d.get("highway")
+        if isinstance(hw, list): hw = hw[0]
+        lit = str(d.get("lit", "no")).lower() in ("1","true","yes")
+        temp_risk, security_risk = risk_from_tags(hw, lit)
+        length = float(d.get("length", 1.0))
+        tt = float(d.get("travel_time", length/8.0))
+        # parallel edges of equal length collide on the primary key; keep the first
+        key = (int(u), int(v), length)
+        if key in seen:
+            continue
+        seen.add(key)
+        yield (f"{city_id}\t{key[0]}\t{key[1]}\t{length!r}\t{tt!r}\t{copy_text(hw or '')}\t"
+               f"{'t' if lit else 'f'}\t{temp_risk!r}\t{security_risk!r}\t{tiles[u]}\t{tiles[v]}\t"
+               f"{shape_text(d.get('geometry'))}\n")
+
+def ingest_city(city, place):
+    t0 = time.perf_counter()
+    print(f"[ingest:{city}] downloading street network for {place} ...", flush=True)
+    G = ox.graph_from_place(place, network_type="drive", simplify=True)
     G = ox.add_edge_speeds(G)         # km/h
     G = ox.add_edge_travel_times(G)   # seconds
 
-    print("[ingest] connecting to Postgres ...", flush=True)
-    conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD)
-    conn.autocommit = True
-
-    with conn.cursor() as cur:
-        cur.execute("INSERT INTO cities(name) VALUES (%s) ON CONFLICT (name) DO NOTHING", (CITY,))
-        cur.execute("SELECT id FROM cities WHERE name=%s", (CITY,))
+    conn = connect()
+    with conn, conn.cursor() as cur:
+        cur.execute("INSERT INTO cities(name) VALUES (%s) ON CONFLICT (name) DO NOTHING", (city,))
+        cur.execute("SELECT id FROM cities WHERE name=%s", (city,))
         city_id = cur.fetchone()[0]
+    nodes_part, edges_part = f"nodes_c{city_id}", f"edges_c{city_id}"
 
-    # insert nodes
-    print("[ingest] inserting nodes ...", flush=True)
-    with conn.cursor() as cur:
-        args = []
-        for n, d in G.nodes(data=True):
-            args.append((city_id, int(n), float(d["x"]), float(d["y"])))
-            if len(args) >= 5000:
-                psycopg2.extras.execute_values(cur, "INSERT INTO nodes(city_id, osmid, x, y) VALUES %s ON CONFLICT DO NOTHING", args)
-                args.clear()
-        if args:
-            psycopg2.extras.execute_values(cur, "INSERT INTO nodes(city_id, osmid, x, y) VALUES %s ON CONFLICT DO NOTHING", args)
-
-    # insert edges
-    print("[ingest] inserting edges ...", flush=True)
+    # load: bare staging tables, no indexes while COPY runs
+    print(f"[ingest:{city}] copying nodes and edges ...", flush=True)
+    with conn, conn.cursor() as cur:
+        for part, parent in ((nodes_part, "nodes"), (edges_part, "edges")):
+            cur.execute(f"DROP TABLE IF EXISTS {part}_load")
+            cur.execute(f"CREATE TABLE {part}_load (LIKE {parent} INCLUDING DEFAULTS)")
+        cur.copy_expert(f"COPY {nodes_part}_load (city_id, osmid, x, y, tile) FROM STDIN",
+                        RowStream(node_rows(G, city_id)))
+        cur.copy_expert(f"COPY {edges_part}_load (city_id, u, v, length, travel_time, highway, lit, temp_risk, security_risk, tile, v_tile, shape) FROM STDIN",
+                        RowStream(edge_rows(G, city_id)))
+
+    # index: match the parents' keys/indexes and the partition bound, so ATTACH neither
+    # builds an index nor scans the table while holding its locks
+    print(f"[ingest:{city}] building indexes ...", flush=True)
+    with conn, conn.cursor() as cur:
+        cur.execute(f"ALTER TABLE {nodes_part}_load ADD CONSTRAINT {nodes_part}_load_pkey PRIMARY KEY (city_id, osmid)")
+        cur.execute(f"ALTER TABLE {edges_part}_load ADD CONSTRAINT {edges_part}_load_pkey PRIMARY KEY (city_id, u, v, length)")
+        cur.execute(f"CREATE INDEX {edges_part}_load_uv ON {edges_part}_load (city_id, u, v)")
+        for part in (nodes_part, edges_part):
+            cur.execute(f"CREATE INDEX {part}_load_tile ON {part}_load (city_id, tile)")
+        for part in (nodes_part, edges_part):
+            cur.execute(f"ALTER TABLE {part}_load ADD CONSTRAINT {part}_load_city CHECK (city_id = {int(city_id)})")
+            cur.execute(f"ALTER TABLE {part}_load ADD FOREIGN KEY (city_id) REFERENCES cities(id) ON DELETE CASCADE")
+    conn.autocommit = True
     with conn.cursor() as cur:
-        args = []
-        for u, v, k, d in G.edges(keys=True, data=True):
-            hw = d.get("highway")
-            if isinstance(hw, list): hw = hw[0]
-            lit = str(d.get("lit", "no")).lower() in ("1","true","yes")
-            temp_risk, security_risk = risk_from_tags(hw, lit)
-            length = float(d.get("length", 1.0))
-            tt = float(d.get("travel_time", length/8.0))
-            args.append((city_id, int(u), int(v), length, tt, hw or "", lit, temp_risk, security_risk))
-            if len(args) >= 5000:
-                psycopg2.extras.execute_values(cur, 
-                    "INSERT INTO edges(city_id, u, v, length, travel_time, highway, lit, temp_risk, security_risk) VALUES %s ON CONFLICT DO NOTHING", 
-                    args)
-                args.clear()
-        if args:
-            psycopg2.extras.execute_values(cur, 
-                "INSERT INTO edges(city_id, u, v, length, travel_time, highway, lit, temp_risk, security_risk) VALUES %s ON CONFLICT DO NOTHING", 
-                args)
+        cur.execute(f"ANALYZE {nodes_part}_load")
+        cur.execute(f"ANALYZE {edges_part}_load")
+    conn.autocommit = False
+
+    # swap: one transaction replaces the city's partitions and bumps its data_version
+    print(f"[ingest:{city}] swapping partitions ...", flush=True)
+    with conn, conn.cursor() as cur:
+        for part, parent in ((nodes_part, "nodes"), (edges_part, "edges")):
+            cur.execute("SELECT to_regclass(%s) IS NOT NULL", (part,))
+            if cur.fetchone()[0]:
+                cur.execute(f"ALTER TABLE {parent} DETACH PARTITION {part}")
+                cur.execute(f"DROP TABLE {part}")
+            # rows of this city still in a pre-partitioning DEFAULT partition
+            cur.execute(f"DELETE FROM {parent} WHERE city_id=%s", (city_id,))
+            cur.execute(f"ALTER TABLE {parent} ATTACH PARTITION {part}_load FOR VALUES IN ({int(city_id)})")
+            cur.execute(f"ALTER TABLE {part}_load RENAME TO {part}")
+            cur.execute(f"ALTER TABLE {part} DROP CONSTRAINT {part}_load_city")
+            # free the staging names for the next ingest
+            cur.execute(f"ALTER INDEX {part}_load_pkey RENAME TO {part}_pkey")
+            cur.execute(f"ALTER INDEX {part}_load_tile RENAME TO {part}_tile")
+        cur.execute(f"ALTER INDEX {edges_part}_load_uv RENAME TO {edges_part}_uv")
+        # signal route engines that their graph snapshots (or tiles) for this city are stale
+        cur.execute("UPDATE cities SET data_version = data_version + 1, tile_deg = %s WHERE id=%s", (TILE_DEG, city_id))
+    conn.close()
+
+    print(f"[ingest:{city}] done: {G.number_of_nodes()} nodes, {G.number_of_edges()} edges "
+          f"in {time.perf_counter() - t0:.1f}s", flush=True)
+    return city
+
+def parse_cities(args):
+    if args:
+        specs = args
+    elif CITIES:
+        specs = [s for s in CITIES.split(";") if s.strip()]
+    else:
+        return [(CITY, PLACE_NAME)]
+    cities = []
+    for spec in specs:
+        name, _, place = spec.partition("=")
+        if not place:
+            raise SystemExit(f"bad city spec {spec!r}, expected name=Place, Country")
+        cities.append((name.strip().lower(), place.strip()))
+    return cities
+
+def main(args):
+    cities = parse_cities(args)
+    print("[ingest] connecting to Postgres ...", flush=True)
+    conn = connect()
+    ensure_schema(conn)
+    conn.close()
+
+    workers = max(1, min(INGEST_WORKERS, len(cities)))
+    print(f"[ingest] {len(cities)} cities, {workers} worker processes", flush=True)
+    if workers == 1:
+        for city, place in cities:
+            ingest_city(city, place)
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            pool.starmap(ingest_city, cities)
 
     print("[ingest] done.", flush=True)
 
 if __name__ == "__main__":
-    import psycopg2.extras
-    main()
+    main(sys.argv[1:])
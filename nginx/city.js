@@ -0,0 +1,17 @@
+// Sends /route, /matrix and /admin/edges to the engines owning the request's city: the city
+// comes from an X-City header, a ?city= argument or the JSON body, in that order, and picks
+// the upstream through the map in upstreams.conf ("" = the engines' DEFAULT_CITY).
+function route(r) {
+    var city = r.headersIn['X-City'] || r.args.city || '';
+    if (!city && r.requestText) {
+        try {
+            city = JSON.parse(r.requestText).city || '';
+        } catch (e) {
+            // not JSON: the engine answers 400
+        }
+    }
+    r.variables.route_city = String(city).toLowerCase();
+    r.internalRedirect('@engines');
+}
+
+export default {route};
@@ -1,15 +1,23 @@
 CREATE TABLE IF NOT EXISTS cities (
   id SERIAL PRIMARY KEY,
-  name TEXT UNIQUE NOT NULL
+  name TEXT UNIQUE NOT NULL,
+  -- bumped by every ingest; route engines rebuild their graph snapshot when it changes
+  data_version BIGINT NOT NULL DEFAULT 0,
+  -- grid size of the nodes'/edges' tile keys (0 = ingested without tiles)
+  tile_deg DOUBLE PRECISION NOT NULL DEFAULT 0
 );
 
+-- one partition per city (nodes_c<id>, edges_c<id>); the ingest loads a new partition
+-- off to the side and swaps it in atomically
 CREATE TABLE IF NOT EXISTS nodes (
   city_id INTEGER NOT NULL REFERENCES cities(id) ON DELETE CASCADE,
   osmid BIGINT NOT NULL,
   x DOUBLE PRECISION NOT NULL,
   y DOUBLE PRECISION NOT NULL,
+  -- grid key of (y, x), see route_engine/app/tiles.py
+  tile BIGINT NOT NULL DEFAULT 0,
   PRIMARY KEY (city_id, osmid)
-);
+) PARTITION BY LIST (city_id);
 
 CREATE TABLE IF NOT EXISTS edges (
   city_id INTEGER NOT NULL REFERENCES cities(id) ON DELETE CASCADE,
@@ -21,9 +29,15 @@ CREATE TABLE IF NOT EXISTS edges (
   lit BOOLEAN NOT NULL DEFAULT FALSE,
   temp_risk DOUBLE PRECISION NOT NULL,
   security_risk DOUBLE PRECISION NOT NULL,
+  -- tiles of u and v
+  tile BIGINT NOT NULL DEFAULT 0,
+  v_tile BIGINT NOT NULL DEFAULT 0,
+  -- inner points of the way between u and v (the degree-2 nodes OSMnx contracted),
+  -- flat lat, lon, lat, lon, ...; NULL for a straight segment
+  shape DOUBLE PRECISION[],
   PRIMARY KEY (city_id, u, v, length)
-);
+) PARTITION BY LIST (city_id);
 
-CREATE INDEX IF NOT EXISTS idx_nodes_city ON nodes(city_id);
-CREATE INDEX IF NOT EXISTS idx_edges_city ON edges(city_id);
 CREATE INDEX IF NOT EXISTS idx_edges_uv ON edges(city_id, u, v);
+CREATE INDEX IF NOT EXISTS idx_nodes_tile ON nodes(city_id, tile);
+CREATE INDEX IF NOT EXISTS idx_edges_tile ON edges(city_id, tile);
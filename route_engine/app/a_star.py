@@ -1,49 +1,243 @@
 import time, heapq, math
 
-def astar_with_deadline(G, source, target, heuristic, weight_func, deadline_sec):
+def astar_with_deadline(G, source, target, heuristic, weights, deadline_sec, stats=None):
     '''
-    Classic A* with a time budget. If time expires, returns best-so-far partial route.
+    Classic A* with a time budget over a CSRGraph. If time expires, returns no path (reason
+    "timeout"): a route to the node closest to the target does not reach the target.
+    `source`/`target` are node indices and `weights` is a per-edge cost array. With a `stats`
+    dict, heap pushes and edge relaxations are added to it (see count_work).
     Returns: (path_nodes, total_cost, expanded_count, degraded, reason)
     '''
     start_time = time.perf_counter()
+    offsets, targets = G.offsets, G.targets
     open_set = [(0, source)]
     came_from = {}
     g_score = {source: 0.0}
     f_score = {source: heuristic(source)}
-    expanded = 0
-    best_node = source
-    best_f = f_score[source]
+    expanded = relaxed = 0
 
     while open_set:
         if time.perf_counter() - start_time > deadline_sec:
-            # timeout: degrade - return path to best_node if exists
-            degraded_path = reconstruct_path(came_from, best_node)
-            return degraded_path, g_score.get(best_node, math.inf), expanded, True, "timeout"
+            # timeout: the caller's fallback (or a 504) handles it
+            count_work(stats, expanded + len(open_set), relaxed)
+            return [], math.inf, expanded, True, "timeout"
 
         _, current = heapq.heappop(open_set)
         expanded += 1
 
         if current == target:
+            count_work(stats, expanded + len(open_set), relaxed)
             return reconstruct_path(came_from, current), g_score[current], expanded, False, ""
 
-        for _, neighbor, data in G.out_edges(current, data=True):
-            # weight function determines cost per edge
-            w = weight_func(data)
-            tentative_g = g_score[current] + w
+        lo, hi = offsets[current], offsets[current + 1]
+        relaxed += hi - lo
+        g_current = g_score[current]
+        for neighbor, w in zip(targets[lo:hi].tolist(), weights[lo:hi].tolist()):
+            tentative_g = g_current + w
             if tentative_g < g_score.get(neighbor, math.inf):
                 came_from[neighbor] = current
                 g_score[neighbor] = tentative_g
                 f = tentative_g + heuristic(neighbor)
                 f_score[neighbor] = f
                 heapq.heappush(open_set, (f, neighbor))
-                if f < best_f:
-                    best_f = f
-                    best_node = neighbor
 
     # no path found
+    count_work(stats, expanded, relaxed)
     return [], math.inf, expanded, True, "no_path"
 
 
+def bidirectional_astar_with_deadline(G, source, target, heuristic, reverse_heuristic, weights, deadline_sec, stats=None):
+    '''
+    Bidirectional A* (symmetric approach) with a time budget. `heuristic` bounds the cost
+    to target, `reverse_heuristic` the cost from source. Only complete routes are returned;
+    on timeout that is the best meeting found so far, if any.
+    Returns: (path_nodes, total_cost, expanded_count, degraded, reason, suboptimality_bound)
+    '''
+    start_time = time.perf_counter()
+    rev_offsets, rev_sources, rev_edges = G.reverse()
+    adjacency = ((G.offsets, G.targets, None), (rev_offsets, rev_sources, rev_edges))
+    h = (heuristic, reverse_heuristic)
+    g_score = ({source: 0.0}, {target: 0.0})
+    came_from = ({}, {})
+    open_sets = ([(heuristic(source), 0.0, source)], [(reverse_heuristic(target), 0.0, target)])
+    best, meet = math.inf, None
+    expanded = pops = relaxed = 0
+    timed_out = False
+
+    while open_sets[0] and open_sets[1]:
+        # every shorter route has a node on each frontier with key <= its cost
+        if open_sets[0][0][0] >= best or open_sets[1][0][0] >= best:
+            break
+        if time.perf_counter() - start_time > deadline_sec:
+            timed_out = True
+            break
+
+        side = 0 if open_sets[0][0][0] <= open_sets[1][0][0] else 1
+        _, g_current, current = heapq.heappop(open_sets[side])
+        pops += 1
+        own, other = g_score[side], g_score[1 - side]
+        if g_current > own[current]:
+            continue
+        expanded += 1
+        if current in other and g_current + other[current] < best:
+            best, meet = g_current + other[current], current
+
+        offsets, neighbors, edge_ids = adjacency[side]
+        lo, hi = offsets[current], offsets[current + 1]
+        relaxed += hi - lo
+        costs = weights[lo:hi] if edge_ids is None else weights[edge_ids[lo:hi]]
+        for neighbor, w in zip(neighbors[lo:hi].tolist(), costs.tolist()):
+            tentative_g = g_current + w
+            if tentative_g < own.get(neighbor, math.inf):
+                own[neighbor] = tentative_g
+                came_from[side][neighbor] = current
+                if neighbor in other and tentative_g + other[neighbor] < best:
+                    best, meet = tentative_g + other[neighbor], neighbor
+                f = tentative_g + h[side](neighbor)
+                if f < best:
+                    heapq.heappush(open_sets[side], (f, tentative_g, neighbor))
+
+    count_work(stats, pops + len(open_sets[0]) + len(open_sets[1]), relaxed)
+    if meet is None:
+        return [], math.inf, expanded, True, "timeout" if timed_out else "no_path", None
+
+    path = reconstruct_path(came_from[0], meet)
+    tail = reconstruct_path(came_from[1], meet)
+    path.extend(reversed(tail[:-1]))
+    if not timed_out:
+        return path, best, expanded, False, "", 1.0
+    lower = max(open_sets[0][0][0] if open_sets[0] else best, open_sets[1][0][0] if open_sets[1] else best)
+    return path, best, expanded, True, "timeout", _bound(best, lower)
+
+
+def anytime_astar_with_deadline(G, source, target, heuristic, weights, deadline_sec, inflation=(3.0, 1.5, 1.0), stats=None):
+    '''
+    Anytime A* (restarting weighted A*): a greedy search with heuristic inflated by
+    inflation[0] finds a complete route fast, then searches with tighter inflation
+    improve it while the budget lasts. A finished search with inflation e guarantees
+    cost <= e * optimal, which is reported as the suboptimality bound.
+    Returns: (path_nodes, total_cost, expanded_count, degraded, reason, suboptimality_bound)
+    '''
+    start_time = time.perf_counter()
+    best_path, best_cost, bound = [], math.inf, None
+    expanded = 0
+    for eps in inflation:
+        remaining = deadline_sec - (time.perf_counter() - start_time)
+        if remaining <= 0:
+            break
+        path, cost, count, finished = _weighted_astar(G, source, target, heuristic, weights, eps, remaining, best_cost, stats)
+        expanded += count
+        if not finished:
+            break
+        if path:
+            best_path, best_cost = path, cost
+        elif not best_path:
+            # exhausted the reachable set without pruning anything: unreachable
+            return [], math.inf, expanded, True, "no_path", None
+        # finished: best_cost <= eps * optimal (or nothing beats the incumbent at all)
+        bound = eps if path else 1.0
+        if bound <= 1.0:
+            return best_path, best_cost, expanded, False, "", 1.0
+
+    if not best_path:
+        return [], math.inf, expanded, True, "timeout", None
+    return best_path, best_cost, expanded, True, "timeout", bound
+
+
+def _weighted_astar(G, source, target, heuristic, weights, eps, deadline_sec, incumbent, stats=None):
+    '''
+    A* on f = g + eps * h, pruning anything that cannot beat `incumbent`.
+    Returns: (path_nodes, total_cost, expanded_count, finished)
+    '''
+    start_time = time.perf_counter()
+    offsets, targets = G.offsets, G.targets
+    open_set = [(eps * heuristic(source), 0.0, source)]
+    came_from = {}
+    g_score = {source: 0.0}
+    expanded = pops = relaxed = 0
+
+    while open_set:
+        if time.perf_counter() - start_time > deadline_sec:
+            count_work(stats, pops + len(open_set), relaxed)
+            return [], math.inf, expanded, False
+        _, g_current, current = heapq.heappop(open_set)
+        pops += 1
+        if g_current > g_score[current]:
+            continue
+        expanded += 1
+        if current == target:
+            count_work(stats, pops + len(open_set), relaxed)
+            return reconstruct_path(came_from, current), g_current, expanded, True
+
+        lo, hi = offsets[current], offsets[current + 1]
+        relaxed += hi - lo
+        for neighbor, w in zip(targets[lo:hi].tolist(), weights[lo:hi].tolist()):
+            tentative_g = g_current + w
+            if tentative_g < g_score.get(neighbor, math.inf):
+                h = heuristic(neighbor)
+                if tentative_g + h >= incumbent:
+                    continue
+                came_from[neighbor] = current
+                g_score[neighbor] = tentative_g
+                heapq.heappush(open_set, (tentative_g + eps * h, tentative_g, neighbor))
+
+    count_work(stats, pops, relaxed)
+    return [], math.inf, expanded, True
+
+
+def count_work(stats, pushes, relaxed):
+    '''
+    Add a search's heap pushes (pops + entries left in the heap) and edge relaxations (edges
+    scanned from expanded nodes) to `stats`, when given.
+    '''
+    if stats is not None:
+        stats["heap_pushes"] = stats.get("heap_pushes", 0) + int(pushes)
+        stats["edge_relaxations"] = stats.get("edge_relaxations", 0) + int(relaxed)
+
+
+def _bound(cost, lower):
+    return max(1.0, cost / lower) if lower > 0 else None
+
+
+def dijkstra(G, source, target, weights, deadline_sec=math.inf, stats=None):
+    '''
+    Plain Dijkstra over a CSRGraph (no heuristic), bounded by `deadline_sec`.
+    Returns: (path_nodes, total_cost); ([], inf) when target is unreachable or time runs out.
+    '''
+    start_time = time.perf_counter()
+    offsets, targets = G.offsets, G.targets
+    open_set = [(0.0, source)]
+    came_from = {}
+    dist = {source: 0.0}
+    done = set()
+    pops = relaxed = 0
+
+    while open_set:
+        if time.perf_counter() - start_time > deadline_sec:
+            count_work(stats, pops + len(open_set), relaxed)
+            return [], math.inf
+        d, current = heapq.heappop(open_set)
+        pops += 1
+        if current in done:
+            continue
+        if current == target:
+            count_work(stats, pops + len(open_set), relaxed)
+            return reconstruct_path(came_from, current), d
+        done.add(current)
+
+        lo, hi = offsets[current], offsets[current + 1]
+        relaxed += hi - lo
+        for neighbor, w in zip(targets[lo:hi].tolist(), weights[lo:hi].tolist()):
+            nd = d + w
+            if nd < dist.get(neighbor, math.inf):
+                came_from[neighbor] = current
+                dist[neighbor] = nd
+                heapq.heappush(open_set, (nd, neighbor))
+
+    count_work(stats, pops, relaxed)
+    return [], math.inf
+
+
 def reconstruct_path(came_from, current):
     path = [current]
     while current in came_from:
@@ -0,0 +1,101 @@
+'''
+Admission control for route searches (cache misses only: hits never get here).
+
+Each worker estimates what a search will cost before starting it: an EWMA of the CPU seconds
+per km of straight-line distance that recent searches of the same city and profile took (per
+cell for distance matrices, a separate `kind` of work).
+The estimated work of the searches in flight, divided by how many can progress at once (1
+for in-thread searches, which share the GIL; SEARCH_PROCESSES with the pool), is the wait
+ahead of a new one. Then:
+
+- searches queued ahead and not enough budget left after the wait: rejected (503 with Retry-After), before any work;
+- a backlog ahead: the search budget is cut to the wait plus `headroom` times its estimate,
+  so long searches return early (degraded) instead of holding the CPU for the whole deadline;
+- otherwise admitted with the request's full budget.
+'''
+import math
+import threading
+
+from .executor import Overloaded
+from .metrics import ADMISSIONS, ADMISSION_BACKLOG, SEARCHES_IN_FLIGHT
+
+# routes shorter than this cost about as much as this (snapping, fixed search overheads)
+_MIN_KM = 1.0
+
+
+class Rejected(Overloaded):
+    def __init__(self, message, retry_after_sec):
+        super().__init__(message)
+        self.retry_after_sec = retry_after_sec
+
+
+class Ticket:
+    __slots__ = ("key", "size", "work", "budget_sec")
+
+    def __init__(self, key, size, work, budget_sec):
+        self.key, self.size, self.work, self.budget_sec = key, size, work, budget_sec
+
+
+class AdmissionController:
+    def __init__(self, capacity, min_budget_sec, headroom, alpha=0.2):
+        self.capacity = max(1, capacity)
+        self.min_budget_sec = min_budget_sec
+        self.headroom = headroom
+        self.alpha = alpha
+        self._rate = {}  # (kind, city, pid) -> EWMA of CPU seconds per km (or per matrix cell)
+        self._work = 0.0  # estimated CPU seconds of the searches in flight
+        self._inflight = 0
+        self._lock = threading.Lock()
+
+    def estimate(self, city, pid, size, kind="route"):
+        '''
+        Estimated CPU seconds of a search of `size` (km for routes, cells for matrices); 0 until
+        work of this kind was seen for the city.
+        '''
+        rate = self._rate.get((kind, city, pid))
+        if rate is None:
+            # unseen profile: the city's most expensive one
+            rate = max((r for (k, c, _), r in self._rate.items() if k == kind and c == city), default=0.0)
+        return rate * max(size, _MIN_KM)
+
+    def admit(self, city, pid, size, remaining_sec, kind="route"):
+        '''A Ticket whose `budget_sec` (<= remaining_sec) the search may use; raises Rejected.'''
+        with self._lock:
+            est = self.estimate(city, pid, size, kind)
+            wait = self._work / self.capacity
+            # an idle engine runs a search with whatever budget it has: rejecting it frees nothing
+            if wait > 0 and remaining_sec - wait < self.min_budget_sec:
+                decision = "rejected"
+            else:
+                budget = remaining_sec
+                if wait > 0:
+                    budget = min(remaining_sec, wait + max(self.headroom * est, self.min_budget_sec))
+                decision = "shrunk" if budget < remaining_sec else "admitted"
+                ticket = Ticket((kind, city, pid), size, min(est, budget), budget)
+                self._work += ticket.work
+                self._inflight += 1
+                SEARCHES_IN_FLIGHT.set(self._inflight)
+            ADMISSION_BACKLOG.set(self._work / self.capacity)
+        ADMISSIONS.labels(city=city, decision=decision).inc()
+        if decision == "rejected":
+            raise Rejected(f"~{wait:.1f}s of searches queued ahead, {remaining_sec:.2f}s of budget left",
+                           max(1, math.ceil(wait)))
+        return ticket
+
+    def done(self, ticket, cpu_sec=None, complete=True):
+        '''
+        Release a ticket; `cpu_sec` (the search's CPU time) updates the estimate. The time of a
+        search cut off by its budget (not `complete`) is only a lower bound: it can only raise it.
+        '''
+        with self._lock:
+            self._work = max(0.0, self._work - ticket.work)
+            self._inflight -= 1
+            SEARCHES_IN_FLIGHT.set(self._inflight)
+            ADMISSION_BACKLOG.set(self._work / self.capacity)
+            if cpu_sec is not None:
+                sample = cpu_sec / max(ticket.size, _MIN_KM)
+                rate = self._rate.get(ticket.key)
+                if rate is None:
+                    self._rate[ticket.key] = sample
+                elif complete or sample > rate:
+                    self._rate[ticket.key] = rate + self.alpha * (sample - rate)
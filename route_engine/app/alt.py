@@ -0,0 +1,122 @@
+'''
+ALT (A*, landmarks, triangle inequality) lower bounds.
+
+Offline, a set of landmarks is picked by farthest-point selection and, for every
+constraint profile, single-source distances from and to each landmark are stored in
+the snapshot. Online, for a target t the bound at v is
+
+    max over landmarks L of  d(L, t) - d(L, v)  and  d(v, L) - d(t, L)
+
+which is admissible and consistent for that profile's edge costs.
+'''
+import numpy as np
+from scipy.sparse.csgraph import dijkstra as sp_dijkstra
+
+ALT_PREFIX = "alt."
+# stands in for "unreachable" so bounds stay finite (and still prune correctly)
+UNREACHABLE = np.float32(1e30)
+# float32 tables carry ~6e-8 relative rounding; bounds are lowered by this fraction of
+# the largest finite distance so they never overshoot the true cost
+_ROUNDING_SLACK = 2.5e-7
+
+
+class Landmarks:
+    '''Landmark distance tables, one (n, L) float32 pair per profile.'''
+
+    def __init__(self, nodes, forward, backward):
+        self.nodes = nodes          # int32[L]
+        self.forward = forward      # {pid: float32[n, L]}  d(L, v)
+        self.backward = backward    # {pid: float32[n, L]}  d(v, L)
+        self._slack = {}
+        for pid, table in forward.items():
+            finite = np.concatenate((table[table < UNREACHABLE], backward[pid][backward[pid] < UNREACHABLE]))
+            self._slack[pid] = float(finite.max(initial=0.0)) * _ROUNDING_SLACK
+
+    def to_arrays(self, prefix=ALT_PREFIX):
+        arrays = {f"{prefix}nodes": self.nodes}
+        for pid in self.forward:
+            arrays[f"{prefix}p{pid}.fwd"] = self.forward[pid]
+            arrays[f"{prefix}p{pid}.bwd"] = self.backward[pid]
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix=ALT_PREFIX):
+        if f"{prefix}nodes" not in arrays:
+            return None
+        forward, backward = {}, {}
+        for name, arr in arrays.items():
+            if name.startswith(f"{prefix}p") and name.endswith(".fwd"):
+                pid = int(name[len(prefix) + 1:-len(".fwd")])
+                forward[pid] = arr
+                backward[pid] = arrays[f"{prefix}p{pid}.bwd"]
+        return cls(arrays[f"{prefix}nodes"], forward, backward)
+
+    @property
+    def nbytes(self):
+        return self.nodes.nbytes + sum(t.nbytes for t in self.forward.values()) + \
+            sum(t.nbytes for t in self.backward.values())
+
+    def heuristic(self, pid, target, source=None, active=4):
+        '''
+        Lower bound on the cost from any node to `target` under profile `pid`. With
+        `source`, only the `active` landmarks giving the best bound for the s-t pair are
+        consulted per node, which is much cheaper than scanning all of them.
+        '''
+        return self._bound(self.forward[pid], self.backward[pid], pid, target, source, active)
+
+    def reverse_heuristic(self, pid, source, target=None, active=4):
+        '''Lower bound on the cost from `source` to any node (backward search).'''
+        # d(s, v) on G is d(v, s) on the reversed graph, whose tables are swapped
+        return self._bound(self.backward[pid], self.forward[pid], pid, source, target, active)
+
+    def _bound(self, fwd, bwd, pid, target, source, active):
+        ft = fwd[target].astype(np.float64)
+        bt = bwd[target].astype(np.float64)
+        cols = slice(None)
+        if source is not None and active < len(self.nodes):
+            gain = np.maximum(ft - fwd[source], bwd[source] - bt)
+            cols = np.sort(np.argsort(-gain)[:active])
+            ft, bt = ft[cols], bt[cols]
+        slack = self._slack[pid]
+
+        def h(node):
+            bound = max(float((ft - fwd[node, cols]).max()), float((bwd[node, cols] - bt).max()))
+            return bound - slack if bound > slack else 0.0
+        return h
+
+
+def select_landmarks(G, weights, count=16, seed=0):
+    '''
+    Farthest-point landmark selection on the symmetrised graph: each new landmark is the
+    reachable node farthest from all previous ones, which spreads them over the border.
+    '''
+    m = G.csr_matrix(weights)
+    m = m.maximum(m.T).tocsr()
+    rng = np.random.default_rng(seed)
+    start = int(rng.integers(G.num_nodes))
+    d = sp_dijkstra(m, directed=False, indices=start)
+    reach = np.isfinite(d)
+    nearest = np.where(reach, np.inf, -np.inf)
+    chosen = []
+    current = int(np.argmax(np.where(reach, d, -1.0)))
+    for _ in range(min(count, int(reach.sum()))):
+        chosen.append(current)
+        d = sp_dijkstra(m, directed=False, indices=current)
+        nearest = np.minimum(nearest, d)
+        current = int(np.argmax(np.where(reach, nearest, -1.0)))
+    return np.asarray(chosen, dtype=np.int32)
+
+
+def build_landmarks(G, profile_weights, count=16, log=None):
+    '''Landmark tables for every profile; `profile_weights` maps pid -> edge costs.'''
+    nodes = select_landmarks(G, profile_weights[0], count)
+    forward, backward = {}, {}
+    for pid, weights in profile_weights.items():
+        m = G.csr_matrix(weights)
+        fwd = sp_dijkstra(m, directed=True, indices=nodes)                 # d(L, v)
+        bwd = sp_dijkstra(m.T.tocsr(), directed=True, indices=nodes)       # d(v, L)
+        forward[pid] = np.ascontiguousarray(np.minimum(fwd, UNREACHABLE).T, dtype=np.float32)
+        backward[pid] = np.ascontiguousarray(np.minimum(bwd, UNREACHABLE).T, dtype=np.float32)
+        if log:
+            log(f"[alt] profile {pid}: {len(nodes)} landmarks")
+    return Landmarks(nodes, forward, backward)
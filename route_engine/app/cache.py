@@ -1,22 +1,209 @@
-import json
-import hashlib
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
 from redis import Redis
 
+from .metrics import CACHE_LOOKUPS, CACHE_LATENCY, CACHE_REFRESHES, COALESCED, phase_timer
+
+# value: format byte, cost (float64), expanded (uint32), then the node index path as int32
+# (_FORMAT) or, for paths with values beyond int32 such as tiled cities' osmids, int64
+_VALUE = struct.Struct("<BdI")
+_FORMAT = 1
+_FORMAT_WIDE = 2
+_INT32 = np.iinfo(np.int32)
+
+
+class LocalLRU:
+    '''Bounded per-process LRU with a TTL; safe for the gthread workers' threads.'''
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return item[1]
+
+    def set(self, key, value):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+
 class Cache:
-    def __init__(self, host, port, db=0):
+    '''
+    Two-tier route cache: a per-worker LocalLRU in front of Redis.
+
+    Entries are keyed on the snapped (source, target) node indices, the constraint profile
+    and the graph version, so nearby requests share them and a graph reload never serves
+    stale node indices. Values are (node index path, cost, expanded); the response
+    (osmids, geometry) is rebuilt from the in-memory graph. Tiled cities store their paths
+    as flattened (osmid, tile) pairs instead.
+
+    With `refresh_ahead_sec`, a Redis hit on an entry expiring within that time resets its TTL
+    to `ttl`: a cached route is exact for its graph version, so hot entries need no recompute
+    to stay.
+    '''
+
+    def __init__(self, host, port, db=0, local_size=4096, local_ttl=300, lease_ms=2000, poll_ms=20,
+                 ttl=3600, refresh_ahead_sec=0):
         self.r = Redis(host=host, port=port, db=db)
+        self.local = LocalLRU(local_size, local_ttl)
+        self.ttl = ttl
+        self.refresh_ahead_ms = refresh_ahead_sec * 1000
+        self.lease_ms = lease_ms
+        self.poll_ms = poll_ms
+        self._flights = {}  # key -> _Flight
+        self._flights_lock = threading.Lock()
 
-    def _key(self, city, src, dst, constraints):
-        payload = json.dumps({"city": city, "src": src, "dst": dst, "c": constraints}, sort_keys=True)
-        return "route:" + hashlib.sha256(payload.encode()).hexdigest()
+    def _key(self, city, version, source, target, pid):
+        return f"route:{city}:{version}:{pid}:{source}:{target}"
 
-    def get(self, city, src, dst, constraints):
-        key = self._key(city, src, dst, constraints)
-        raw = self.r.get(key)
-        if raw:
-            return json.loads(raw)
-        return None
+    def get(self, city, version, source, target, pid):
+        '''(path int32[] or int64[], cost, expanded, tier) or None.'''
+        key = self._key(city, version, source, target, pid)
+        t0 = time.perf_counter()
+        hit = self.local.get(key)
+        CACHE_LATENCY.labels(tier="local").observe(time.perf_counter() - t0)
+        CACHE_LOOKUPS.labels(tier="local", result="hit" if hit else "miss").inc()
+        if hit:
+            return (*hit, "local")
+
+        t0 = time.perf_counter()
+        if self.refresh_ahead_ms > 0:
+            # TTL in the same round trip
+            raw, ttl_ms = self.r.pipeline(transaction=False).get(key).pttl(key).execute()
+        else:
+            raw, ttl_ms = self.r.get(key), -1
+        CACHE_LATENCY.labels(tier="redis").observe(time.perf_counter() - t0)
+        CACHE_LOOKUPS.labels(tier="redis", result="hit" if raw else "miss").inc()
+        value = decode(raw) if raw else None
+        if value is None:
+            return None
+        if 0 <= ttl_ms < self.refresh_ahead_ms:
+            self.r.pexpire(key, self.ttl * 1000)
+            CACHE_REFRESHES.labels(kind="ahead").inc()
+        self.local.set(key, value)
+        return (*value, "redis")
+
+    def touch(self, city, version, source, target, pid, ttl=3600):
+        '''Reset the TTL of a cached route to `ttl`; False when it is not cached.'''
+        return bool(self.r.expire(self._key(city, version, source, target, pid), ttl))
 
-    def set(self, city, src, dst, constraints, value, ttl=3600):
-        key = self._key(city, src, dst, constraints)
-        self.r.setex(key, ttl, json.dumps(value))
+    def set(self, city, version, source, target, pid, path, cost, expanded, ttl=3600):
+        key = self._key(city, version, source, target, pid)
+        value = (path_array(path), float(cost), int(expanded))
+        self.local.set(key, value)
+        self.r.setex(key, ttl, encode(*value))
+
+
+    def get_or_compute(self, city, version, source, target, pid, compute, wait_sec, ttl=3600):
+        '''
+        Single-flight lookup. On a miss exactly one thread per worker computes; across
+        workers and containers a short Redis lease elects one computer while the others
+        poll the cache. Waiting is bounded by `wait_sec`, after which a waiter computes
+        itself. `compute()` returns (path, cost, expanded, degraded, reason, bound); only
+        non-degraded results are stored.
+        Returns: (result, tier) with tier "local", "redis", "coalesced" or "miss".
+        '''
+        with phase_timer("cache_get", city, pid):
+            cached = self.get(city, version, source, target, pid)
+        if cached:
+            path, cost, expanded, tier = cached
+            return (path, cost, expanded, False, "", 1.0), tier
+
+        key = self._key(city, version, source, target, pid)
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            if flight.done.wait(wait_sec) and flight.result is not None:
+                COALESCED.labels(kind="local").inc()
+                return flight.result, "coalesced"
+            return compute(), "miss"
+
+        try:
+            result, tier = self._lease_or_compute(key, city, version, source, target, pid, compute, wait_sec, ttl)
+            flight.result = result
+            return result, tier
+        finally:
+            with self._flights_lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _lease_or_compute(self, key, city, version, source, target, pid, compute, wait_sec, ttl):
+        lease = "lease:" + key
+        token = os.urandom(8)
+        if not self.r.set(lease, token, nx=True, px=self.lease_ms):
+            # another engine is computing this route: poll for its result
+            deadline = time.monotonic() + wait_sec
+            while time.monotonic() < deadline:
+                time.sleep(self.poll_ms / 1000.0)
+                raw = self.r.get(key)
+                value = decode(raw) if raw else None
+                if value is not None:
+                    COALESCED.labels(kind="lease").inc()
+                    self.local.set(key, value)
+                    path, cost, expanded = value
+                    return (path, cost, expanded, False, "", 1.0), "coalesced"
+            COALESCED.labels(kind="lease_timeout").inc()
+            token = None
+        try:
+            result = compute()
+            path, cost, expanded, degraded = result[:4]
+            if path and not degraded:
+                with phase_timer("cache_set", city, pid):
+                    self.set(city, version, source, target, pid, path, cost, expanded, ttl=ttl)
+            return result, "miss"
+        finally:
+            if token is not None and self.r.get(lease) == token:
+                self.r.delete(lease)
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+def path_array(path):
+    '''`path` as int32, or int64 when its values do not fit.'''
+    path = np.asarray(path, dtype=np.int64)
+    if len(path) and (path.min() < _INT32.min or path.max() > _INT32.max):
+        return path
+    return path.astype(np.int32)
+
+
+def encode(path, cost, expanded):
+    path = path_array(path)
+    if path.dtype == np.int64:
+        return _VALUE.pack(_FORMAT_WIDE, cost, expanded) + path.astype("<i8").tobytes()
+    return _VALUE.pack(_FORMAT, cost, expanded) + path.astype("<i4").tobytes()
+
+
+def decode(raw):
+    '''(path, cost, expanded), or None for a value in another format.'''
+    fmt, cost, expanded = _VALUE.unpack_from(raw)
+    if fmt not in (_FORMAT, _FORMAT_WIDE):
+        return None
+    path = np.frombuffer(raw, dtype="<i4" if fmt == _FORMAT else "<i8", offset=_VALUE.size)
+    return path, cost, expanded
@@ -0,0 +1,272 @@
+'''
+Customizable Contraction Hierarchies.
+
+Metric-independent phase (offline, stored in the snapshot): a nested-dissection node
+order from recursive geometric bisection, and the chordal supergraph obtained by
+contracting nodes in that order without witness searches.
+
+Customization (per profile, at load): seed every hierarchy edge with the cheapest
+original edge in each direction, then relax lower triangles bottom-up. Triangles are
+processed in batches by elimination-tree level, so each batch is a handful of
+vectorized NumPy operations. Queries walk elimination-tree ancestors rather than
+running a priority queue, and share the CH shortcut unpacking.
+'''
+import math
+import time
+
+import numpy as np
+
+from .ch import ContractionHierarchy
+from .spatial import SpatialIndex
+
+CCH_ARRAYS = ("rank", "offsets", "heads", "level")
+CCH_PREFIX = "cch."
+
+
+class CCHTopology:
+    '''
+    Chordal upward graph: the hierarchy edges {v, u} with rank[v] < rank[u] are stored
+    at v (`offsets`/`heads`, each slice sorted by rank of head). `level[v]` is the
+    height of v in the elimination tree.
+    '''
+
+    def __init__(self, rank, offsets, heads, level):
+        self.rank = rank
+        self.offsets = offsets
+        self.heads = heads
+        self.level = level
+        n = len(rank)
+        tails = np.repeat(np.arange(n, dtype=np.int64), np.diff(offsets))
+        keys = tails * n + heads
+        self._tails = tails
+        self._key_order = np.argsort(keys, kind="stable")
+        self._sorted_keys = keys[self._key_order]
+        self._by_level = np.argsort(level, kind="stable")
+        self._level_bounds = np.searchsorted(level[self._by_level], np.arange(int(level.max(initial=0)) + 2))
+
+    def to_arrays(self, prefix=CCH_PREFIX):
+        return {f"{prefix}{name}": getattr(self, name) for name in CCH_ARRAYS}
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix=CCH_PREFIX):
+        if f"{prefix}rank" not in arrays:
+            return None
+        return cls(*(arrays[f"{prefix}{name}"] for name in CCH_ARRAYS))
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in CCH_ARRAYS) + \
+            self._tails.nbytes + self._key_order.nbytes + self._sorted_keys.nbytes
+
+    def edge_id(self, lower, higher):
+        '''Hierarchy edge index of {lower, higher} (rank[lower] < rank[higher]).'''
+        n = len(self.rank)
+        keys = np.asarray(lower, dtype=np.int64) * n + np.asarray(higher, dtype=np.int64)
+        return self._key_order[np.searchsorted(self._sorted_keys, keys)]
+
+    def customize(self, G, weights):
+        '''Customize for per-edge `weights` of G -> ContractionHierarchy.'''
+        m = len(self.heads)
+        fw = np.full(m, np.inf)   # tail -> head
+        bw = np.full(m, np.inf)   # head -> tail
+        fw_mid = np.full(m, -1, dtype=np.int32)
+        bw_mid = np.full(m, -1, dtype=np.int32)
+
+        a = G.edge_sources().astype(np.int64)
+        b = G.targets.astype(np.int64)
+        w = np.asarray(weights, dtype=np.float64)
+        keep = a != b
+        a, b, w = a[keep], b[keep], w[keep]
+        up = self.rank[a] < self.rank[b]
+        e = self.edge_id(np.where(up, a, b), np.where(up, b, a))
+        np.minimum.at(fw, e[up], w[up])
+        np.minimum.at(bw, e[~up], w[~up])
+
+        offsets = self.offsets
+        for lvl in range(len(self._level_bounds) - 1):
+            nodes = self._by_level[self._level_bounds[lvl]:self._level_bounds[lvl + 1]]
+            starts = offsets[nodes]
+            degs = offsets[nodes + 1] - starts
+            e1, e2, v = _slice_pairs(starts, degs, nodes)
+            e_uw = self.edge_id(self.heads[e1], self.heads[e2])
+            # u -> v -> w and w -> v -> u through the lower vertex v
+            _relax(fw, fw_mid, e_uw, bw[e1] + fw[e2], v)
+            _relax(bw, bw_mid, e_uw, bw[e2] + fw[e1], v)
+
+        heads = self.heads
+        return CustomizedHierarchy(self.rank, offsets, heads, fw, fw_mid,
+                                   offsets, heads, bw, bw_mid)
+
+
+class CustomizedHierarchy(ContractionHierarchy):
+    '''
+    A customized CCH. Up and down graphs share one topology, and every upper neighbour
+    of a node is one of its elimination-tree ancestors (the parent being the lowest),
+    so a query just scans the two ancestor chains.
+    '''
+
+    def query(self, source, target, deadline_sec=math.inf):
+        '''
+        Elimination-tree query with a time budget.
+        Returns: (path_nodes, total_cost, scanned_count, degraded, reason)
+        '''
+        start_time = time.perf_counter()
+        n = len(self.rank)
+        offsets, heads = self.up_offsets, self.up_targets
+        dist = (np.full(n, np.inf), np.full(n, np.inf))
+        parent = (np.full(n, -1, dtype=np.int64), np.full(n, -1, dtype=np.int64))
+        chain = []
+        scanned = 0
+        for side, root, weights in ((0, source, self.up_weights), (1, target, self.down_weights)):
+            d, par = dist[side], parent[side]
+            d[root] = 0.0
+            v = root
+            while v >= 0:
+                if time.perf_counter() - start_time > deadline_sec:
+                    return [], math.inf, scanned, True, "timeout"
+                scanned += 1
+                if side == 0:
+                    chain.append(v)
+                lo, hi = offsets[v], offsets[v + 1]
+                if lo == hi:
+                    break
+                if d[v] < math.inf:
+                    tgt = heads[lo:hi]
+                    cand = d[v] + weights[lo:hi]
+                    better = cand < d[tgt]
+                    d[tgt[better]] = cand[better]
+                    par[tgt[better]] = v
+                v = int(heads[lo])
+
+        chain = np.asarray(chain, dtype=np.int64)
+        total = dist[0][chain] + dist[1][chain]
+        i = int(np.argmin(total))
+        if not total[i] < math.inf:
+            return [], math.inf, scanned, True, "no_path"
+        meet = int(chain[i])
+
+        nodes = [meet]
+        while parent[0][nodes[-1]] >= 0:
+            nodes.append(int(parent[0][nodes[-1]]))
+        nodes.reverse()
+        while parent[1][nodes[-1]] >= 0:
+            nodes.append(int(parent[1][nodes[-1]]))
+
+        path = [nodes[0]]
+        for a, b in zip(nodes[:-1], nodes[1:]):
+            path.extend(self._unpack(a, b)[1:])
+        return path, float(total[i]), scanned, False, ""
+
+
+def _slice_pairs(starts, degs, nodes):
+    '''All index pairs (i < j) inside each CSR slice, plus the slice owner.'''
+    later = np.repeat(degs - 1, degs) - _ranges(degs)        # partners after each entry
+    first = np.repeat(starts, degs) + _ranges(degs)
+    e1 = np.repeat(first, later)
+    e2 = e1 + 1 + _ranges(later)
+    owner = np.repeat(np.repeat(nodes, degs), later)
+    return e1, e2, owner
+
+
+def _ranges(counts):
+    '''Concatenation of arange(c) for c in counts.'''
+    counts = np.asarray(counts, dtype=np.int64)
+    total = int(counts.sum())
+    starts = np.cumsum(counts) - counts
+    return np.arange(total, dtype=np.int64) - np.repeat(starts, counts)
+
+
+def _relax(dist, mid, edges, cand, via):
+    before = dist[edges]
+    np.minimum.at(dist, edges, cand)
+    won = (cand < before) & (cand == dist[edges])
+    mid[edges[won]] = via[won]
+
+
+def nested_dissection_order(G, leaf_size=32):
+    '''
+    Node order (rank per node) from recursive geometric bisection: split each part at
+    the median of its wider axis, take the smaller boundary as separator and rank the
+    separator above both halves.
+    '''
+    n = G.num_nodes
+    xy = SpatialIndex(G).xy
+    src = G.edge_sources().astype(np.int64)
+    dst = G.targets.astype(np.int64)
+    keep = src != dst
+    lo, hi = np.minimum(src[keep], dst[keep]), np.maximum(src[keep], dst[keep])
+    pairs = np.unique(lo * n + hi)
+    eu, ev = pairs // n, pairs % n
+
+    side = np.zeros(n, dtype=np.int8)
+    order = []
+    stack = [(np.arange(n, dtype=np.int64), eu, ev, False)]
+    # explicit stack: (nodes, edge ends, emit) - emit=True entries are separators that
+    # must come after everything pushed above them
+    while stack:
+        nodes, a, b, emit = stack.pop()
+        if emit or len(nodes) <= leaf_size:
+            order.append(nodes)
+            continue
+        pts = xy[nodes]
+        axis = int(np.argmax(pts.max(axis=0) - pts.min(axis=0)))
+        by_axis = np.argsort(pts[:, axis], kind="stable")
+        half = len(nodes) // 2
+        side[nodes[by_axis[:half]]] = 0
+        side[nodes[by_axis[half:]]] = 1
+
+        cross = side[a] != side[b]
+        ca, cb = a[cross], b[cross]
+        left = np.unique(np.where(side[ca] == 0, ca, cb))
+        right = np.unique(np.where(side[ca] == 1, ca, cb))
+        sep = left if len(left) <= len(right) else right
+
+        in_sep = np.zeros(n, dtype=bool)
+        in_sep[sep] = True
+        rest = ~cross & ~in_sep[a] & ~in_sep[b]
+        a, b = a[rest], b[rest]
+        parts = []
+        for s in (0, 1):
+            part = nodes[(side[nodes] == s) & ~in_sep[nodes]]
+            mask = side[a] == s
+            parts.append((part, a[mask], b[mask], False))
+        # popped in reverse: part 0, part 1, then the separator on top of both
+        stack.append((sep, None, None, True))
+        stack.append(parts[1])
+        stack.append(parts[0])
+
+    flat = np.concatenate(order) if order else np.zeros(0, dtype=np.int64)
+    rank = np.empty(n, dtype=np.int32)
+    rank[flat] = np.arange(n, dtype=np.int32)
+    return rank, eu, ev
+
+
+def build_cch(G, leaf_size=32, log=None):
+    '''Metric-independent CCH preprocessing (offline) -> CCHTopology.'''
+    n = G.num_nodes
+    rank, eu, ev = nested_dissection_order(G, leaf_size)
+    rank_l = rank.tolist()
+    upper = [set() for _ in range(n)]
+    for a, b in zip(eu.tolist(), ev.tolist()):
+        if rank_l[a] < rank_l[b]:
+            upper[a].add(b)
+        else:
+            upper[b].add(a)
+
+    # contract in rank order without witness search: upper neighbours become a clique
+    level = [0] * n
+    order = np.argsort(rank).tolist()
+    for i, v in enumerate(order):
+        nbrs = sorted(upper[v], key=rank_l.__getitem__)
+        upper[v] = nbrs
+        for j, u in enumerate(nbrs):
+            upper[u].update(nbrs[j + 1:])
+            if level[u] <= level[v]:
+                level[u] = level[v] + 1
+        if log and (i + 1) % 20000 == 0:
+            log(f"[cch] contracted {i + 1}/{n} nodes")
+
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum([len(u) for u in upper], out=offsets[1:])
+    heads = np.fromiter((u for nbrs in upper for u in nbrs), dtype=np.int32, count=int(offsets[-1]))
+    return CCHTopology(rank, offsets, heads, np.asarray(level, dtype=np.int32))
@@ -0,0 +1,263 @@
+'''
+Contraction Hierarchies over a CSRGraph.
+
+`build_ch` is the offline step: it contracts nodes in edge-difference order, adding
+shortcut edges where no witness path exists, and returns a ContractionHierarchy whose
+arrays are stored in the city snapshot. `ContractionHierarchy.query` is the online
+bidirectional upward search, with stall-on-demand and shortcut unpacking back to the
+original node sequence.
+'''
+import heapq
+import math
+import time
+
+import numpy as np
+
+CH_ARRAYS = ("rank", "up_offsets", "up_targets", "up_weights", "up_mid",
+             "down_offsets", "down_sources", "down_weights", "down_mid")
+
+
+class ContractionHierarchy:
+    '''
+    Upward graphs of a contraction hierarchy, in CSR form.
+
+    `up_*`:   edges v -> x with rank[x] > rank[v], stored at v (forward search).
+    `down_*`: edges u -> v with rank[u] > rank[v], stored at v (backward search).
+    `*_mid` is the contracted middle node of a shortcut, or -1 for an original edge.
+    '''
+
+    def __init__(self, rank, up_offsets, up_targets, up_weights, up_mid,
+                 down_offsets, down_sources, down_weights, down_mid):
+        self.rank = rank
+        self.up_offsets = up_offsets
+        self.up_targets = up_targets
+        self.up_weights = up_weights
+        self.up_mid = up_mid
+        self.down_offsets = down_offsets
+        self.down_sources = down_sources
+        self.down_weights = down_weights
+        self.down_mid = down_mid
+
+    def to_arrays(self, prefix):
+        return {f"{prefix}{name}": getattr(self, name) for name in CH_ARRAYS}
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        '''Rebuild from snapshot arrays; None when the snapshot carries no such CH.'''
+        if f"{prefix}rank" not in arrays:
+            return None
+        return cls(*(arrays[f"{prefix}{name}"] for name in CH_ARRAYS))
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in CH_ARRAYS)
+
+    def query(self, source, target, deadline_sec=math.inf):
+        '''
+        Bidirectional upward Dijkstra with a time budget.
+        Returns: (path_nodes, total_cost, settled_count, degraded, reason)
+        '''
+        start_time = time.perf_counter()
+        up_off, up_tgt, up_w = self.up_offsets, self.up_targets, self.up_weights
+        dn_off, dn_src, dn_w = self.down_offsets, self.down_sources, self.down_weights
+
+        dist = ({source: 0.0}, {target: 0.0})
+        parent = ({}, {})
+        heaps = ([(0.0, source)], [(0.0, target)])
+        best, meet = math.inf, -1
+        settled = 0
+
+        while True:
+            fwd_open = heaps[0] and heaps[0][0][0] < best
+            bwd_open = heaps[1] and heaps[1][0][0] < best
+            if not (fwd_open or bwd_open):
+                break
+            if time.perf_counter() - start_time > deadline_sec:
+                return [], math.inf, settled, True, "timeout"
+
+            side = 0 if fwd_open and (not bwd_open or heaps[0][0][0] <= heaps[1][0][0]) else 1
+            d, v = heapq.heappop(heaps[side])
+            own, other = dist[side], dist[1 - side]
+            if d > own[v]:
+                continue
+            settled += 1
+
+            if v in other and d + other[v] < best:
+                best, meet = d + other[v], v
+
+            # forward search relaxes up edges and is stalled through down edges, and
+            # the backward search the other way round
+            if side == 0:
+                rel_off, rel_nbr, rel_w = up_off, up_tgt, up_w
+                st_off, st_nbr, st_w = dn_off, dn_src, dn_w
+            else:
+                rel_off, rel_nbr, rel_w = dn_off, dn_src, dn_w
+                st_off, st_nbr, st_w = up_off, up_tgt, up_w
+
+            lo, hi = st_off[v], st_off[v + 1]
+            stalled = False
+            for u, w in zip(st_nbr[lo:hi].tolist(), st_w[lo:hi].tolist()):
+                du = own.get(u)
+                if du is not None and du + w < d:
+                    stalled = True
+                    break
+            if stalled:
+                continue
+
+            lo, hi = rel_off[v], rel_off[v + 1]
+            par = parent[side]
+            heap = heaps[side]
+            for x, w in zip(rel_nbr[lo:hi].tolist(), rel_w[lo:hi].tolist()):
+                nd = d + w
+                if nd < own.get(x, math.inf):
+                    own[x] = nd
+                    par[x] = v
+                    heapq.heappush(heap, (nd, x))
+
+        if meet < 0:
+            return [], math.inf, settled, True, "no_path"
+
+        chain = [meet]
+        while chain[-1] in parent[0]:
+            chain.append(parent[0][chain[-1]])
+        chain.reverse()
+        while chain[-1] in parent[1]:
+            chain.append(parent[1][chain[-1]])
+
+        path = [chain[0]]
+        for a, b in zip(chain[:-1], chain[1:]):
+            path.extend(self._unpack(a, b)[1:])
+        return path, best, settled, False, ""
+
+    def _middle(self, a, b):
+        '''Middle node of the hierarchy edge a -> b (-1 for an original edge).'''
+        if self.rank[a] < self.rank[b]:
+            lo, hi = self.up_offsets[a], self.up_offsets[a + 1]
+            hit = np.nonzero(self.up_targets[lo:hi] == b)[0]
+            return int(self.up_mid[lo + hit[0]])
+        lo, hi = self.down_offsets[b], self.down_offsets[b + 1]
+        hit = np.nonzero(self.down_sources[lo:hi] == a)[0]
+        return int(self.down_mid[lo + hit[0]])
+
+    def _unpack(self, a, b):
+        out = [a]
+        stack = [(a, b)]
+        while stack:
+            x, y = stack.pop()
+            mid = self._middle(x, y)
+            if mid < 0:
+                out.append(y)
+            else:
+                stack.append((mid, y))
+                stack.append((x, mid))
+        return out
+
+
+def _witness_dists(out_adj, source, skip, targets, max_cost, max_settled):
+    dist = {source: 0.0}
+    heap = [(0.0, source)]
+    pending = set(targets)
+    settled = 0
+    while heap and pending:
+        d, v = heapq.heappop(heap)
+        if d > dist[v]:
+            continue
+        if d > max_cost or settled >= max_settled:
+            break
+        settled += 1
+        pending.discard(v)
+        for x, (w, _) in out_adj[v].items():
+            if x == skip:
+                continue
+            nd = d + w
+            if nd < dist.get(x, math.inf):
+                dist[x] = nd
+                heapq.heappush(heap, (nd, x))
+    return dist
+
+
+def _shortcuts(out_adj, in_adj, v, max_settled):
+    '''Shortcuts (u, x, cost) needed to contract v, found with bounded witness searches.'''
+    found = []
+    outs = out_adj[v]
+    for u, (wu, _) in in_adj[v].items():
+        targets = [(x, wu + wx) for x, (wx, _) in outs.items() if x != u]
+        if not targets:
+            continue
+        dist = _witness_dists(out_adj, u, v, [x for x, _ in targets],
+                              max(c for _, c in targets), max_settled)
+        for x, c in targets:
+            if dist.get(x, math.inf) > c:
+                found.append((u, x, c))
+    return found
+
+
+def build_ch(G, weights, max_settled=500, log=None):
+    '''
+    Contract every node of G under the per-edge `weights` (offline, pure Python).
+    A bounded witness search can only add superfluous shortcuts, never drop needed ones,
+    so queries stay exact.
+    '''
+    n = G.num_nodes
+    out_adj = [dict() for _ in range(n)]
+    in_adj = [dict() for _ in range(n)]
+    src = G.edge_sources().tolist()
+    for u, v, w in zip(src, G.targets.tolist(), np.asarray(weights, dtype=np.float64).tolist()):
+        if u != v and w < out_adj[u].get(v, (math.inf,))[0]:
+            out_adj[u][v] = (w, -1)
+            in_adj[v][u] = (w, -1)
+
+    deleted = [0] * n
+
+    def priority(v, shortcuts):
+        # edge difference, weighted up, plus contracted neighbours to spread contraction out
+        edge_diff = len(shortcuts) - len(out_adj[v]) - len(in_adj[v])
+        return 2 * edge_diff + deleted[v]
+
+    heap = [(priority(v, _shortcuts(out_adj, in_adj, v, max_settled)), v) for v in range(n)]
+    heapq.heapify(heap)
+    rank = np.zeros(n, dtype=np.int32)
+    up = [None] * n
+    down = [None] * n
+    order = 0
+    t0 = time.perf_counter()
+
+    while heap:
+        _, v = heapq.heappop(heap)
+        # lazy update: re-evaluate, and put back if it is no longer the minimum
+        shortcuts = _shortcuts(out_adj, in_adj, v, max_settled)
+        p = priority(v, shortcuts)
+        if heap and p > heap[0][0]:
+            heapq.heappush(heap, (p, v))
+            continue
+
+        for u, x, c in shortcuts:
+            if c < out_adj[u].get(x, (math.inf,))[0]:
+                out_adj[u][x] = (c, v)
+                in_adj[x][u] = (c, v)
+
+        up[v] = [(x, w, mid) for x, (w, mid) in out_adj[v].items()]
+        down[v] = [(u, w, mid) for u, (w, mid) in in_adj[v].items()]
+        for x in out_adj[v]:
+            del in_adj[x][v]
+            deleted[x] += 1
+        for u in in_adj[v]:
+            del out_adj[u][v]
+            deleted[u] += 1
+        out_adj[v] = {}
+        in_adj[v] = {}
+        rank[v] = order
+        order += 1
+        if log and order % 10000 == 0:
+            log(f"[ch] contracted {order}/{n} nodes in {time.perf_counter() - t0:.1f}s")
+
+    def to_csr(lists):
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum([len(l) for l in lists], out=offsets[1:])
+        flat = [e for l in lists for e in l]
+        nbr = np.array([e[0] for e in flat], dtype=np.int32)
+        w = np.array([e[1] for e in flat], dtype=np.float64)
+        mid = np.array([e[2] for e in flat], dtype=np.int32)
+        return offsets, nbr, w, mid
+
+    return ContractionHierarchy(rank, *to_csr(up), *to_csr(down))
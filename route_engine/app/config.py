@@ -11,5 +11,91 @@ class Config:
     REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
     REDIS_DB = int(os.getenv("REDIS_DB", "0"))
 
+    CACHE_TTL = int(os.getenv("CACHE_TTL", "3600"))
+    # per-worker in-process tier in front of Redis (entries, seconds; size 0 disables it)
+    CACHE_LOCAL_SIZE = int(os.getenv("CACHE_LOCAL_SIZE", "4096"))
+    CACHE_LOCAL_TTL = int(os.getenv("CACHE_LOCAL_TTL", "300"))
+    # request coalescing: Redis lease held by the engine computing a route, and how long
+    # others wait for its result before computing themselves (capped at half the budget)
+    COALESCE_LEASE_MS = int(os.getenv("COALESCE_LEASE_MS", "3000"))
+    COALESCE_WAIT_MS = int(os.getenv("COALESCE_WAIT_MS", "1000"))
+    # a Redis hit on a route expiring within this many seconds gets a fresh CACHE_TTL (0 = off)
+    CACHE_REFRESH_AHEAD_SEC = int(os.getenv("CACHE_REFRESH_AHEAD_SEC", "600"))
+
+    # sampled JSONL log of served routes, one rotating file per worker ("" = off)
+    REQUEST_LOG_DIR = os.getenv("REQUEST_LOG_DIR", "")
+    REQUEST_LOG_SAMPLE = float(os.getenv("REQUEST_LOG_SAMPLE", "0.1"))
+    REQUEST_LOG_MAX_MB = int(os.getenv("REQUEST_LOG_MAX_MB", "64"))
+    REQUEST_LOG_BACKUPS = int(os.getenv("REQUEST_LOG_BACKUPS", "3"))
+    # cache pre-warm from the request log: in each of these UTC hours (comma-separated, "" = never)
+    # one engine recomputes or refreshes the PREWARM_TOP_K most requested pairs per city and
+    # profile seen in the last PREWARM_LOOKBACK_HOURS, for at most PREWARM_BUDGET_SEC
+    PREWARM_HOURS = [int(h) for h in os.getenv("PREWARM_HOURS", "").split(",") if h.strip()]
+    PREWARM_TOP_K = int(os.getenv("PREWARM_TOP_K", "500"))
+    PREWARM_LOOKBACK_HOURS = int(os.getenv("PREWARM_LOOKBACK_HOURS", "168"))
+    PREWARM_BUDGET_SEC = int(os.getenv("PREWARM_BUDGET_SEC", "900"))
+
     DEFAULT_CITY = os.getenv("DEFAULT_CITY", "bogota")
+    # comma-separated cities every worker loads and warms up at boot ("" = load on first request)
+    PRELOAD_CITIES = [c.strip().lower() for c in os.getenv("PRELOAD_CITIES", "").split(",") if c.strip()]
+    # how long a request waits for another thread's load of its city before a 503
+    CITY_LOAD_WAIT_MS = int(os.getenv("CITY_LOAD_WAIT_MS", "2000"))
+    # estimated memory of loaded cities per worker; least recently used cities are evicted
+    # beyond it (0 = unlimited)
+    CITY_MEMORY_BUDGET_MB = int(os.getenv("CITY_MEMORY_BUDGET_MB", "0"))
+    # comma-separated cities loaded tile by tile around each request instead of as one graph
+    # (ingested with TILE_DEG); their tile LRU per worker and the corridor margin
+    TILED_CITIES = [c.strip().lower() for c in os.getenv("TILED_CITIES", "").split(",") if c.strip()]
+    TILE_CACHE_MB = int(os.getenv("TILE_CACHE_MB", "1024"))
+    TILE_MARGIN_KM = float(os.getenv("TILE_MARGIN_KM", "2"))
+    # city sharding (app/sharding.py): this engine as nginx reaches it ("host:port"), every engine
+    # of the ring ("" = no sharding: each engine serves every city) and the owners per city,
+    # with overrides for hot cities ("bogota=2,medellin=2")
+    ENGINE_ID = os.getenv("ENGINE_ID", "")
+    SHARD_ENGINES = [e.strip() for e in os.getenv("SHARD_ENGINES", "").split(",") if e.strip()]
+    SHARD_REPLICAS = int(os.getenv("SHARD_REPLICAS", "1"))
+    CITY_REPLICAS = {c.strip().lower(): int(n) for c, n in
+                     (item.split("=", 1) for item in os.getenv("CITY_REPLICAS", "").split(",") if item.strip())}
     ROUTE_DEADLINE_MS = int(os.getenv("ROUTE_DEADLINE_MS", "3000"))
+    # the proxy in front gives up after this (nginx proxy_read_timeout 5s): no request budget
+    # reaches past it
+    UPSTREAM_TIMEOUT_MS = int(os.getenv("UPSTREAM_TIMEOUT_MS", "4500"))
+
+    # admission control of searches (cache misses): reject (503) when less than
+    # ADMISSION_MIN_BUDGET_MS would be left after the estimated wait, and under a backlog cut
+    # a search's budget to the wait plus ADMISSION_HEADROOM times its estimated cost
+    ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "1") == "1"
+    ADMISSION_MIN_BUDGET_MS = int(os.getenv("ADMISSION_MIN_BUDGET_MS", "150"))
+    ADMISSION_HEADROOM = float(os.getenv("ADMISSION_HEADROOM", "3"))
+
+    # Directory of mmap-able city graph snapshots shared by all workers ("" = load from Postgres)
+    SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "")
+    SNAPSHOT_VERIFY = os.getenv("SNAPSHOT_VERIFY", "1") == "1"
+
+    # "node": snap to the nearest vertex; "edge": snap to the nearest road segment, then its closer endpoint
+    SNAP_MODE = os.getenv("SNAP_MODE", "node")
+
+    # landmarks consulted per A* node when ALT tables are in the snapshot
+    ALT_ACTIVE_LANDMARKS = int(os.getenv("ALT_ACTIVE_LANDMARKS", "4"))
+
+    # search when no hierarchy is ready: "anytime" (weighted A*, tightened within the budget),
+    # "bidirectional" (bidirectional A*) or "astar" (classic A*, no route on timeout)
+    SEARCH_MODE = os.getenv("SEARCH_MODE", "anytime")
+    # share of the remaining budget the search may use; the rest is kept for the base-profile
+    # Dijkstra fallback that runs when it ends without a route
+    SEARCH_BUDGET_SHARE = float(os.getenv("SEARCH_BUDGET_SHARE", "0.8"))
+
+    # upper bound on sources * targets for POST /matrix
+    MATRIX_MAX_CELLS = int(os.getenv("MATRIX_MAX_CELLS", "250000"))
+
+    # bearer token for /admin/* endpoints; unset disables them
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+    # longest sampling profile POST /admin/profile may take; keep it below the proxy's read
+    # timeout for that location (nginx/nginx.conf: 75s)
+    PROFILE_MAX_SEC = int(os.getenv("PROFILE_MAX_SEC", "60"))
+
+    # >0: run searches in this many spawned processes per gunicorn worker (sharing the mmap-ed
+    # snapshots; set SNAPSHOT_DIR), request threads only parse, snap and hit the cache.
+    # At most SEARCH_PROCESSES * SEARCH_QUEUE_DEPTH searches wait or run; beyond that -> 503.
+    SEARCH_PROCESSES = int(os.getenv("SEARCH_PROCESSES", "0"))
+    SEARCH_QUEUE_DEPTH = int(os.getenv("SEARCH_QUEUE_DEPTH", "4"))
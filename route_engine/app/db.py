@@ -1,7 +1,9 @@
-import psycopg2
-import psycopg2.extras
-import networkx as nx
+import threading
+
 import numpy as np
+import psycopg2
+
+from .graph import CSRGraph
 
 class DB:
     def __init__(self, host, port, dbname, user, password):
@@ -9,55 +11,141 @@ class DB:
             host=host, port=port, dbname=dbname, user=user, password=password
         )
         self.conn.autocommit = True
+        # one connection shared by the worker's threads: queries take turns
+        self.lock = threading.RLock()
 
     def ensure_city(self, city: str):
-        with self.conn.cursor() as cur:
+        with self.lock, self.conn.cursor() as cur:
             cur.execute("SELECT id FROM cities WHERE name=%s", (city,))
             row = cur.fetchone()
             if not row:
                 raise RuntimeError(f"City '{city}' not found. Run the ingest job.")
             return row[0]
 
+    def city_version(self, city: str):
+        with self.lock, self.conn.cursor() as cur:
+            cur.execute("SELECT data_version FROM cities WHERE name=%s", (city,))
+            row = cur.fetchone()
+            if not row:
+                raise RuntimeError(f"City '{city}' not found. Run the ingest job.")
+            return int(row[0])
+
+    def list_cities(self):
+        '''[(name, data_version)] of every ingested city.'''
+        with self.lock, self.conn.cursor() as cur:
+            cur.execute("SELECT name, data_version FROM cities ORDER BY name")
+            return [(name, int(version)) for name, version in cur.fetchall()]
+
     def load_graph(self, city: str):
-        city_id = self.ensure_city(city)
-        G = nx.DiGraph(city=city)
-
-        # NODES (chunked)
-        with self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-            cur.execute("SELECT osmid, x, y FROM nodes WHERE city_id=%s", (city_id,))
-            while True:
-                rows = cur.fetchmany(10000)
-                if not rows:
-                    break
-                for r in rows:
-                    osmid = int(r["osmid"])
-                    G.add_node(osmid, x=float(r["x"]), y=float(r["y"]))
-
-        # EDGES (chunked)
-        with self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-            cur.execute(
-                "SELECT u, v, length, travel_time, highway, lit, temp_risk, security_risk "
-                "FROM edges WHERE city_id=%s",
-                (city_id,),
-            )
-            while True:
-                rows = cur.fetchmany(10000)
-                if not rows:
-                    break
-                for r in rows:
-                    G.add_edge(
-                        int(r["u"]),
-                        int(r["v"]),
-                        length=float(r["length"]),
-                        travel_time=float(r["travel_time"]),
-                        highway=r["highway"],
-                        lit=bool(r["lit"]),
-                        temp_risk=float(r["temp_risk"]),
-                        security_risk=float(r["security_risk"]),
+        '''
+        (G, idx_to_node, coords, data_version) of a city; the version is read in the same
+        snapshot as the graph, so it is the version of exactly these nodes and edges.
+        '''
+        with self.lock:
+            node_ids, lats, lons = [], [], []
+            u, v, length, travel_time, highway, lit, temp_risk, security_risk, shape = ([] for _ in range(9))
+
+            # one snapshot for the version, nodes and edges, so an ingest swapping the city's
+            # partitions and bumping data_version in between cannot mix two versions
+            with self.conn.cursor() as cur:
+                cur.execute("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            try:
+                with self.conn.cursor() as cur:
+                    cur.execute("SELECT id, data_version FROM cities WHERE name=%s", (city,))
+                    row = cur.fetchone()
+                    if not row:
+                        raise RuntimeError(f"City '{city}' not found. Run the ingest job.")
+                    city_id, version = row
+
+                # NODES (chunked)
+                with self.conn.cursor() as cur:
+                    cur.execute("SELECT osmid, x, y FROM nodes WHERE city_id=%s", (city_id,))
+                    while True:
+                        rows = cur.fetchmany(10000)
+                        if not rows:
+                            break
+                        for osmid, x, y in rows:
+                            node_ids.append(osmid)
+                            lons.append(x)
+                            lats.append(y)
+
+                # EDGES (chunked)
+                with self.conn.cursor() as cur:
+                    cur.execute(
+                        "SELECT u, v, length, travel_time, highway, lit, temp_risk, security_risk, shape "
+                        "FROM edges WHERE city_id=%s",
+                        (city_id,),
                     )
+                    while True:
+                        rows = cur.fetchmany(10000)
+                        if not rows:
+                            break
+                        for r in rows:
+                            u.append(r[0])
+                            v.append(r[1])
+                            length.append(r[2])
+                            travel_time.append(r[3])
+                            highway.append(r[4])
+                            lit.append(r[5])
+                            temp_risk.append(r[6])
+                            security_risk.append(r[7])
+                            shape.append(r[8])
+            finally:
+                with self.conn.cursor() as cur:
+                    cur.execute("COMMIT")
+
+        G = CSRGraph.from_edge_list(
+            city, node_ids, lats, lons, u, v, length, travel_time,
+            temp_risk, security_risk, lit, highway,
+            # cities ingested without shapes get straight segments between nodes
+            shapes=shape if any(shape) else None,
+        )
+        # node index == position in idx_to_node / coords, used for nearest-node queries
+        return G, G.node_ids, G.coords, int(version)
+
+    def tile_info(self, city: str):
+        '''(data_version, tile_deg) of a city; tile_deg is 0 when it was ingested without tiles.'''
+        with self.lock, self.conn.cursor() as cur:
+            cur.execute("SELECT data_version, tile_deg FROM cities WHERE name=%s", (city,))
+            row = cur.fetchone()
+            if not row:
+                raise RuntimeError(f"City '{city}' not found. Run the ingest job.")
+            return int(row[0]), float(row[1])
+
+    def load_tiles(self, city: str, tiles):
+        '''
+        (data_version, node columns, edge columns) of the given tiles, read in one snapshot.
+        Nodes: (tile, osmid, lat, lon); edges: (tile, u, v, v_tile, travel_time, temp_risk, security_risk).
+        '''
+        tiles = [int(k) for k in tiles]
+        with self.lock:
+            with self.conn.cursor() as cur:
+                cur.execute("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            try:
+                with self.conn.cursor() as cur:
+                    cur.execute("SELECT id, data_version FROM cities WHERE name=%s", (city,))
+                    row = cur.fetchone()
+                    if not row:
+                        raise RuntimeError(f"City '{city}' not found. Run the ingest job.")
+                    city_id, version = row
+                    cur.execute("SELECT tile, osmid, y, x FROM nodes WHERE city_id=%s AND tile = ANY(%s)", (city_id, tiles))
+                    nodes = cur.fetchall()
+                    cur.execute(
+                        "SELECT tile, u, v, v_tile, travel_time, temp_risk, security_risk "
+                        "FROM edges WHERE city_id=%s AND tile = ANY(%s)",
+                        (city_id, tiles),
+                    )
+                    edges = cur.fetchall()
+            finally:
+                with self.conn.cursor() as cur:
+                    cur.execute("COMMIT")
+
+        node_cols = _columns(nodes, (np.int64, np.int64, np.float64, np.float64))
+        edge_cols = _columns(edges, (np.int64, np.int64, np.int64, np.int64, np.float32, np.float32, np.float32))
+        return int(version), node_cols, edge_cols
+
 
-        # Build arrays for nearest-node queries
-        nodes = list(G.nodes(data=True))
-        idx_to_node = np.array([n for n, _ in nodes], dtype=np.int64)
-        coords = np.array([[d["y"], d["x"]] for _, d in nodes], dtype=np.float64)  # lat, lon
-        return G, idx_to_node, coords
+def _columns(rows, dtypes):
+    if not rows:
+        return tuple(np.zeros(0, dtype=d) for d in dtypes)
+    return tuple(np.asarray(col, dtype=d) for col, d in zip(zip(*rows), dtypes))
@@ -0,0 +1,100 @@
+'''
+Observed demand: a sampled log of served routes, and the origin-destination pairs mined from it.
+
+Every worker appends a sampled share of its /route requests, one JSON object per line, to its
+own rotating file `requests-<host>-<pid>.jsonl` in the log directory; a queue thread does the
+writing, so request threads never wait on the disk. Pairs are logged as snapped node osmids
+(not node indices), so they stay valid across re-ingests. The cache pre-warm job counts them
+per city and constraint profile.
+'''
+import collections
+import glob
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import socket
+import time
+
+log = logging.getLogger(__name__)
+
+FILE_PATTERN = "requests-*.jsonl*"  # current files and their rotated backups
+
+
+class RequestLog:
+    '''Sampled, rotating JSONL log of routed requests of this process.'''
+
+    def __init__(self, directory, sample_rate, max_bytes, backups):
+        os.makedirs(directory, exist_ok=True)
+        self.sample_rate = sample_rate
+        path = os.path.join(directory, f"requests-{socket.gethostname()}-{os.getpid()}.jsonl")
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        records = queue.SimpleQueue()
+        self._logger = logging.getLogger(f"{__name__}.requests")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        self._logger.handlers = [logging.handlers.QueueHandler(records)]
+        self._listener = logging.handlers.QueueListener(records, handler)
+        self._listener.start()
+
+    def record(self, city, points, source, target, pid, deadline_ms, latency_ms, degraded, tier):
+        '''
+        Log one served route, for a `sample_rate` share of calls: the requested (lat, lon)
+        `points` (so tests/replay.py can resend it) and the snapped osmids `source`/`target`.
+        '''
+        if random.random() >= self.sample_rate:
+            return
+        self._logger.info(json.dumps({
+            "ts": round(time.time(), 3), "city": city, "points": [[float(lat), float(lon)] for lat, lon in points],
+            "source": int(source), "target": int(target), "profile": int(pid), "deadline_ms": int(deadline_ms),
+            "latency_ms": round(latency_ms, 2), "degraded": bool(degraded), "cache": tier, "sample": self.sample_rate,
+        }))
+
+    def close(self):
+        self._listener.stop()
+
+
+def read_log(directory, since=0.0):
+    '''Yields the records of every log file in `directory` (rotated ones too) newer than `since`.'''
+    for path in glob.glob(os.path.join(directory, FILE_PATTERN)):
+        try:
+            if os.path.getmtime(path) < since:
+                continue
+            with open(path) as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by a crash
+                    if rec.get("ts", 0) >= since:
+                        yield rec
+        except OSError:
+            continue  # rotated away while reading
+
+
+def top_pairs(records, k):
+    '''
+    {(city, profile): [(source osmid, target osmid, count), ...]} with the `k` most frequent
+    pairs of each city and profile, most frequent first.
+    '''
+    counts = collections.defaultdict(collections.Counter)
+    for rec in records:
+        try:
+            counts[(rec["city"], int(rec["profile"]))][(int(rec["source"]), int(rec["target"]))] += 1
+        except (KeyError, TypeError, ValueError):
+            continue
+    return {key: [(s, t, n) for (s, t), n in c.most_common(k)] for key, c in counts.items()}
+
+
+def prune(directory, max_age_sec):
+    '''Delete log files untouched for `max_age_sec` (left behind by workers that exited).'''
+    cutoff = time.time() - max_age_sec
+    for path in glob.glob(os.path.join(directory, FILE_PATTERN)):
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,70 @@
+'''
+Process pool for CPU-bound searches.
+
+Searches are pure Python and serialize on the GIL inside a gunicorn worker, so in this
+mode the request threads only parse, snap and talk to the cache, and hand the search to a
+pool of spawned processes. Those processes map the same city snapshots (SNAPSHOT_DIR), so
+the graph and profile cost pages are shared through the page cache instead of being copied
+per process; they get snapped nodes, so they build no spatial index.
+
+Backpressure: at most `max_pending` searches may be queued or running per request worker;
+beyond that `run` raises Overloaded right away instead of growing the queue.
+'''
+import concurrent.futures as cf
+import multiprocessing
+import threading
+
+# slack on top of the request budget before a search result is given up on
+_GRACE_SEC = 0.25
+
+
+class Overloaded(RuntimeError):
+    pass
+
+
+class SearchPool:
+    def __init__(self, processes, max_pending, initializer=None):
+        self.processes = processes
+        self.max_pending = max_pending
+        self.initializer = initializer
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        # created on first use, i.e. inside the gunicorn worker; "spawn" because forking
+        # a process with live threads and sockets is unsafe
+        with self._lock:
+            if self._pool is None:
+                self._pool = cf.ProcessPoolExecutor(
+                    self.processes, mp_context=multiprocessing.get_context("spawn"),
+                    initializer=self.initializer)
+            return self._pool
+
+    def run(self, fn, args, timeout_sec):
+        '''
+        fn(*args) in a search process. Returns its result, or None when it did not finish
+        within `timeout_sec` (plus a small grace). Raises Overloaded when the queue is full.
+        '''
+        if not self._slots.acquire(blocking=False):
+            raise Overloaded(f"{self.max_pending} searches already pending")
+        try:
+            future = self._executor().submit(fn, *args)
+        except cf.process.BrokenProcessPool:
+            self._slots.release()
+            with self._lock:
+                self._pool = None
+            raise
+        # the slot is held until the search process is done, even if we stop waiting
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=max(0.0, timeout_sec) + _GRACE_SEC)
+        except cf.TimeoutError:
+            future.cancel()
+            return None
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
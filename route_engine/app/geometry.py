@@ -0,0 +1,84 @@
+'''
+Compact route geometry: Douglas-Peucker simplification and encoded polylines.
+
+Both work on (k, 2) float64 arrays of (lat, lon), as stored in CSRGraph.coords.
+'''
+import math
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000.0
+# 5-bit groups needed for any zigzag-encoded 32-bit delta
+_GROUPS = 7
+
+
+def simplify(points, tolerance_m):
+    '''
+    Indices of the points kept by Douglas-Peucker with `tolerance_m` (meters): every dropped
+    point lies within the tolerance of the simplified line. First and last are always kept.
+    '''
+    k = len(points)
+    if k < 3 or tolerance_m <= 0:
+        return np.arange(k)
+    # local equirectangular projection; accurate to well under the tolerance at city scale
+    lat0 = math.radians(float(points[:, 0].mean()))
+    xy = np.radians(points[:, ::-1]) * EARTH_RADIUS_M
+    xy[:, 0] *= math.cos(lat0)
+
+    keep = np.zeros(k, dtype=bool)
+    keep[0] = keep[-1] = True
+    # all open segments of one recursion level at once
+    lo, hi = np.array([0]), np.array([k - 1])
+    while len(lo):
+        inner = hi - lo - 1
+        lo, hi, inner = lo[inner > 0], hi[inner > 0], inner[inner > 0]
+        if not len(lo):
+            break
+        seg = np.repeat(np.arange(len(lo)), inner)
+        starts = np.cumsum(inner) - inner
+        idx = np.repeat(lo + 1, inner) + (np.arange(len(seg)) - np.repeat(starts, inner))
+        a, ab = xy[lo][seg], (xy[hi] - xy[lo])[seg]
+        p = xy[idx] - a
+        denom = np.einsum("ij,ij->i", ab, ab)
+        # distance to the segment a-b (not the infinite line: routes double back)
+        t = np.clip(np.einsum("ij,ij->i", p, ab) / np.where(denom > 0, denom, 1.0), 0.0, 1.0)
+        dist = np.hypot(*(p - t[:, None] * ab).T)
+        # farthest point per segment (first one on ties)
+        best = np.maximum.reduceat(dist, starts)
+        first = np.flatnonzero(dist == best[seg])
+        _, at = np.unique(seg[first], return_index=True)
+        split = best > tolerance_m
+        mid = idx[first[at]][split]
+        keep[mid] = True
+        lo, hi = np.concatenate((lo[split], mid)), np.concatenate((mid, hi[split]))
+    return np.flatnonzero(keep)
+
+
+def encode_polyline(points, precision=5):
+    '''Encoded polyline (Google's format) of (lat, lon) points with `precision` decimals.'''
+    if len(points) == 0:
+        return ""
+    scaled = np.round(np.asarray(points, dtype=np.float64) * 10.0 ** precision).astype(np.int64)
+    deltas = np.diff(scaled, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    values = ((deltas << 1) ^ (deltas >> 63)).astype(np.uint64)  # zigzag: sign in the low bit
+    groups = (values[:, None] >> (5 * np.arange(_GROUPS, dtype=np.uint64))) & np.uint64(0x1F)
+    # a value uses groups 0 .. n-1, with the continuation bit on all but the last
+    n = 1 + ((values[:, None] >> (5 * np.arange(1, _GROUPS, dtype=np.uint64))) > 0).sum(axis=1)
+    used = np.arange(_GROUPS) < n[:, None]
+    more = np.arange(_GROUPS) < (n - 1)[:, None]
+    chars = groups.astype(np.uint8) + 63 + np.where(more, 0x20, 0).astype(np.uint8)
+    return chars[used].tobytes().decode("ascii")
+
+
+def decode_polyline(text, precision=5):
+    '''Inverse of encode_polyline: float64[k, 2] of (lat, lon).'''
+    values, shift, acc = [], 0, 0
+    for byte in text.encode("ascii"):
+        byte -= 63
+        acc |= (byte & 0x1F) << shift
+        shift += 5
+        if byte < 0x20:
+            values.append(~(acc >> 1) if acc & 1 else acc >> 1)
+            shift = acc = 0
+    coords = np.cumsum(np.asarray(values, dtype=np.int64).reshape(-1, 2), axis=0)
+    return coords / 10.0 ** precision
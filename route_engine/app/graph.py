@@ -0,0 +1,189 @@
+import itertools
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+
+
+class CSRGraph:
+    '''
+    Compact directed road graph in compressed-sparse-row form.
+
+    Nodes are addressed by a dense int32 index; `node_ids[i]` is the osmid of node i
+    (sorted ascending) and `coords[i]` its (lat, lon). The out-edges of node i are the
+    edge indices `offsets[i]:offsets[i + 1]`, sorted by target; every per-edge attribute
+    lives in a parallel array indexed by edge index.
+
+    Edges are whole chains of degree-2 nodes (contracted by OSMnx at ingest); the points of
+    edge e between its end nodes, when known, are `shape_points[shape_offsets[e]:shape_offsets[e + 1]]`.
+    '''
+
+    def __init__(self, city, node_ids, coords, offsets, targets, length, travel_time,
+                 temp_risk, security_risk, lit, highway, highway_classes):
+        self.city = city
+        self.node_ids = node_ids            # int64[n]   osmid per node index
+        self.coords = coords                # float64[n, 2]  lat, lon
+        self.offsets = offsets              # int64[n + 1]
+        self.targets = targets              # int32[m]
+        self.length = length                # float32[m] meters
+        self.travel_time = travel_time      # float32[m] seconds
+        self.temp_risk = temp_risk          # float32[m] 0..1
+        self.security_risk = security_risk  # float32[m] 0..1
+        self.lit = lit                      # float32[m] 0/1
+        self.highway = highway              # uint8[m]   code into highway_classes
+        self.highway_classes = list(highway_classes)
+        self.shape_offsets = None           # int64[m + 1], or None without shapes
+        self.shape_points = None            # float64[p, 2]  lat, lon
+        self._reverse = None
+        self._edge_keys = None
+
+    @classmethod
+    def from_edge_list(cls, city, node_ids, lat, lon, u, v, length, travel_time,
+                       temp_risk, security_risk, lit, highway, shapes=None):
+        '''
+        Build from flat node and edge columns keyed by osmid. `highway` is a sequence of
+        class names, interned into uint8 codes. `shapes` optionally gives each edge's inner
+        points as a flat [lat, lon, lat, lon, ...] sequence (or None). Edges whose endpoints
+        are not among the nodes are dropped; parallel edges are kept (searches take the
+        cheapest one).
+        '''
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        order = np.argsort(node_ids, kind="stable")
+        node_ids = node_ids[order]
+        coords = np.column_stack((np.asarray(lat, dtype=np.float64)[order],
+                                  np.asarray(lon, dtype=np.float64)[order]))
+
+        classes = {}
+        codes = np.fromiter((classes.setdefault(h or "", len(classes)) for h in highway),
+                            dtype=np.int64, count=len(highway))
+        if len(classes) > 256:
+            raise ValueError(f"too many highway classes ({len(classes)}) for uint8 codes")
+
+        g = cls(city, node_ids, coords, None, None, None, None, None, None, None, None,
+                sorted(classes, key=classes.get))
+        ui = g.index_of(u)
+        vi = g.index_of(v)
+        keep = (ui >= 0) & (vi >= 0)
+        ui, vi = ui[keep], vi[keep]
+        perm = np.lexsort((vi, ui))
+
+        n = len(node_ids)
+        g.offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(ui, minlength=n), out=g.offsets[1:])
+        g.targets = vi[perm].astype(np.int32)
+
+        def column(values, dtype):
+            return np.asarray(values, dtype=dtype)[keep][perm]
+
+        g.length = column(length, np.float32)
+        g.travel_time = column(travel_time, np.float32)
+        g.temp_risk = column(temp_risk, np.float32)
+        g.security_risk = column(security_risk, np.float32)
+        g.lit = column(lit, np.float32)
+        g.highway = codes[keep][perm].astype(np.uint8)
+        if shapes is not None:
+            kept = [shapes[i] or () for i in np.flatnonzero(keep)[perm].tolist()]
+            counts = np.fromiter((len(p) // 2 for p in kept), dtype=np.int64, count=len(kept))
+            offsets = np.zeros(len(kept) + 1, dtype=np.int64)
+            np.cumsum(counts, out=offsets[1:])
+            points = np.fromiter(itertools.chain.from_iterable(kept), dtype=np.float64, count=2 * int(offsets[-1]))
+            g.set_shapes(offsets, points.reshape(-1, 2))
+        return g
+
+    def set_shapes(self, offsets, points):
+        self.shape_offsets, self.shape_points = offsets, points
+
+    @property
+    def num_nodes(self):
+        return len(self.node_ids)
+
+    @property
+    def num_edges(self):
+        return len(self.targets)
+
+    @property
+    def nbytes(self):
+        shapes = (self.shape_offsets, self.shape_points) if self.shape_offsets is not None else ()
+        return sum(a.nbytes for a in (
+            self.node_ids, self.coords, self.offsets, self.targets, self.length,
+            self.travel_time, self.temp_risk, self.security_risk, self.lit, self.highway, *shapes,
+        ))
+
+    def index_of(self, osmids):
+        '''Map osmids to node indices (int64 array, -1 where unknown).'''
+        osmids = np.asarray(osmids, dtype=np.int64)
+        pos = np.searchsorted(self.node_ids, osmids)
+        pos = np.minimum(pos, len(self.node_ids) - 1)
+        found = self.node_ids[pos] == osmids
+        return np.where(found, pos, -1)
+
+    def out_edges(self, node):
+        '''Edge index range (lo, hi) of the out-edges of `node`.'''
+        return int(self.offsets[node]), int(self.offsets[node + 1])
+
+    def edge_sources(self):
+        '''Source node index of every edge (int32[m]).'''
+        return np.repeat(np.arange(self.num_nodes, dtype=np.int32), np.diff(self.offsets))
+
+    def reverse(self):
+        '''Incoming adjacency (offsets, sources, edge indices), built on first use.'''
+        if self._reverse is None:
+            order = np.argsort(self.targets, kind="stable")
+            offsets = np.zeros(self.num_nodes + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.targets, minlength=self.num_nodes), out=offsets[1:])
+            self._reverse = (offsets, self.edge_sources()[order], order)
+        return self._reverse
+
+    def csr_matrix(self, weights):
+        '''scipy CSR matrix of the graph under `weights`, keeping the cheapest of any parallel edges.'''
+        n = self.num_nodes
+        src = self.edge_sources()
+        dst = self.targets
+        if len(dst) == 0:
+            return sp.csr_matrix((n, n))
+        start = np.ones(len(dst), dtype=bool)
+        start[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+        first = np.flatnonzero(start)
+        w = np.minimum.reduceat(np.asarray(weights, dtype=np.float64), first)
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src[first], minlength=n), out=indptr[1:])
+        return sp.csr_matrix((w, dst[first], indptr), shape=(n, n))
+
+    def largest_component(self):
+        '''Mask of the nodes in the largest strongly connected component (bool[n]).'''
+        if self.num_nodes == 0:
+            return np.zeros(0, dtype=bool)
+        _, labels = connected_components(self.csr_matrix(np.ones(self.num_edges)), directed=True, connection="strong")
+        return labels == np.argmax(np.bincount(labels))
+
+    def path_points(self, path, weights):
+        '''
+        (lat, lon) points of a node index path, with the inner points of the edges it takes
+        (of parallel edges, the cheapest under `weights`, as the searches do).
+        '''
+        path = np.asarray(path, dtype=np.int64)
+        if self.shape_offsets is None or len(path) < 2:
+            return self.coords[path]
+        lo, hi = self.edge_range(path[:-1], path[1:])
+        edges = lo.copy()
+        for i in np.flatnonzero(hi - lo > 1).tolist():
+            edges[i] = lo[i] + int(np.argmin(weights[lo[i]:hi[i]]))
+        edges = np.minimum(edges, max(self.num_edges - 1, 0))
+        counts = np.where(hi > lo, self.shape_offsets[edges + 1] - self.shape_offsets[edges], 0)
+        # every path node, followed by the inner points of the edge leaving it
+        node_pos = np.zeros(len(path), dtype=np.int64)
+        np.cumsum(counts + 1, out=node_pos[1:])
+        points = np.empty((node_pos[-1] + 1, 2))
+        points[node_pos] = self.coords[path]
+        step = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+        points[np.repeat(node_pos[:-1] + 1, counts) + step] = self.shape_points[np.repeat(self.shape_offsets[edges], counts) + step]
+        return points
+
+    def edge_range(self, u, v):
+        '''Edge index ranges [lo, hi) of u -> v for node index arrays u, v (hi == lo if absent).'''
+        if self._edge_keys is None:
+            # edges are sorted by (source, target), so these keys are sorted too
+            self._edge_keys = self.edge_sources().astype(np.int64) * self.num_nodes + self.targets
+        keys = np.asarray(u, dtype=np.int64) * self.num_nodes + np.asarray(v, dtype=np.int64)
+        return (np.searchsorted(self._edge_keys, keys, side="left"),
+                np.searchsorted(self._edge_keys, keys, side="right"))
@@ -1,79 +1,745 @@
-from flask import Flask, request, jsonify
+import collections
+import logging
+import math
+import os
+import socket
+import threading
+import time
+
+from flask import Flask, Response, request, jsonify
 from werkzeug.middleware.dispatcher import DispatcherMiddleware
 from prometheus_client import make_wsgi_app
+from redis import Redis
+import msgpack
 import numpy as np
-import networkx as nx
+import orjson
 
 from .config import Config
 from .db import DB
 from .cache import Cache
-from .metrics import REQUESTS, FAILURES, DURATION, EXPANDED
-from .a_star import astar_with_deadline
+from . import snapshot
+from .metrics import (REQUESTS, FAILURES, DURATION, EXPANDED, MATRIX_CELLS, HEAP_PUSHES, EDGE_RELAXATIONS, RESPONSE_BYTES,
+                      CACHE_REFRESHES, PREWARM_ROUTES, SHARD_REQUESTS, observe_phase, phase_timer)
+from .a_star import astar_with_deadline, bidirectional_astar_with_deadline, anytime_astar_with_deadline, dijkstra
 from .utils import haversine
+from .spatial import SpatialIndex
+from .ch import ContractionHierarchy
+from .cch import CCHTopology
+from .alt import Landmarks
+from .profiles import BASE_PROFILE, ProfileSet, profile_id, profile_name, edge_weights
+from .matrix import bucket_matrix, dijkstra_matrix
+from .updates import EdgeUpdates, parse_batch, resolve_edges
+from .executor import SearchPool, Overloaded
+from .admission import AdmissionController
+from .registry import CityRegistry, CityLoading
+from . import demand, profiler
+from .geometry import simplify, encode_polyline
+from .tiles import TiledCity, TilesChanged
+from .sharding import ShardMap
+
+GEOMETRY_FORMATS = ("points", "coords", "polyline", "polyline6", "none")
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
 
 # Global singleton-ish (simple demo)
 DB_CONN = None
 CACHE = None
-GRAPHS = {}  # city -> (G, idx_to_node, coords)
+UPDATES = None  # EdgeUpdates
+SEARCH_POOL = None  # SearchPool when SEARCH_PROCESSES > 0
+ADMISSION = None  # AdmissionController when ADMISSION_CONTROL is on
+CITIES = None  # CityRegistry: city -> (CSRGraph, idx_to_node, coords, SpatialIndex, ProfileSet, data_version)
+REQUEST_LOG = None  # demand.RequestLog when REQUEST_LOG_DIR is set
+TILED = {}  # city -> TiledCity, for the TILED_CITIES
+SHARDS = None  # ShardMap: the cities this engine owns
+_DB_LOCK = threading.Lock()
+_TILED_LOCK = threading.Lock()
+_PREWARM_LOCK = threading.Lock()
+
+log = logging.getLogger(__name__)
+
+
+def get_db(cfg):
+    global DB_CONN
+    with _DB_LOCK:
+        if DB_CONN is None:
+            DB_CONN = DB(cfg.DB_HOST, cfg.DB_PORT, cfg.DB_NAME, cfg.DB_USER, cfg.DB_PASSWORD)
+        return DB_CONN
+
+
+def load_city(city, cfg, spatial=True):
+    '''
+    Registry entry of a city. Without `spatial` (search processes, which get snapped nodes)
+    the entry has no SpatialIndex and the snapping component is not needed.
+    '''
+    db = get_db(cfg)
+    ch = cch = landmarks = snappable = weights = None
+    if cfg.SNAPSHOT_DIR:
+        G, header, extra = snapshot.load_or_build(db, city, cfg.SNAPSHOT_DIR, verify=cfg.SNAPSHOT_VERIFY)
+        idx_to_node, coords, version = G.node_ids, G.coords, header["data_version"]
+        ch = ContractionHierarchy.from_arrays(extra, snapshot.CH_BASE_PREFIX)
+        cch = CCHTopology.from_arrays(extra)
+        landmarks = Landmarks.from_arrays(extra)
+        # both absent from snapshots of older builds
+        snappable = extra.get(snapshot.COMPONENT_ARRAY)
+        weights = snapshot.stored_weights(extra)
+    else:
+        G, idx_to_node, coords, version = db.load_graph(city)
+    profiles = ProfileSet(G, ch=ch, cch=cch, landmarks=landmarks, weights=weights)
+    if UPDATES is not None:
+        # live edge updates published since this data_version was ingested; those of older
+        # versions are obsolete
+        UPDATES.forget(city)
+        UPDATES.prune(city, version)
+        UPDATES.sync(city, version, G, profiles)
+    if not spatial:
+        return G, idx_to_node, coords, None, profiles, version
+    # snap only into the largest strongly connected component: from islands and one-way dead
+    # ends most of the city is unreachable, and a search finds out only after exhausting them
+    if snappable is None:
+        snappable = G.largest_component()
+    if not snappable.all():
+        log.info("%s: %d of %d nodes outside the largest strongly connected component are not snapped to",
+                 city, int((~snappable).sum()), G.num_nodes)
+    return G, idx_to_node, coords, SpatialIndex(G, nodes=snappable), profiles, version
+
+
+def get_tiled(city, cfg):
+    '''TiledCity of a TILED_CITIES city, created once per worker; notices re-ingests.'''
+    with _TILED_LOCK:
+        tiled = TILED.get(city)
+        if tiled is None:
+            tiled = TILED[city] = TiledCity(city, get_db(cfg), cfg.TILE_CACHE_MB * 2**20, cfg.TILE_MARGIN_KM)
+    tiled.refresh()
+    return tiled
+
+
+def city_nbytes(entry):
+    G, _, _, index, profiles, _ = entry
+    return G.nbytes + (index.nbytes if index is not None else 0) + profiles.nbytes
+
+
+def init_cities(cfg, spatial=True):
+    global CITIES
+    CITIES = CityRegistry(lambda city: load_city(city, cfg, spatial), city_nbytes,
+                          budget_bytes=cfg.CITY_MEMORY_BUDGET_MB * 2**20,
+                          on_loaded=lambda city, entry: on_edge_update(city))
 
 
 def load_city_if_needed(city, cfg):
-    global GRAPHS, DB_CONN
-    if city in GRAPHS:
-        return GRAPHS[city]
-    if DB_CONN is None:
-        DB_CONN = DB(cfg.DB_HOST, cfg.DB_PORT, cfg.DB_NAME, cfg.DB_USER, cfg.DB_PASSWORD)
-    G, idx_to_node, coords = DB_CONN.load_graph(city)
-    GRAPHS[city] = (G, idx_to_node, coords)
-    return GRAPHS[city]
+    '''Entry of a city, loaded once per worker; raises CityLoading if another thread's load takes too long.'''
+    return CITIES.get(city, cfg.CITY_LOAD_WAIT_MS / 1000.0)
+
+
+def on_edge_update(city):
+    entry = CITIES.peek(city)
+    if entry is not None:
+        G, _, _, _, profiles, data_version = entry
+        UPDATES.sync(city, data_version, G, profiles)
+
+
+def warm_city(city, cfg):
+    '''Load a city and run one search on it, so the first real request finds it hot.'''
+    G, _, coords, index, profiles, data_version = load_city_if_needed(city, cfg)
+    if G.num_nodes < 2:
+        return
+    # fault the mmap-ed snapshot pages in
+    for arr in (G.offsets, G.targets, G.travel_time, G.coords) + tuple(profiles.weights):
+        int(arr.reshape(-1).view(np.uint8)[::4096].sum())
+    # snap the city centre, then route from there to a far node under the base profile
+    s = int(snap_points(index, coords.mean(axis=0, keepdims=True), cfg)[0])
+    t = int(np.argmax(np.abs(coords - coords[s]).sum(axis=1)))
+    deadline_sec = cfg.ROUTE_DEADLINE_MS / 1000.0
+    if SEARCH_POOL is None:
+        search_route(G, profiles, coords, BASE_PROFILE, s, t, cfg.SEARCH_MODE, deadline_sec, time.perf_counter(), cfg)
+    else:
+        args = (city, data_version, UPDATES.seq(city, data_version), s, t, BASE_PROFILE, cfg.SEARCH_MODE, time.time() + deadline_sec)
+        SEARCH_POOL.run(search_task, args, deadline_sec)
+
+
+def preload_cities(cfg):
+    started = time.perf_counter()
+    for city in cfg.PRELOAD_CITIES:
+        if city in cfg.TILED_CITIES:
+            continue  # nothing to warm: tiles load around requests
+        if not SHARDS.owns(city):
+            log.warning("not preloading %s: owned by %s", city, ", ".join(SHARDS.owners(city)))
+            continue
+        try:
+            warm_city(city, cfg)
+        except Exception:
+            # e.g. not ingested yet: it is loaded on its first request instead
+            log.exception("preloading city %s failed", city)
+    log.info("preloaded %s in %.1fs", ", ".join(cfg.PRELOAD_CITIES), time.perf_counter() - started)
+
+
+def prewarm_cache(cfg, top_k, budget_sec):
+    '''
+    Make sure the `top_k` most requested pairs per city and profile in the request log stay
+    cached for another CACHE_TTL: entries still cached get their TTL reset, missing ones
+    (expired, or from before a graph change) are computed. Hottest pairs first, until
+    `budget_sec` runs out. Returns a Counter of results.
+    '''
+    lookback_sec = cfg.PREWARM_LOOKBACK_HOURS * 3600
+    demand.prune(cfg.REQUEST_LOG_DIR, lookback_sec)
+    pairs = demand.top_pairs(demand.read_log(cfg.REQUEST_LOG_DIR, time.time() - lookback_sec), top_k)
+    # tiled cities are skipped: their entries are keyed on osmids, and loading tiles for
+    # hundreds of cold pairs would evict the ones live traffic uses
+    # (the log is shared by all engines: each pre-warms the cities it owns)
+    todo = sorted(((n, city, pid, src, dst) for (city, pid), top in pairs.items() for src, dst, n in top
+                   if city not in cfg.TILED_CITIES and SHARDS.owns(city)), key=lambda item: -item[0])
+    summary = collections.Counter()
+    entries = {}
+    deadline = time.monotonic() + budget_sec
+    for _, city, pid, src, dst in todo:
+        if time.monotonic() >= deadline:
+            result = "skipped"
+        else:
+            if city not in entries:
+                try:
+                    entries[city] = load_city_if_needed(city, cfg)
+                except Exception:
+                    log.exception("pre-warm: loading city %s failed", city)
+                    entries[city] = None
+            result = prewarm_pair(entries[city], city, pid, src, dst, cfg)
+        summary[result] += 1
+        PREWARM_ROUTES.labels(city=city, result=result).inc()
+    return summary
+
+
+def prewarm_pair(entry, city, pid, src, dst, cfg):
+    '''Refresh or compute the cached route between osmids src and dst; returns the result label.'''
+    if entry is None:
+        return "failed"
+    G, _, coords, _, profiles, data_version = entry
+    s, t = G.index_of([src, dst]).tolist()
+    if s < 0 or t < 0:
+        return "unknown_node"  # logged before a re-ingest that dropped the node
+    version = UPDATES.version(city, data_version)
+    if CACHE.touch(city, version, s, t, pid, ttl=cfg.CACHE_TTL):
+        CACHE_REFRESHES.labels(kind="prewarm").inc()
+        return "refreshed"
+    try:
+        path, cost, expanded, degraded = compute_route(city, data_version, G, profiles, coords, pid, s, t, cfg.SEARCH_MODE,
+                                                       cfg.ROUTE_DEADLINE_MS / 1000.0, time.perf_counter(), cfg)[:4]
+    except Overloaded:
+        time.sleep(1.0)  # live traffic keeps the searches busy: back off
+        return "failed"
+    if not path or degraded:
+        return "failed"
+    CACHE.set(city, version, s, t, pid, path, cost, expanded, ttl=cfg.CACHE_TTL)
+    return "computed"
+
+
+def run_prewarm(cfg, top_k, budget_sec):
+    '''prewarm_cache, unless one already runs in this worker (then None).'''
+    if not _PREWARM_LOCK.acquire(blocking=False):
+        return None
+    try:
+        started = time.perf_counter()
+        summary = prewarm_cache(cfg, top_k, budget_sec)
+        log.info("cache pre-warm: %s in %.0fs", dict(summary), time.perf_counter() - started)
+        return summary
+    finally:
+        _PREWARM_LOCK.release()
+
+
+def prewarm_scheduler(cfg):
+    '''Runs the pre-warm once in each PREWARM_HOURS hour (UTC), on the worker that claims it first.'''
+    while True:
+        time.sleep(60)
+        now = time.gmtime()
+        if now.tm_hour not in cfg.PREWARM_HOURS:
+            continue
+        try:
+            # one run per hour across all workers of both engines (of each engine when sharded:
+            # every engine pre-warms its own cities)
+            claim = "prewarm:" + (f"{cfg.ENGINE_ID}:" if SHARDS.enabled else "") + time.strftime("%Y%m%d%H", now)
+            if CACHE.r.set(claim, f"{socket.gethostname()}:{os.getpid()}", nx=True, ex=7200):
+                run_prewarm(cfg, cfg.PREWARM_TOP_K, cfg.PREWARM_BUDGET_SEC)
+        except Exception:
+            log.exception("cache pre-warm failed")
+
+
+def admin_denied(cfg):
+    '''Error response unless the request carries the admin bearer token.'''
+    if not cfg.ADMIN_TOKEN:
+        return jsonify({"error": "forbidden", "detail": "admin endpoints are disabled (ADMIN_TOKEN unset)"}), 403
+    if request.headers.get("Authorization", "") != f"Bearer {cfg.ADMIN_TOKEN}":
+        return jsonify({"error": "unauthorized"}), 401
+    return None
+
+
+def misdirected(city):
+    '''
+    421 response when this engine does not own `city`, so nothing gets loaded for it; None
+    when it does, when nginx fails over to it because the owners did not answer, or when
+    nginx has no upstream for the city yet (ingested since upstreams.conf was generated).
+    '''
+    if SHARDS.owns(city):
+        SHARD_REQUESTS.labels(city=city, result="owned").inc()
+        return None
+    if request.headers.get("X-Shard-Failover"):
+        SHARD_REQUESTS.labels(city=city, result="failover").inc()
+        return None
+    if request.headers.get("X-Shard-Unmapped"):
+        SHARD_REQUESTS.labels(city=city, result="unmapped").inc()
+        return None
+    SHARD_REQUESTS.labels(city=city, result="misdirected").inc()
+    owners = SHARDS.owners(city)
+    return (jsonify({"error": "misdirected", "detail": f"city '{city}' is served by {', '.join(owners)}", "owners": owners}),
+            421, {"X-Shard-Owners": ",".join(owners)})
+
+
+def snap_points(index, points, cfg):
+    if cfg.SNAP_MODE == "edge":
+        return index.snap_to_edge(points)
+    return index.nearest(points)[0]
+
+
+def parse_points(points):
+    '''[{"lat": .., "lon": ..}, ...] -> float64[k, 2]; ValueError when malformed.'''
+    if not isinstance(points, list) or not points:
+        raise ValueError("expected a non-empty list of points")
+    try:
+        return np.array([[float(p["lat"]), float(p["lon"])] for p in points], dtype=np.float64)
+    except (TypeError, KeyError) as e:
+        raise ValueError("points need numeric lat/lon") from e
+
+
+def build_heuristic(profiles, coords, pid, s, t, cfg, reverse=False):
+    if profiles.landmarks is not None:
+        # ALT: triangle-inequality bound from the profile's landmark tables
+        if reverse:
+            return profiles.landmarks.reverse_heuristic(pid, s, target=t, active=cfg.ALT_ACTIVE_LANDMARKS)
+        return profiles.landmarks.heuristic(pid, t, source=s, active=cfg.ALT_ACTIVE_LANDMARKS)
+
+    # no landmarks: haversine -> optimistic travel time assuming 60 km/h
+    dst_lat, dst_lon = coords[s if reverse else t]
+    def heuristic(node):
+        lat, lon = coords[node]
+        dist_m = haversine(lat, lon, dst_lat, dst_lon)
+        return dist_m / 16.6666667  # seconds at 60 km/h (≈16.67 m/s)
+    return heuristic
+
+
+def run_search(G, profiles, coords, pid, s, t, deadline_sec, mode, cfg, stats=None):
+    '''
+    Search without a hierarchy; heap pushes and edge relaxations are added to `stats`.
+    Returns: (path_nodes, total_cost, expanded_count, degraded, reason, suboptimality_bound)
+    '''
+    weights = profiles.weights[pid]  # precomputed at load
+    heuristic = build_heuristic(profiles, coords, pid, s, t, cfg)
+    if mode == "bidirectional":
+        reverse_heuristic = build_heuristic(profiles, coords, pid, s, t, cfg, reverse=True)
+        return bidirectional_astar_with_deadline(G, s, t, heuristic, reverse_heuristic, weights, deadline_sec, stats=stats)
+    if mode == "anytime":
+        return anytime_astar_with_deadline(G, s, t, heuristic, weights, deadline_sec, stats=stats)
+    path, cost, expanded, degraded, reason = astar_with_deadline(G, s, t, heuristic, weights, deadline_sec, stats=stats)
+    return path, cost, expanded, degraded, reason, None if degraded else 1.0
+
+
+def search_route(G, profiles, coords, pid, s, t, mode, deadline_sec, started, cfg, stats=None):
+    '''
+    Search (hierarchy if ready, else `mode`) plus the budgeted fallback; the request's
+    whole budget is `deadline_sec` from `started`. The search gets cfg.SEARCH_BUDGET_SHARE of
+    it, so one ending without a route leaves the fallback time. `stats` collects the seconds
+    spent in the "search" and "fallback" phases, the CPU seconds of both ("cpu") and the
+    searches' heap pushes / edge relaxations.
+    Returns: (path_nodes, total_cost, expanded_count, degraded, reason, suboptimality_bound)
+    '''
+    stats = {} if stats is None else stats
+    hierarchy = profiles.hierarchy(pid)
+    cpu0 = time.thread_time()
+    t0 = time.perf_counter()
+    remaining = (deadline_sec - (t0 - started)) * cfg.SEARCH_BUDGET_SHARE
+    if hierarchy is not None:
+        path, cost, expanded, degraded, reason = hierarchy.query(s, t, remaining)
+        bound = 1.0 if path else None
+    else:
+        path, cost, expanded, degraded, reason, bound = run_search(G, profiles, coords, pid, s, t, remaining, mode, cfg, stats)
+    t1 = time.perf_counter()
+    stats["search"] = t1 - t0
+
+    if not path and reason != "no_path":
+        # fallback: fastest by base travel_time, within whatever budget is left
+        remaining = deadline_sec - (t1 - started)
+        if remaining > 0:
+            path, cost = dijkstra(G, s, t, profiles.weights[BASE_PROFILE], remaining, stats=stats)
+        if path:
+            degraded, reason, bound = True, "fallback_dijkstra", None
+        stats["fallback"] = time.perf_counter() - t1
+    stats["cpu"] = time.thread_time() - cpu0
+    return path, cost, expanded, degraded, reason, bound
+
+
+def compute_route(city, data_version, G, profiles, coords, pid, s, t, mode, deadline_sec, started, cfg):
+    '''
+    search_route in this thread, or in the search process pool when one is configured. Goes
+    through admission control first, which may cut the budget; raises Overloaded when the
+    search is rejected or the pool's queue is full.
+    '''
+    (src_lat, src_lon), (dst_lat, dst_lon) = coords[s], coords[t]
+    return admitted(city, pid, haversine(src_lat, src_lon, dst_lat, dst_lon) / 1000.0, deadline_sec, started,
+                    lambda budget_sec, stats: _compute_route(city, data_version, G, profiles, coords, pid, s, t, mode,
+                                                             budget_sec, started, cfg, stats))
+
+
+def admitted(city, pid, size, deadline_sec, started, run, kind="route", complete=None):
+    '''
+    run(deadline_sec, stats) under admission control, with the budget it grants; `run` puts
+    the search's CPU seconds in stats["cpu"]. complete(result) tells whether it finished
+    within the budget (default: a route result that did not time out). Raises Rejected (an
+    Overloaded).
+    '''
+    if ADMISSION is None:
+        return run(deadline_sec, {})
+    if complete is None:
+        complete = lambda result: result[4] not in ("timeout", "fallback_dijkstra")
+    elapsed = time.perf_counter() - started
+    ticket = ADMISSION.admit(city, pid, size, deadline_sec - elapsed, kind)
+    stats = {}
+    result = None
+    try:
+        result = run(elapsed + ticket.budget_sec, stats)
+        return result
+    finally:
+        if result is None:
+            ADMISSION.done(ticket)
+        elif "cpu" not in stats:
+            # the pool gave up on it: it took at least the budget
+            ADMISSION.done(ticket, ticket.budget_sec, complete=False)
+        else:
+            ADMISSION.done(ticket, stats["cpu"], complete=complete(result))
+
+
+def _compute_route(city, data_version, G, profiles, coords, pid, s, t, mode, deadline_sec, started, cfg, stats):
+    with DURATION.time():
+        if SEARCH_POOL is None:
+            result = search_route(G, profiles, coords, pid, s, t, mode, deadline_sec, started, cfg, stats)
+        else:
+            remaining = deadline_sec - (time.perf_counter() - started)
+            # absolute wall-clock deadline: time spent queued counts against the budget
+            args = (city, data_version, UPDATES.seq(city, data_version), s, t, pid, mode, time.time() + remaining)
+            submitted = time.perf_counter()
+            done = SEARCH_POOL.run(search_task, args, remaining)
+            if done is None:
+                result = ([], math.inf, 0, True, "timeout", None)
+            else:
+                result, task_stats = done
+                stats.update(task_stats)
+            stats["queue"] = time.perf_counter() - submitted - stats.get("search", 0.0) - stats.get("fallback", 0.0)
+    EXPANDED.observe(result[2])
+    observe_search(city, pid, stats)
+    return result
+
+
+def compute_tiled_route(tiled, pid, s, s_tile, t, t_tile, dist_km, deadline_sec, started):
+    '''
+    TiledCity.astar under admission control. The path is returned as flattened (osmid, tile)
+    pairs, the form the route cache stores for tiled cities.
+    '''
+    def run(budget_sec, stats):
+        with DURATION.time():
+            cpu0 = time.thread_time()
+            t0 = time.perf_counter()
+            path, cost, expanded, degraded, reason, bound = tiled.astar(
+                s, s_tile, t, t_tile, pid, budget_sec - (t0 - started), stats)
+            stats["search"] = time.perf_counter() - t0
+            stats["cpu"] = time.thread_time() - cpu0
+        EXPANDED.observe(expanded)
+        observe_search(tiled.city, pid, stats)
+        return [x for pair in path for x in pair], cost, expanded, degraded, reason, bound
+    return admitted(tiled.city, pid, dist_km, deadline_sec, started, run)
+
+
+def route_tiled(city, src, dst, constraints, pid, deadline_ms, deadline_sec, output, t0, started, cfg):
+    '''/route for a TILED_CITIES city: snapping, search and geometry on the tiles it touches.'''
+    geometry, simplify_m, include_nodes = output
+    with phase_timer("load", city, pid):
+        tiled = get_tiled(city, cfg)
+    try:
+        with phase_timer("snap", city, pid):
+            try:
+                (s, t), (s_tile, t_tile) = [a.tolist() for a in tiled.snap((src, dst))]
+            except ValueError as e:
+                FAILURES.labels(city=city, reason="no_road").inc()
+                return jsonify({"error": "no_road", "detail": str(e)}), 422
+
+        # cached on the snapped osmids under the city's data_version
+        remaining = deadline_sec - (time.perf_counter() - started)
+        wait_sec = max(0.0, min(cfg.COALESCE_WAIT_MS / 1000.0, remaining / 2))
+        dist_km = haversine(src[0], src[1], dst[0], dst[1]) / 1000.0
+        compute = lambda: compute_tiled_route(tiled, pid, s, s_tile, t, t_tile, dist_km, deadline_sec, started)
+        try:
+            result, tier = CACHE.get_or_compute(city, tiled.cache_version, s, t, pid, compute, wait_sec, ttl=cfg.CACHE_TTL)
+        except Overloaded as e:
+            FAILURES.labels(city=city, reason="overloaded").inc()
+            retry_after = getattr(e, "retry_after_sec", 1)
+            return jsonify({"error": "overloaded", "detail": str(e)}), 503, {"Retry-After": str(retry_after)}
+        path, cost, expanded, degraded, reason, bound = result
+        cache_hit = "false" if tier == "miss" else "true"
+
+        if len(path) == 0:
+            FAILURES.labels(city=city, reason=reason or "unreachable").inc()
+            REQUESTS.labels(city=city, degraded="true", cache_hit=cache_hit).inc()
+            if reason == "no_path":
+                return jsonify({"error": "no_path", "detail": f"no path between {s} and {t}"}), 422
+            return jsonify({"error": "timeout", "detail": f"no route found within {deadline_ms} ms"}), 504
+
+        with phase_timer("build", city, pid):
+            osmids, coords = tiled.geometry(np.asarray(path).reshape(-1, 2))
+            k = len(osmids)
+            resp = build_response(city, osmids, coords, 0, k - 1, constraints, np.arange(k), cost, expanded, degraded,
+                                  reason, bound, geometry, simplify_m, include_nodes)
+    except TilesChanged as e:
+        FAILURES.labels(city=city, reason="tiles_changed").inc()
+        return jsonify({"error": "city_loading", "detail": str(e)}), 503, {"Retry-After": "1"}
+    REQUESTS.labels(city=city, degraded=str(degraded), cache_hit=cache_hit).inc()
+    with phase_timer("serialize", city, pid):
+        out = make_response(resp, 200, {"X-Cache": tier})
+    if REQUEST_LOG is not None:
+        REQUEST_LOG.record(city, (src, dst), s, t, pid, deadline_ms, (time.perf_counter() - t0) * 1000.0, degraded, tier)
+    return out
+
+
+def tiled_unsupported(city, cfg, what):
+    '''400 response when `city` is tiled: `what` needs the whole graph.'''
+    if city not in cfg.TILED_CITIES:
+        return None
+    return jsonify({"error": "bad_request", "detail": f"{what} is not available for tiled city '{city}'"}), 400
+
+
+def compute_matrix(city, profiles, pid, sources, targets, include_paths, deadline_sec, started):
+    '''
+    Costs (and optionally paths) between snapped nodes, under admission control with the
+    number of cells as the work's size.
+    Returns: (costs float64[S, T], rows_done, paths or None)
+    '''
+    hierarchy = profiles.hierarchy(pid)
+
+    def run(budget_sec, stats):
+        cpu0 = time.thread_time()
+        paths = None
+        with DURATION.time():
+            remaining = budget_sec - (time.perf_counter() - started)
+            if hierarchy is not None:
+                costs, rows_done = bucket_matrix(hierarchy, sources.tolist(), targets.tolist(), remaining)
+                if include_paths:
+                    paths = [[None] * len(targets) for _ in sources]
+                    for i, s in enumerate(sources.tolist()[:rows_done]):
+                        for j, t in enumerate(targets.tolist()):
+                            remaining = budget_sec - (time.perf_counter() - started)
+                            if remaining <= 0 or not np.isfinite(costs[i, j]):
+                                continue
+                            paths[i][j] = hierarchy.query(s, t, remaining)[0] or None
+            else:
+                costs, rows_done, paths = dijkstra_matrix(profiles.csgraph(pid), sources, targets, remaining, include_paths)
+        stats["cpu"] = time.thread_time() - cpu0
+        return costs, rows_done, paths
+
+    # bucket queries and one Dijkstra per source cost orders of magnitude apart per cell
+    kind = "matrix.hierarchy" if hierarchy is not None else "matrix"
+    return admitted(city, pid, len(sources) * len(targets), deadline_sec, started, run, kind=kind,
+                    complete=lambda result: result[1] == len(sources))
+
+
+def observe_search(city, pid, stats):
+    for phase in ("queue", "search", "fallback"):
+        if phase in stats:
+            observe_phase(phase, city, pid, stats[phase])
+    labels = {"city": city, "profile": profile_name(pid)}
+    if stats.get("heap_pushes"):
+        HEAP_PUSHES.labels(**labels).inc(stats["heap_pushes"])
+    if stats.get("edge_relaxations"):
+        EDGE_RELAXATIONS.labels(**labels).inc(stats["edge_relaxations"])
+
+
+def init_search_process():
+    '''
+    Initializer of a pool process: edge updates are replayed on demand, not subscribed to,
+    and cities are loaded without spatial index (the worker snaps).
+    '''
+    global UPDATES
+    cfg = Config()
+    UPDATES = EdgeUpdates(Redis(host=cfg.REDIS_HOST, port=cfg.REDIS_PORT, db=cfg.REDIS_DB))
+    init_cities(cfg, spatial=False)
+
+
+def search_task(city, data_version, seq, s, t, pid, mode, deadline_at):
+    '''
+    Runs in a pool process: search_route on this process' (mmap-shared) copy of the city.
+    Returns: (result, stats) as for search_route
+    '''
+    cfg = Config()
+    entry = CITIES.peek(city)
+    if entry is not None and entry[5] != data_version:
+        CITIES.discard(city)
+    G, _, coords, _, profiles, data_version = load_city_if_needed(city, cfg)
+    if UPDATES.seq(city, data_version) < seq:
+        # catch up with the edge updates the requesting worker has applied
+        UPDATES.sync(city, data_version, G, profiles)
+    remaining = deadline_at - time.time()
+    if remaining <= 0:
+        return ([], math.inf, 0, True, "timeout", None), {}
+    stats = {}
+    path, cost, expanded, degraded, reason, bound = search_route(
+        G, profiles, coords, pid, s, t, mode, remaining, time.perf_counter(), cfg, stats)
+    return ([int(x) for x in path], cost, expanded, degraded, reason, bound), stats
+
+
+def parse_output(payload):
+    '''(geometry format, simplify tolerance in meters, include nodes) of a /route request; ValueError when invalid.'''
+    geometry = payload.get("geometry", "points")
+    if geometry not in GEOMETRY_FORMATS:
+        raise ValueError(f"geometry must be one of {', '.join(GEOMETRY_FORMATS)}")
+    try:
+        simplify_m = float(payload.get("simplify_m", 0.0))
+    except (TypeError, ValueError) as e:
+        raise ValueError("simplify_m must be a number") from e
+    if not 0.0 <= simplify_m < math.inf:
+        raise ValueError("simplify_m must be >= 0")
+    return geometry, simplify_m, bool(payload.get("include_nodes", True))
+
+
+def build_response(city, idx_to_node, coords, s, t, constraints, path, cost, expanded, degraded, reason, bound,
+                   geometry="points", simplify_m=0.0, include_nodes=True, points=None):
+    # osmids and geometry come from the in-memory graph (also for cache hits); `points`, when
+    # given, is the route's geometry including the edges' inner points
+    resp = {
+        "city": city,
+        "source_node": int(idx_to_node[s]),
+        "target_node": int(idx_to_node[t]),
+        "constraints": constraints,
+        "degraded": degraded,
+        "reason": reason or "",
+        "travel_time_sec_est": cost,
+        "suboptimality_bound": bound,
+        "expanded_nodes": expanded,
+    }
+    if include_nodes:
+        resp["nodes"] = idx_to_node[path]
+    if geometry != "none":
+        if points is None:
+            points = coords[path]
+        if simplify_m > 0:
+            points = points[simplify(points, simplify_m)]
+        if geometry == "points":
+            resp["geometry"] = [{"lat": lat, "lon": lon} for lat, lon in points.tolist()]
+        elif geometry == "coords":
+            resp["geometry"] = points  # [[lat, lon], ...]
+        else:
+            resp["geometry"] = encode_polyline(points, 6 if geometry == "polyline6" else 5)
+        resp["geometry_format"] = geometry
+    return resp
+
+
+def _msgpack_default(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"cannot serialize {type(obj).__name__}")
+
+
+def make_response(resp, status=200, headers=None):
+    '''
+    `resp` as MessagePack when the client's Accept prefers it, else as JSON (orjson, which
+    also writes numpy arrays directly).
+    '''
+    best = request.accept_mimetypes.best_match(("application/json",) + MSGPACK_TYPES, default="application/json")
+    if best in MSGPACK_TYPES:
+        body, mimetype = msgpack.packb(resp, default=_msgpack_default), "application/msgpack"
+    else:
+        body, mimetype = orjson.dumps(resp, option=orjson.OPT_SERIALIZE_NUMPY), "application/json"
+    RESPONSE_BYTES.labels(content_type=mimetype).observe(len(body))
+    return Response(body, status=status, headers=headers, mimetype=mimetype)
 
 
 def build_weight_func(constraints):
-    cc = 1.0 if constraints.get("cold_chain") else 0.0
-    hv = 1.0 if constraints.get("high_value") else 0.0
-    sc = 1.0 if constraints.get("security_conditions") else 0.0
-
-    # Penalty model: base on travel_time, add risk-sensitive multipliers
-    def weight(data):
-        tt = float(data.get("travel_time", data.get("length", 1.0) / 8.0))  # seconds
-        temp_risk = float(data.get("temp_risk", 0.3))      # 0..1
-        security_risk = float(data.get("security_risk", 0.3))  # 0..1
-        penalty = (cc * temp_risk) + (hv * security_risk) + (sc * security_risk * 0.8)
-        return tt * (1.0 + penalty)
+    # Penalty model: base on travel_time, add risk-sensitive multipliers (see profiles.edge_weights).
+    # Evaluated for every edge at once -> float64 cost array indexed by edge.
+    pid = profile_id(constraints)
+    def weight(G):
+        return edge_weights(G, pid)
     return weight
 
 
 def create_app():
     app = Flask(__name__)
     cfg = Config()
-    global CACHE
-    CACHE = Cache(cfg.REDIS_HOST, cfg.REDIS_PORT, cfg.REDIS_DB)
+    global CACHE, UPDATES, SEARCH_POOL, REQUEST_LOG, ADMISSION, SHARDS
+    SHARDS = ShardMap(cfg.ENGINE_ID, cfg.SHARD_ENGINES, cfg.SHARD_REPLICAS, cfg.CITY_REPLICAS)
+    CACHE = Cache(cfg.REDIS_HOST, cfg.REDIS_PORT, cfg.REDIS_DB,
+                  local_size=cfg.CACHE_LOCAL_SIZE, local_ttl=cfg.CACHE_LOCAL_TTL,
+                  lease_ms=cfg.COALESCE_LEASE_MS, ttl=cfg.CACHE_TTL,
+                  refresh_ahead_sec=cfg.CACHE_REFRESH_AHEAD_SEC)
+    UPDATES = EdgeUpdates(CACHE.r)
+    init_cities(cfg)
+    UPDATES.listen(on_edge_update)
+    if cfg.SEARCH_PROCESSES > 0:
+        SEARCH_POOL = SearchPool(cfg.SEARCH_PROCESSES, cfg.SEARCH_PROCESSES * cfg.SEARCH_QUEUE_DEPTH,
+                                 initializer=init_search_process)
+    if cfg.ADMISSION_CONTROL:
+        # in-thread searches share the GIL: one at a time makes progress
+        ADMISSION = AdmissionController(max(1, cfg.SEARCH_PROCESSES), cfg.ADMISSION_MIN_BUDGET_MS / 1000.0,
+                                        cfg.ADMISSION_HEADROOM)
+    if cfg.PRELOAD_CITIES:
+        # in the background, so the worker answers /healthz meanwhile; requests for a city
+        # being preloaded wait for it (or get a 503)
+        threading.Thread(target=preload_cities, args=(cfg,), daemon=True, name="preload").start()
+    if cfg.REQUEST_LOG_DIR:
+        REQUEST_LOG = demand.RequestLog(cfg.REQUEST_LOG_DIR, cfg.REQUEST_LOG_SAMPLE,
+                                        cfg.REQUEST_LOG_MAX_MB * 2**20, cfg.REQUEST_LOG_BACKUPS)
+        if cfg.PREWARM_HOURS:
+            threading.Thread(target=prewarm_scheduler, args=(cfg,), daemon=True, name="prewarm").start()
 
     # attach /metrics
     app.wsgi_app = DispatcherMiddleware(app.wsgi_app, {"/metrics": make_wsgi_app()})
 
+    @app.errorhandler(CityLoading)
+    def city_loading(e):
+        FAILURES.labels(city=e.city, reason="city_loading").inc()
+        return jsonify({"error": "city_loading", "detail": str(e)}), 503, {"Retry-After": "1"}
+
     @app.get("/healthz")
     def healthz():
         return {"ok": True}, 200
 
+    @app.get("/cities")
+    def cities():
+        '''Discovery for app.sharding: the ring, and every ingested city with its owners.'''
+        loaded = set(CITIES.cities()) | set(TILED)
+        listed = [{
+            "city": name,
+            "data_version": version,
+            "owners": SHARDS.owners(name),
+            "served": SHARDS.owns(name),
+            "tiled": name in cfg.TILED_CITIES,
+            "loaded": name in loaded,  # by the worker answering
+        } for name, version in get_db(cfg).list_cities()]
+        return jsonify({
+            "engine": cfg.ENGINE_ID or socket.gethostname(),
+            "engines": SHARDS.engines,
+            "default_city": cfg.DEFAULT_CITY,
+            "served": [c["city"] for c in listed if c["served"]],
+            "cities": listed,
+        }), 200
+
     @app.post("/route")
     def route():
+        t0 = time.perf_counter()
         payload = request.get_json(force=True)
         city = (payload.get("city") or cfg.DEFAULT_CITY).lower()
         src = payload["source"]
         dst = payload["target"]
         constraints = payload.get("constraints", {})
         deadline_ms = int(payload.get("deadline_ms", cfg.ROUTE_DEADLINE_MS))
-
-        # cache lookup first
-        cached = CACHE.get(city, src, dst, constraints)
-        if cached:
-            REQUESTS.labels(city=city, degraded=str(cached.get("degraded", False)), cache_hit="true").inc()
-            return jsonify(cached), 200
-
-        # ensure graph is loaded
-        G, idx_to_node, coords = load_city_if_needed(city, cfg)
-
+        mode = payload.get("search_mode", cfg.SEARCH_MODE)
+        if mode not in ("anytime", "bidirectional", "astar"):
+            return jsonify({"error": "bad_request", "detail": "search_mode must be anytime, bidirectional or astar"}), 400
+        try:
+            geometry, simplify_m, include_nodes = parse_output(payload)
+        except ValueError as e:
+            return jsonify({"error": "bad_request", "detail": str(e)}), 400
         try:
             src_lat = float(src.get("lat"))
             src_lon = float(src.get("lon"))
@@ -81,59 +747,191 @@ def create_app():
             dst_lon = float(dst.get("lon"))
         except (TypeError, ValueError):
             return jsonify({"error": "bad_request", "detail": "source/target lat/lon must be numbers"}), 400
+        pid = profile_id(constraints)
 
-        # map lat/lon to nearest osmid
-        src_arr = np.array([src_lat, src_lon], dtype=np.float64)
-        dst_arr = np.array([dst_lat, dst_lon], dtype=np.float64)
-        # rough nearest (euclidean in lat/lon) - OK for city scale
-        s_idx = np.argmin(np.sum((coords - src_arr) ** 2, axis=1))
-        t_idx = np.argmin(np.sum((coords - dst_arr) ** 2, axis=1))
-        s = int(idx_to_node[s_idx]); t = int(idx_to_node[t_idx])
+        started = time.perf_counter()
+        observe_phase("parse", city, pid, started - t0)
+        # past the proxy's timeout nobody reads the answer
+        deadline_sec = max(0.05, min(deadline_ms, cfg.UPSTREAM_TIMEOUT_MS) / 1000.0)
+        refused = misdirected(city)
+        if refused:
+            return refused
+        if city in cfg.TILED_CITIES:
+            return route_tiled(city, (src_lat, src_lon), (dst_lat, dst_lon), constraints, pid, deadline_ms, deadline_sec,
+                               (geometry, simplify_m, include_nodes), t0, started, cfg)
 
-        # build heuristic using haversine -> optimistic travel time assuming 60 km/h
-        def heuristic(node):
-            ndata = G.nodes[node]
-            dist_m = haversine(ndata["y"], ndata["x"], dst_arr[0], dst_arr[1])
-            return dist_m / 16.6666667  # seconds at 60 km/h (≈16.67 m/s)
+        # ensure graph is loaded
+        with phase_timer("load", city, pid):
+            G, idx_to_node, coords, index, profiles, data_version = load_city_if_needed(city, cfg)
+            version = UPDATES.version(city, data_version)  # cache entries die with every graph change
 
-        weight_func = build_weight_func(constraints)
+        # map lat/lon to nearest node (both points in one spatial index query)
+        with phase_timer("snap", city, pid):
+            src_arr = np.array([src_lat, src_lon], dtype=np.float64)
+            dst_arr = np.array([dst_lat, dst_lon], dtype=np.float64)
+            s, t = snap_points(index, np.stack((src_arr, dst_arr)), cfg).tolist()  # node indices into G
 
-        # run
-        deadline_sec = max(0.05, deadline_ms / 1000.0)
-        with DURATION.time():
-            path, cost, expanded, degraded, reason = astar_with_deadline(G, s, t, heuristic, weight_func, deadline_sec)
-        EXPANDED.observe(expanded)
+        # cache lookup on the snapped nodes, so nearby requests share entries; concurrent
+        # misses for the same route wait on one computation (here or on another engine)
+        remaining = deadline_sec - (time.perf_counter() - started)
+        wait_sec = max(0.0, min(cfg.COALESCE_WAIT_MS / 1000.0, remaining / 2))
+        compute = lambda: compute_route(city, data_version, G, profiles, coords, pid, s, t, mode, deadline_sec, started, cfg)
+        try:
+            result, tier = CACHE.get_or_compute(city, version, s, t, pid, compute, wait_sec, ttl=cfg.CACHE_TTL)
+        except Overloaded as e:
+            # search queue full, or rejected by admission control
+            FAILURES.labels(city=city, reason="overloaded").inc()
+            retry_after = getattr(e, "retry_after_sec", 1)
+            return jsonify({"error": "overloaded", "detail": str(e)}), 503, {"Retry-After": str(retry_after)}
+        path, cost, expanded, degraded, reason, bound = result
+        cache_hit = "false" if tier == "miss" else "true"
 
-        if not path:
-            # hard fallback: try fastest by base travel_time
-            try:
-                path = nx.shortest_path(G, s, t, weight="travel_time")
-                degraded = True
-                reason = "fallback_dijkstra"
-                # estimate cost
-                cost = sum(G.edges[u, v].get("travel_time", 1.0) for u, v in zip(path[:-1], path[1:]))
-            except Exception as e:
-                FAILURES.labels(city=city, reason=reason or "unreachable").inc()
-                REQUESTS.labels(city=city, degraded="true", cache_hit="false").inc()
-                return jsonify({"error": "no_path", "detail": str(e)}), 422
-
-        # build coordinates
-        coords_out = [{"lat": float(G.nodes[n]["y"]), "lon": float(G.nodes[n]["x"])} for n in path]
+        if len(path) == 0:
+            FAILURES.labels(city=city, reason=reason or "unreachable").inc()
+            REQUESTS.labels(city=city, degraded="true", cache_hit=cache_hit).inc()
+            if reason == "no_path":
+                return jsonify({"error": "no_path", "detail": f"no path between {int(idx_to_node[s])} and {int(idx_to_node[t])}"}), 422
+            return jsonify({"error": "timeout", "detail": f"no route found within {deadline_ms} ms"}), 504
+
+        with phase_timer("build", city, pid):
+            points = G.path_points(path, profiles.weights[pid]) if geometry != "none" else None
+            resp = build_response(city, idx_to_node, coords, s, t, constraints, path, cost, expanded, degraded, reason, bound,
+                                  geometry, simplify_m, include_nodes, points)
+        REQUESTS.labels(city=city, degraded=str(degraded), cache_hit=cache_hit).inc()
+        with phase_timer("serialize", city, pid):
+            out = make_response(resp, 200, {"X-Cache": tier})
+        if REQUEST_LOG is not None:
+            REQUEST_LOG.record(city, ((src_lat, src_lon), (dst_lat, dst_lon)), idx_to_node[s], idx_to_node[t], pid,
+                               deadline_ms, (time.perf_counter() - t0) * 1000.0, degraded, tier)
+        return out
+
+    @app.post("/matrix")
+    def matrix():
+        payload = request.get_json(force=True)
+        city = (payload.get("city") or cfg.DEFAULT_CITY).lower()
+        constraints = payload.get("constraints", {})
+        deadline_ms = int(payload.get("deadline_ms", cfg.ROUTE_DEADLINE_MS))
+        include_paths = bool(payload.get("include_paths", False))
+        started = time.perf_counter()
+        # past the proxy's timeout nobody reads the answer
+        deadline_sec = max(0.05, min(deadline_ms, cfg.UPSTREAM_TIMEOUT_MS) / 1000.0)
+        refused = misdirected(city) or tiled_unsupported(city, cfg, "/matrix")
+        if refused:
+            return refused
+
+        try:
+            src_pts = parse_points(payload.get("sources"))
+            dst_pts = parse_points(payload.get("targets"))
+        except ValueError as e:
+            return jsonify({"error": "bad_request", "detail": f"sources/targets: {e}"}), 400
+        cells = len(src_pts) * len(dst_pts)
+        if cells > cfg.MATRIX_MAX_CELLS:
+            return jsonify({"error": "bad_request", "detail": f"{cells} cells exceeds the limit of {cfg.MATRIX_MAX_CELLS}"}), 400
+
+        G, idx_to_node, coords, index, profiles, _ = load_city_if_needed(city, cfg)
+
+        # snap every point in one spatial index query
+        snapped = snap_points(index, np.concatenate((src_pts, dst_pts)), cfg)
+        sources, targets = snapped[:len(src_pts)], snapped[len(src_pts):]
+
+        pid = profile_id(constraints)
+        try:
+            costs, rows_done, paths = compute_matrix(city, profiles, pid, sources, targets, include_paths, deadline_sec, started)
+        except Overloaded as e:
+            FAILURES.labels(city=city, reason="overloaded").inc()
+            retry_after = getattr(e, "retry_after_sec", 1)
+            return jsonify({"error": "overloaded", "detail": str(e)}), 503, {"Retry-After": str(retry_after)}
+        MATRIX_CELLS.observe(cells)
+
+        degraded = rows_done < len(sources)
+        if include_paths and not degraded:
+            # pairs whose path could not be unpacked in time
+            degraded = any(p is None for row, c in zip(paths, costs) for p, x in zip(row, c) if np.isfinite(x))
         resp = {
             "city": city,
-            "source_node": s,
-            "target_node": t,
+            "source_nodes": idx_to_node[sources].tolist(),
+            "target_nodes": idx_to_node[targets].tolist(),
             "constraints": constraints,
             "degraded": degraded,
-            "reason": reason or "",
-            "travel_time_sec_est": cost,
-            "nodes": path,
-            "geometry": coords_out,
-            "expanded_nodes": expanded,
+            "reason": "timeout" if degraded else "",
+            # unreachable pairs and rows not computed in time are null
+            "costs": [[c if c < np.inf else None for c in row] for row in costs.tolist()],
         }
+        if include_paths:
+            resp["paths"] = [[idx_to_node[p].tolist() if p is not None else None for p in row] for row in paths]
+        return make_response(resp)
+
+    @app.post("/admin/edges")
+    def update_edges():
+        denied = admin_denied(cfg)
+        if denied:
+            return denied
+        payload = request.get_json(force=True)
+        city = (payload.get("city") or cfg.DEFAULT_CITY).lower()
+        refused = misdirected(city) or tiled_unsupported(city, cfg, "live edge updates")
+        if refused:
+            return refused
+        try:
+            batch = parse_batch(payload.get("updates"))
+        except ValueError as e:
+            return jsonify({"error": "bad_request", "detail": str(e)}), 400
 
-        CACHE.set(city, src, dst, constraints, resp, ttl=3600)
-        REQUESTS.labels(city=city, degraded=str(degraded), cache_hit="false").inc()
-        return jsonify(resp), 200
+        G, _, _, _, profiles, data_version = load_city_if_needed(city, cfg)
+        edges, rows = resolve_edges(G, batch)
+        if len(edges) == 0:
+            return jsonify({"error": "no_edges", "detail": "none of the (u, v) pairs is an edge of the city graph"}), 422
+        seq = UPDATES.publish(city, data_version, batch)
+        # this worker applies it right away; the others via the pub/sub subscriber
+        UPDATES.sync(city, data_version, G, profiles)
+        return jsonify({
+            "city": city,
+            "data_version": data_version,
+            "seq": seq,
+            "updates": len(batch["u"]),
+            "matched_updates": int(len(np.unique(rows))),
+            "edges": int(len(edges)),
+        }), 200
+
+    @app.post("/admin/prewarm")
+    def prewarm():
+        denied = admin_denied(cfg)
+        if denied:
+            return denied
+        if REQUEST_LOG is None:
+            return jsonify({"error": "disabled", "detail": "the request log is off (REQUEST_LOG_DIR unset)"}), 409
+        payload = request.get_json(silent=True) or {}
+        try:
+            top_k = int(payload.get("top_k", cfg.PREWARM_TOP_K))
+            budget_sec = float(payload.get("budget_sec", cfg.PREWARM_BUDGET_SEC))
+        except (TypeError, ValueError):
+            return jsonify({"error": "bad_request", "detail": "top_k and budget_sec must be numbers"}), 400
+        if top_k < 1 or budget_sec <= 0:
+            return jsonify({"error": "bad_request", "detail": "need top_k >= 1 and budget_sec > 0"}), 400
+        if _PREWARM_LOCK.locked():
+            return jsonify({"error": "busy", "detail": "a pre-warm is already running in this worker"}), 409
+        # longer than any proxy timeout: runs in the background, results in the log and metrics
+        threading.Thread(target=run_prewarm, args=(cfg, top_k, budget_sec), daemon=True, name="prewarm-admin").start()
+        return jsonify({"started": True, "top_k": top_k, "budget_sec": budget_sec, "worker_pid": os.getpid()}), 202
+
+    @app.post("/admin/profile")
+    def profile():
+        denied = admin_denied(cfg)
+        if denied:
+            return denied
+        params = {**request.args.to_dict(), **(request.get_json(silent=True) or {})}
+        try:
+            seconds = float(params.get("seconds", 10))
+            interval_ms = float(params.get("interval_ms", 10))
+        except (TypeError, ValueError):
+            return jsonify({"error": "bad_request", "detail": "seconds and interval_ms must be numbers"}), 400
+        if not 0 < seconds <= cfg.PROFILE_MAX_SEC or not 1 <= interval_ms <= 1000:
+            return jsonify({"error": "bad_request", "detail": f"need 0 < seconds <= {cfg.PROFILE_MAX_SEC} and 1 <= interval_ms <= 1000"}), 400
+        include_idle = str(params.get("idle", "")).lower() in ("1", "true")
+        try:
+            folded, passes = profiler.sample(seconds, interval_ms / 1000.0, include_idle)
+        except profiler.ProfilerBusy as e:
+            return jsonify({"error": "busy", "detail": str(e)}), 409
+        return folded, 200, {"Content-Type": "text/plain; charset=utf-8", "X-Samples": str(passes),
+                             "X-Worker-Pid": str(os.getpid()), "X-Engine-Id": cfg.ENGINE_ID or socket.gethostname()}
 
     return app
@@ -0,0 +1,117 @@
+'''
+Many-to-many cost matrices.
+
+With a hierarchy (CH or customized CCH) the matrix comes from the bucket algorithm: one
+backward upward search per target leaves (target, distance) entries in buckets at every
+node it reaches, then one forward upward search per source scans the buckets of the
+nodes it reaches. Each search touches only a small upward search space, so an N x M
+matrix costs N + M tiny searches instead of N * M point-to-point queries.
+
+Without a hierarchy, scipy's C Dijkstra runs one full one-to-all search per source.
+
+Both work through the sources under one deadline; rows not reached in time stay inf.
+'''
+import heapq
+import math
+import time
+
+import numpy as np
+from scipy.sparse.csgraph import dijkstra as sp_dijkstra
+
+# sources per scipy Dijkstra call (the deadline is checked between calls)
+_CHUNK = 8
+
+
+def upward_search(offsets, neighbors, weights, root):
+    '''Dijkstra restricted to one upward graph of a hierarchy -> {node: dist}.'''
+    dist = {root: 0.0}
+    heap = [(0.0, root)]
+    settled = {}
+    while heap:
+        d, v = heapq.heappop(heap)
+        if v in settled:
+            continue
+        settled[v] = d
+        lo, hi = offsets[v], offsets[v + 1]
+        for x, w in zip(neighbors[lo:hi].tolist(), weights[lo:hi].tolist()):
+            nd = d + w
+            if nd < dist.get(x, math.inf):
+                dist[x] = nd
+                heapq.heappush(heap, (nd, x))
+    return settled
+
+
+def bucket_matrix(hierarchy, sources, targets, deadline_sec=math.inf):
+    '''
+    Cost matrix over a ContractionHierarchy.
+    Returns: (costs float64[len(sources), len(targets)], rows_done)
+    '''
+    start_time = time.perf_counter()
+    costs = np.full((len(sources), len(targets)), np.inf)
+
+    bucket_j, bucket_d = {}, {}
+    for j, t in enumerate(targets):
+        if time.perf_counter() - start_time > deadline_sec:
+            return costs, 0
+        for v, d in upward_search(hierarchy.down_offsets, hierarchy.down_sources,
+                                  hierarchy.down_weights, t).items():
+            bucket_j.setdefault(v, []).append(j)
+            bucket_d.setdefault(v, []).append(d)
+    buckets = {v: (np.asarray(js, dtype=np.int64), np.asarray(bucket_d[v]))
+               for v, js in bucket_j.items()}
+
+    for i, s in enumerate(sources):
+        if time.perf_counter() - start_time > deadline_sec:
+            return costs, i
+        row = costs[i]
+        for v, d in upward_search(hierarchy.up_offsets, hierarchy.up_targets,
+                                  hierarchy.up_weights, s).items():
+            hit = buckets.get(v)
+            if hit is not None:
+                np.minimum.at(row, hit[0], d + hit[1])
+    return costs, len(sources)
+
+
+def dijkstra_matrix(csgraph, sources, targets, deadline_sec=math.inf, with_paths=False):
+    '''
+    Cost matrix from one-to-all searches on a scipy CSR matrix of the city graph.
+    Returns: (costs, rows_done, paths) where paths[i][j] is a node list (or None) when
+    `with_paths`, else paths is None.
+    '''
+    start_time = time.perf_counter()
+    sources = np.asarray(sources, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+    costs = np.full((len(sources), len(targets)), np.inf)
+    paths = [[None] * len(targets) for _ in sources] if with_paths else None
+    # duplicated sources are searched once
+    unique, inverse = np.unique(sources, return_inverse=True)
+    done = np.zeros(len(unique), dtype=bool)
+
+    for lo in range(0, len(unique), _CHUNK):
+        if time.perf_counter() - start_time > deadline_sec:
+            break
+        chunk = unique[lo:lo + _CHUNK]
+        if with_paths:
+            dist, pred = sp_dijkstra(csgraph, directed=True, indices=chunk, return_predecessors=True)
+        else:
+            dist = sp_dijkstra(csgraph, directed=True, indices=chunk)
+        for k in range(len(chunk)):
+            rows = np.flatnonzero(inverse == lo + k)
+            costs[rows] = dist[k, targets]
+            if with_paths:
+                for j, t in enumerate(targets.tolist()):
+                    path = _pred_path(pred[k], int(chunk[k]), t) if np.isfinite(dist[k, t]) else None
+                    for i in rows.tolist():
+                        paths[i][j] = path
+        done[lo:lo + len(chunk)] = True
+
+    rows_done = int(done[inverse].sum())
+    return costs, rows_done, paths
+
+
+def _pred_path(pred, source, target):
+    path = [target]
+    while path[-1] != source:
+        path.append(int(pred[path[-1]]))
+    path.reverse()
+    return path
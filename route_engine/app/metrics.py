@@ -1,6 +1,47 @@
-from prometheus_client import Counter, Histogram
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from .profiles import profile_name
 
 REQUESTS = Counter("route_requests_total", "Total route requests", ["city", "degraded", "cache_hit"])
 FAILURES = Counter("route_failures_total", "Route calculation failures", ["city", "reason"])
+SHARD_REQUESTS = Counter("route_shard_requests_total", "Requests by city ownership: owned, failover (sent by nginx after the owners failed), unmapped (a city nginx has no upstream for yet) or misdirected (421)", ["city", "result"])
 DURATION = Histogram("route_duration_seconds", "Route calculation duration (seconds)", buckets=[0.05,0.1,0.2,0.5,1,1.5,2,2.5,3,4,5,10])
 EXPANDED = Histogram("astar_expanded_nodes", "Number of nodes expanded by A*", buckets=[10,50,100,200,400,800,1600,3200,6400])
+MATRIX_CELLS = Histogram("route_matrix_cells", "Cells (sources x targets) per matrix request", buckets=[1,10,100,1000,10000,100000,250000])
+CACHE_LOOKUPS = Counter("route_cache_lookups_total", "Route cache lookups per tier", ["tier", "result"])
+CACHE_LATENCY = Histogram("route_cache_lookup_seconds", "Route cache lookup latency per tier (seconds)", ["tier"], buckets=[0.00001,0.00005,0.0001,0.0005,0.001,0.0025,0.005,0.01,0.05])
+CACHE_REFRESHES = Counter("route_cache_refreshes_total", "Cached routes whose TTL was reset: on a hit near expiry (ahead) or by the pre-warm job (prewarm)", ["kind"])
+PREWARM_ROUTES = Counter("route_prewarm_routes_total", "Routes handled by the cache pre-warm job", ["city", "result"])
+COALESCED = Counter("route_coalesced_total", "Route computations avoided or waited on by request coalescing", ["kind"])
+CITIES_RESIDENT = Gauge("route_cities_resident", "Cities loaded in this worker")
+CITY_MEMORY = Gauge("route_city_memory_bytes", "Estimated memory of a loaded city (graph, profiles, indexes)", ["city"])
+CITY_LOAD_SECONDS = Histogram("route_city_load_seconds", "City load time, snapshot or Postgres (seconds)", ["city"], buckets=[0.1,0.25,0.5,1,2,5,10,30,60,120,300])
+CITY_EVICTIONS = Counter("route_city_evictions_total", "Cities evicted to stay within the memory budget", ["city"])
+TILES_RESIDENT = Gauge("route_tiles_resident", "Tiles of a tiled city loaded in this worker", ["city"])
+TILE_MEMORY = Gauge("route_tile_memory_bytes", "Estimated memory of the resident tiles of a tiled city", ["city"])
+TILE_LOADS = Counter("route_tile_loads_total", "Tiles loaded from Postgres: around snapped points, along the OD corridor, or when a search reached them (frontier)", ["city", "reason"])
+TILE_LOAD_SECONDS = Histogram("route_tile_load_seconds", "Time per batch of tiles loaded (seconds)", ["city"], buckets=[0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5])
+TILE_EVICTIONS = Counter("route_tile_evictions_total", "Tiles evicted to stay within TILE_CACHE_MB", ["city"])
+PHASE = Histogram("route_phase_seconds", "Time per /route phase (seconds)", ["phase", "city", "profile"], buckets=[0.0001,0.00025,0.0005,0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5])
+HEAP_PUSHES = Counter("route_heap_pushes_total", "Priority queue pushes of route searches (A*, fallback Dijkstra)", ["city", "profile"])
+EDGE_RELAXATIONS = Counter("route_edge_relaxations_total", "Edges relaxed by route searches (A*, fallback Dijkstra)", ["city", "profile"])
+ADMISSIONS = Counter("route_admissions_total", "Admission decisions for route searches: admitted, shrunk (budget cut) or rejected (503)", ["city", "decision"])
+SEARCHES_IN_FLIGHT = Gauge("route_searches_in_flight", "Route searches admitted and not finished in this worker")
+ADMISSION_BACKLOG = Gauge("route_admission_backlog_seconds", "Estimated CPU seconds of in-flight searches per search slot in this worker")
+RESPONSE_BYTES = Histogram("route_response_bytes", "Size of /route and /matrix response bodies", ["content_type"], buckets=[256,1024,4096,16384,65536,262144,1048576,4194304])
+
+
+def observe_phase(phase, city, pid, seconds):
+    PHASE.labels(phase=phase, city=city, profile=profile_name(pid)).observe(seconds)
+
+
+@contextmanager
+def phase_timer(phase, city, pid):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_phase(phase, city, pid, time.perf_counter() - started)
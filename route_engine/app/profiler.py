@@ -0,0 +1,61 @@
+'''
+On-demand sampling profiler for a live worker.
+
+A sampling pass snapshots the Python stack of every other thread of the process every
+`interval_sec` for `duration_sec` and counts identical stacks. The result is in the
+"folded" format (`thread;outer;...;inner <count>` per line) that flamegraph.pl, speedscope
+and inferno read. Only this process is sampled; searches running in the process pool
+(SEARCH_PROCESSES) are not.
+'''
+import collections
+import os
+import sys
+import threading
+import time
+
+# leaf frames in these stdlib modules are threads blocked on I/O or locks
+_IDLE_MODULES = ("threading.py", "selectors.py", "socket.py", "queue.py", "ssl.py", "socketserver.py")
+
+_running = threading.Lock()
+
+
+class ProfilerBusy(RuntimeError):
+    pass
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample(duration_sec, interval_sec, include_idle=False):
+    '''
+    Returns (folded stack text, number of sampling passes). One pass per process at a
+    time: raises ProfilerBusy while another one runs.
+    '''
+    if not _running.acquire(blocking=False):
+        raise ProfilerBusy("a profile is already being taken in this worker")
+    try:
+        me = threading.get_ident()
+        counts = collections.Counter()
+        passes = 0
+        deadline = time.monotonic() + duration_sec
+        while time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                if not include_idle and os.path.basename(frame.f_code.co_filename) in _IDLE_MODULES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                counts[";".join(reversed(stack))] += 1
+            passes += 1
+            time.sleep(interval_sec)
+        folded = "".join(f"{stack} {n}\n" for stack, n in counts.most_common())
+        return folded, passes
+    finally:
+        _running.release()
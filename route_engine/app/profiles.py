@@ -0,0 +1,151 @@
+'''
+Constraint profiles and their per-edge cost arrays.
+
+The cost only depends on three booleans, so there are 8 profiles. A profile id is the
+bitmask cold_chain | high_value << 1 | security_conditions << 2; id 0 is plain travel time.
+'''
+import threading
+
+import numpy as np
+
+FLAGS = ("cold_chain", "high_value", "security_conditions")
+NUM_PROFILES = 1 << len(FLAGS)
+BASE_PROFILE = 0
+
+
+def profile_id(constraints):
+    pid = 0
+    for bit, flag in enumerate(FLAGS):
+        if constraints.get(flag):
+            pid |= 1 << bit
+    return pid
+
+
+def profile_name(pid):
+    return "+".join(f for bit, f in enumerate(FLAGS) if pid >> bit & 1) or "base"
+
+
+def edge_weights(G, pid, edges=None):
+    '''
+    Per-edge cost for a profile, as documented in the README:
+    travel_time * (1 + cold_chain*temp_risk + high_value*security_risk + 0.8*security_conditions*security_risk)
+    Same float64 operations, in the same order, as evaluating the formula edge by edge.
+    With `edges`, only those edges' costs are returned.
+    '''
+    sel = slice(None) if edges is None else edges
+    cc, hv, sc = (float(pid >> bit & 1) for bit in range(len(FLAGS)))
+    tt = G.travel_time[sel].astype(np.float64)               # seconds
+    temp_risk = G.temp_risk[sel].astype(np.float64)          # 0..1
+    security_risk = G.security_risk[sel].astype(np.float64)  # 0..1
+    penalty = (cc * temp_risk) + (hv * security_risk) + (sc * security_risk * 0.8)
+    return tt * (1.0 + penalty)
+
+
+class ProfileSet:
+    '''
+    Everything routing needs per (city, profile): the 8 cost arrays, computed once at load
+    unless given (e.g. mapped from a snapshot), optional ALT landmark tables, and a speedup
+    hierarchy per profile. A witness-based CH
+    (base profile only) is used as-is; a CCH topology is customized per profile in a
+    background thread on first use.
+    '''
+
+    def __init__(self, G, ch=None, cch=None, landmarks=None, weights=None):
+        self.G = G
+        self.landmarks = landmarks
+        if weights is None:
+            weights = [edge_weights(G, pid) for pid in range(NUM_PROFILES)]
+        self.weights = list(weights)
+        for w in self.weights:
+            w.flags.writeable = False
+        self.cch = cch
+        self._hierarchies = [None] * NUM_PROFILES
+        if ch is not None:
+            self._hierarchies[BASE_PROFILE] = ch
+        self._customizing = set()
+        self._lock = threading.Lock()
+        self._csgraphs = [None] * NUM_PROFILES
+        # per profile, bumped by update_edges; stale customizations are discarded
+        self._generations = [0] * NUM_PROFILES
+
+    @property
+    def nbytes(self):
+        total = sum(w.nbytes for w in self.weights)
+        total += sum(h.nbytes for h in self._hierarchies if h is not None)
+        total += sum(m.data.nbytes + m.indices.nbytes + m.indptr.nbytes for m in self._csgraphs if m is not None)
+        if self.landmarks is not None:
+            total += self.landmarks.nbytes
+        return total
+
+    def hierarchy(self, pid):
+        '''Ready hierarchy for the profile, or None (customization is then started).'''
+        h = self._hierarchies[pid]
+        if h is not None or self.cch is None:
+            return h
+        with self._lock:
+            if pid not in self._customizing:
+                self._customizing.add(pid)
+                threading.Thread(target=self._customize, args=(pid,), daemon=True,
+                                 name=f"cch-customize-{pid}").start()
+        return None
+
+    def csgraph(self, pid):
+        '''scipy matrix of the graph under the profile's costs, built on first use (matrix queries).'''
+        m = self._csgraphs[pid]
+        if m is None:
+            m = self._csgraphs[pid] = self.G.csr_matrix(self.weights[pid])
+        return m
+
+    def customize_all(self):
+        '''Synchronously customize every profile that has no hierarchy yet.'''
+        if self.cch is None:
+            return
+        for pid in range(NUM_PROFILES):
+            if self._hierarchies[pid] is None:
+                self._hierarchies[pid] = self.cch.customize(self.G, self.weights[pid])
+
+    def update_edges(self, edges):
+        '''
+        Recompute every profile's cost of `edges` after G's edge attributes changed. A cost
+        array that changes is replaced by an updated copy, so a search in flight keeps a
+        consistent view; profiles the update leaves alone (e.g. a temp_risk change for those
+        without cold_chain) keep their arrays and hierarchies. Changed profiles drop their
+        hierarchy (a CCH is re-customized on demand; a witness CH is lost until the next load),
+        and ALT bounds are dropped too if any cost went down.
+        '''
+        edges = np.asarray(edges, dtype=np.int64)
+        decreased = False
+        changed = {}
+        for pid in range(NUM_PROFILES):
+            old = self.weights[pid][edges]
+            new = edge_weights(self.G, pid, edges)
+            if np.array_equal(new, old):
+                continue
+            decreased |= bool((new < old).any())
+            w = self.weights[pid].copy()
+            w[edges] = new
+            w.flags.writeable = False
+            changed[pid] = w
+        if not changed:
+            return
+        with self._lock:
+            weights = list(self.weights)
+            for pid, w in changed.items():
+                weights[pid] = w
+                self._generations[pid] += 1
+                self._hierarchies[pid] = None
+                self._csgraphs[pid] = None
+            self.weights = weights
+            if decreased:
+                self.landmarks = None
+
+    def _customize(self, pid):
+        generation = self._generations[pid]
+        hierarchy = None
+        try:
+            hierarchy = self.cch.customize(self.G, self.weights[pid])
+        finally:
+            with self._lock:
+                if hierarchy is not None and generation == self._generations[pid]:
+                    self._hierarchies[pid] = hierarchy
+                self._customizing.discard(pid)
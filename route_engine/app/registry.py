@@ -0,0 +1,138 @@
+'''
+Loaded cities of one worker.
+
+Every city is loaded exactly once: the first request for it runs the loader, concurrent
+requests for the same city wait for that load (up to `wait_sec`, then CityLoading, which the
+app turns into a 503) and share its outcome. Loaded cities are kept in LRU order and the least
+recently used ones are evicted once the estimated footprint of all of them exceeds the memory
+budget. Eviction only drops the registry's reference: requests holding the city finish on it.
+'''
+import collections
+import logging
+import threading
+import time
+
+from .metrics import CITIES_RESIDENT, CITY_MEMORY, CITY_LOAD_SECONDS, CITY_EVICTIONS
+
+# footprints grow after load (hierarchies, scipy matrices, edge index): re-checked on hits this often
+_RECHECK_SEC = 10.0
+
+log = logging.getLogger(__name__)
+
+
+class CityLoading(RuntimeError):
+    def __init__(self, city):
+        super().__init__(f"city '{city}' is still loading")
+        self.city = city
+
+
+class _Load:
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+        self.error = None
+
+
+class CityRegistry:
+    def __init__(self, loader, sizeof, budget_bytes=0, on_loaded=None):
+        '''
+        loader(city) -> entry; sizeof(entry) -> estimated bytes; budget_bytes 0 = unlimited.
+        on_loaded(city, entry) runs once the entry is registered.
+        '''
+        self.loader = loader
+        self.sizeof = sizeof
+        self.budget_bytes = budget_bytes
+        self.on_loaded = on_loaded
+        self._entries = collections.OrderedDict()  # city -> entry, least recently used first
+        self._loads = {}  # city -> _Load in progress
+        self._lock = threading.Lock()
+        self._checked = time.monotonic()
+
+    def get(self, city, wait_sec):
+        '''Entry of a city, loading it if needed.'''
+        with self._lock:
+            entry = self._entries.get(city)
+            if entry is not None:
+                self._entries.move_to_end(city)
+                if time.monotonic() - self._checked > _RECHECK_SEC:
+                    self._enforce_budget(keep=city)
+                return entry
+            load = self._loads.get(city)
+            owner = load is None
+            if owner:
+                load = self._loads[city] = _Load()
+        if owner:
+            return self._load(city, load)
+        if not load.done.wait(wait_sec):
+            raise CityLoading(city)
+        if load.error is not None:
+            raise load.error
+        return load.entry
+
+    def peek(self, city):
+        '''Entry if loaded, without loading or touching the LRU order.'''
+        return self._entries.get(city)
+
+    def discard(self, city):
+        with self._lock:
+            if self._entries.pop(city, None) is not None:
+                self._forget(city)
+                CITIES_RESIDENT.set(len(self._entries))
+
+    def cities(self):
+        return list(self._entries)
+
+    def _load(self, city, load):
+        started = time.perf_counter()
+        try:
+            entry = self.loader(city)
+        except BaseException as e:
+            # not remembered: the next request tries again
+            load.error = e
+            with self._lock:
+                del self._loads[city]
+            load.done.set()
+            raise
+        CITY_LOAD_SECONDS.labels(city=city).observe(time.perf_counter() - started)
+        with self._lock:
+            self._entries[city] = entry
+            del self._loads[city]
+            self._enforce_budget(keep=city, loaded=True)
+            CITIES_RESIDENT.set(len(self._entries))
+        if self.on_loaded is not None:
+            try:
+                self.on_loaded(city, entry)
+            except Exception:
+                log.exception("on_loaded failed for city %s", city)
+        load.entry = entry
+        load.done.set()
+        return entry
+
+    def _enforce_budget(self, keep, loaded=False):
+        # under self._lock
+        self._checked = time.monotonic()
+        sizes = {city: self.sizeof(entry) for city, entry in self._entries.items()}
+        for city, size in sizes.items():
+            CITY_MEMORY.labels(city=city).set(size)
+        total = sum(sizes.values())
+        if not self.budget_bytes:
+            return
+        for city in list(self._entries):
+            if total <= self.budget_bytes:
+                break
+            if city == keep:
+                continue
+            del self._entries[city]
+            total -= sizes[city]
+            self._forget(city)
+            CITY_EVICTIONS.labels(city=city).inc()
+            log.info("evicted city %s (%.0f MB) to stay within the memory budget", city, sizes[city] / 2**20)
+        if loaded and total > self.budget_bytes:
+            log.warning("city %s alone exceeds the memory budget (%.0f MB)", keep, total / 2**20)
+        CITIES_RESIDENT.set(len(self._entries))
+
+    def _forget(self, city):
+        try:
+            CITY_MEMORY.remove(city)
+        except KeyError:
+            pass
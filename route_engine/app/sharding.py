@@ -0,0 +1,120 @@
+'''
+City sharding across route engines.
+
+Every engine knows the ring (SHARD_ENGINES, as nginx reaches them: "host:port") and its own
+place in it (ENGINE_ID). A city is owned by the CITY_REPLICAS (default SHARD_REPLICAS) engines
+that rank highest for it under rendezvous hashing. All engines compute the same owners with no
+coordination, and adding or removing an engine only moves the cities it gains or loses. An
+engine answers requests for cities it does not own with a 421 (before loading anything), unless
+nginx marks the request as a failover because all the owners failed.
+
+    python -m app.sharding > upstreams.conf
+
+asks every engine of the ring for its /cities and writes the nginx upstreams and city map
+(see nginx/nginx.conf).
+'''
+import hashlib
+import json
+import sys
+import urllib.request
+
+
+def _score(engine, city):
+    return int.from_bytes(hashlib.blake2b(f"{engine}|{city}".encode(), digest_size=8).digest(), "big")
+
+
+def ranking(city, engines):
+    '''`engines` by rendezvous preference for `city`, most preferred first.'''
+    return sorted(engines, key=lambda engine: _score(engine, city), reverse=True)
+
+
+class ShardMap:
+    '''City ownership on a ring of engines; an empty ring means every engine serves every city.'''
+
+    def __init__(self, engine_id, engines, replicas=1, city_replicas=None):
+        self.engine_id = engine_id
+        self.engines = list(engines)
+        self.replicas = replicas
+        self.city_replicas = dict(city_replicas or {})
+        if self.engines and engine_id not in self.engines:
+            raise ValueError(f"ENGINE_ID {engine_id!r} is not one of SHARD_ENGINES {', '.join(self.engines)}")
+
+    @property
+    def enabled(self):
+        return bool(self.engines)
+
+    def owners(self, city):
+        '''Engines owning `city`, most preferred first; [] when sharding is off.'''
+        n = max(1, self.city_replicas.get(city, self.replicas))
+        return ranking(city, self.engines)[:n]
+
+    def owns(self, city):
+        return not self.enabled or self.engine_id in self.owners(city)
+
+
+def _upstream_name(city):
+    return "city_" + "".join(c if c.isalnum() else "_" for c in city)
+
+
+def render_nginx(engines, default_city, owners):
+    '''
+    nginx config: the `route_engines` upstream of the whole ring, one upstream per city with
+    its owners, and the map from $route_city (set by nginx/city.js) to the upstream.
+    '''
+    server = "  server {} max_fails=3 fail_timeout=10s;"
+    lines = ["# generated by `python -m app.sharding`; do not edit", "upstream route_engines {"]
+    lines += [server.format(engine) for engine in engines]
+    lines.append("}")
+    for city in sorted(owners):
+        lines += ["", f"upstream {_upstream_name(city)} {{"]
+        lines += [server.format(engine) for engine in owners[city]]
+        lines.append("}")
+    lines += ["", "map $route_city $route_upstream {", "  default route_engines;"]
+    if default_city in owners:
+        lines.append(f'  "" {_upstream_name(default_city)};')
+    lines += [f'  "{city}" {_upstream_name(city)};' for city in sorted(owners)]
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def discover(engines, timeout=5.0):
+    '''{engine: /cities document} of the engines that answered.'''
+    docs = {}
+    for engine in engines:
+        try:
+            with urllib.request.urlopen(f"http://{engine}/cities", timeout=timeout) as res:
+                docs[engine] = json.load(res)
+        except (OSError, ValueError) as e:
+            print(f"[sharding] {engine}: {e}", file=sys.stderr)
+    return docs
+
+
+def main(argv=None):
+    import argparse
+    from .config import Config
+
+    parser = argparse.ArgumentParser(description="Write the nginx upstreams of the engines' city shards.")
+    parser.add_argument("engines", nargs="*", help="host:port of the engines (default: SHARD_ENGINES)")
+    args = parser.parse_args(argv)
+
+    engines = args.engines or Config.SHARD_ENGINES
+    if not engines:
+        raise SystemExit("no engines given and SHARD_ENGINES is unset")
+    docs = discover(engines)
+    if not docs:
+        raise SystemExit("no engine answered")
+    rings = {tuple(doc["engines"]) for doc in docs.values()}
+    if len(rings) > 1:
+        raise SystemExit(f"the engines disagree on the ring: {sorted(rings)}")
+    # every engine reports the owners of every ingested city: any answer would do, the
+    # union covers cities ingested between the requests
+    owners = {}
+    for doc in docs.values():
+        for city in doc["cities"]:
+            owners.setdefault(city["city"], city["owners"] or list(doc["engines"]) or engines)
+    default_city = next(iter(docs.values()))["default_city"]
+    sys.stdout.write(render_nginx(engines, default_city, owners))
+
+
+if __name__ == "__main__":
+    main()
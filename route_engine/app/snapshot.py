@@ -0,0 +1,227 @@
+'''
+Binary on-disk city graph snapshots.
+
+Layout (little endian):
+    magic b"RGSNAP\\0\\0" | format u32 | header_len u32 | payload crc32 u32 | pad u32
+    JSON header (city, data_version, highway_classes, array table)
+    payload: raw arrays, each aligned to 64 bytes
+
+Workers open snapshots with a read-only mmap, so every process on a host shares the
+same physical pages. Postgres stays the source of truth: a snapshot records the
+`cities.data_version` it was built from and is rebuilt when that changes.
+'''
+import fcntl
+import json
+import mmap
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from .alt import ALT_PREFIX, build_landmarks
+from .cch import CCH_PREFIX, build_cch
+from .ch import build_ch
+from .graph import CSRGraph
+from .profiles import BASE_PROFILE, NUM_PROFILES, edge_weights
+
+MAGIC = b"RGSNAP\0\0"
+FORMAT_VERSION = 1
+_PREAMBLE = struct.Struct("<8sIIII")
+_ALIGN = 64
+
+GRAPH_ARRAYS = ("node_ids", "coords", "offsets", "targets", "length", "travel_time",
+                "temp_risk", "security_risk", "lit", "highway")
+# extra arrays of the Contraction Hierarchy for the unconstrained (travel_time) profile
+CH_BASE_PREFIX = "ch.base."
+# optional edge shapes (CSRGraph.shape_offsets / shape_points)
+SHAPE_ARRAYS = ("shape.offsets", "shape.points")
+# mask of the largest strongly connected component (CSRGraph.largest_component), snapped into
+COMPONENT_ARRAY = "scc.largest"
+# the per-edge cost array of every profile ("weights.<pid>"), mapped instead of recomputed per process
+WEIGHTS_PREFIX = "weights."
+
+
+class SnapshotError(RuntimeError):
+    pass
+
+
+def snapshot_path(directory, city):
+    return os.path.join(directory, f"{city}.graph")
+
+
+def write_snapshot(path, G, data_version, extra=None):
+    '''
+    Atomically write G (plus optional `extra` named arrays) to `path`.
+    '''
+    arrays = {name: np.ascontiguousarray(getattr(G, name)) for name in GRAPH_ARRAYS}
+    if G.shape_offsets is not None:
+        arrays.update(zip(SHAPE_ARRAYS, (np.ascontiguousarray(G.shape_offsets), np.ascontiguousarray(G.shape_points))))
+    for name, arr in (extra or {}).items():
+        arrays[name] = np.ascontiguousarray(arr)
+
+    table, offset = {}, 0
+    for name, arr in arrays.items():
+        offset = -(-offset // _ALIGN) * _ALIGN
+        table[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+        offset += arr.nbytes
+
+    header = json.dumps({
+        "city": G.city,
+        "data_version": int(data_version),
+        "highway_classes": G.highway_classes,
+        "arrays": table,
+    }).encode()
+    data_start = -(-(_PREAMBLE.size + len(header)) // _ALIGN) * _ALIGN
+
+    crc = 0
+    payload = []
+    pos = 0
+    for name, arr in arrays.items():
+        pad = table[name]["offset"] - pos
+        chunk = b"\0" * pad + arr.tobytes()
+        crc = zlib.crc32(chunk, crc)
+        payload.append(chunk)
+        pos += len(chunk)
+
+    tmp = f"{path}.tmp.{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header), crc, 0))
+        f.write(header)
+        f.write(b"\0" * (data_start - _PREAMBLE.size - len(header)))
+        for chunk in payload:
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def read_header(path):
+    '''Return the JSON header of a snapshot without mapping the payload.'''
+    with open(path, "rb") as f:
+        magic, fmt, header_len, crc, _ = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+        if magic != MAGIC:
+            raise SnapshotError(f"{path}: not a graph snapshot")
+        if fmt != FORMAT_VERSION:
+            raise SnapshotError(f"{path}: unsupported snapshot format {fmt}")
+        header = json.loads(f.read(header_len))
+    header["crc32"] = crc
+    header["data_start"] = -(-(_PREAMBLE.size + header_len) // _ALIGN) * _ALIGN
+    return header
+
+
+def load_snapshot(path, verify=True):
+    '''
+    Map a snapshot read-only. Returns (G, header, extra_arrays); every array is a
+    zero-copy view into the shared mapping.
+    '''
+    header = read_header(path)
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    start = header["data_start"]
+    if verify and zlib.crc32(memoryview(mm)[start:]) != header["crc32"]:
+        raise SnapshotError(f"{path}: checksum mismatch")
+
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        if count == 0:
+            arrays[name] = np.empty(spec["shape"], dtype=dtype)
+            continue
+        arr = np.frombuffer(mm, dtype=dtype, count=count, offset=start + spec["offset"])
+        arrays[name] = arr.reshape(spec["shape"])
+
+    G = CSRGraph(header["city"], *(arrays.pop(name) for name in GRAPH_ARRAYS),
+                 header["highway_classes"])
+    if SHAPE_ARRAYS[0] in arrays:
+        G.set_shapes(*(arrays.pop(name) for name in SHAPE_ARRAYS))
+    return G, header, arrays
+
+
+def build_snapshot(db, city, path, ch=False, cch=False, landmarks=0, log=None):
+    '''
+    Load the city from Postgres and write its snapshot to `path`. With `ch`, also run the
+    (slow, offline) Contraction Hierarchies build for base travel-time routing; with
+    `cch`, the metric-independent CCH preprocessing shared by all constraint profiles;
+    with `landmarks` > 0, ALT distance tables for every profile. The profile cost arrays
+    and the largest strongly connected component are always stored.
+    '''
+    G, _, _, version = db.load_graph(city)
+    weights = {pid: edge_weights(G, pid) for pid in range(NUM_PROFILES)}
+    extra = {COMPONENT_ARRAY: G.largest_component()}
+    extra.update((f"{WEIGHTS_PREFIX}{pid}", w) for pid, w in weights.items())
+    if ch:
+        hierarchy = build_ch(G, weights[BASE_PROFILE], log=log)
+        extra.update(hierarchy.to_arrays(CH_BASE_PREFIX))
+    if cch:
+        extra.update(build_cch(G, log=log).to_arrays(CCH_PREFIX))
+    if landmarks:
+        extra.update(build_landmarks(G, weights, landmarks, log=log).to_arrays(ALT_PREFIX))
+    write_snapshot(path, G, version, extra)
+    return G, version
+
+
+def stored_weights(extra):
+    '''The profile cost arrays of a snapshot's extra arrays; None for snapshots without them.'''
+    names = [f"{WEIGHTS_PREFIX}{pid}" for pid in range(NUM_PROFILES)]
+    if not all(name in extra for name in names):
+        return None
+    return [extra[name] for name in names]
+
+
+def load_or_build(db, city, directory, verify=True):
+    '''
+    Map the city's snapshot, (re)building it from Postgres first when it is missing or
+    older than `cities.data_version`. A file lock makes sure only one process on the
+    host rebuilds; the others wait and then map the fresh file. The snapshot carries the
+    version its graph was read with, which an ingest committing meanwhile makes newer than
+    `version` here.
+    '''
+    version = db.city_version(city)
+    path = snapshot_path(directory, city)
+
+    def current():
+        try:
+            return read_header(path)["data_version"] >= version
+        except (OSError, SnapshotError, ValueError):
+            return False
+
+    if not current():
+        os.makedirs(directory, exist_ok=True)
+        with open(path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if not current():
+                    build_snapshot(db, city, path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+    return load_snapshot(path, verify=verify)
+
+
+def main(argv=None):
+    import argparse
+    from .config import Config
+    from .db import DB
+
+    parser = argparse.ArgumentParser(description="Build city graph snapshots from Postgres.")
+    parser.add_argument("cities", nargs="+", help="city names as stored in the cities table")
+    parser.add_argument("--out", default=Config.SNAPSHOT_DIR or ".", help="snapshot directory")
+    parser.add_argument("--ch", action="store_true", help="also build Contraction Hierarchies (slow)")
+    parser.add_argument("--cch", action="store_true", help="also build the CCH topology for all profiles")
+    parser.add_argument("--landmarks", type=int, default=0, metavar="N",
+                        help="also build ALT tables with N landmarks (8-16) for all profiles")
+    args = parser.parse_args(argv)
+
+    cfg = Config()
+    db = DB(cfg.DB_HOST, cfg.DB_PORT, cfg.DB_NAME, cfg.DB_USER, cfg.DB_PASSWORD)
+    os.makedirs(args.out, exist_ok=True)
+    for city in args.cities:
+        city = city.lower()
+        path = snapshot_path(args.out, city)
+        G, version = build_snapshot(db, city, path, ch=args.ch, cch=args.cch, landmarks=args.landmarks, log=lambda msg: print(msg, flush=True))
+        print(f"[snapshot] {city} v{version}: {G.num_nodes} nodes, {G.num_edges} edges -> {path}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import math
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS_M = 6371000.0
+
+
+class SpatialIndex:
+    '''
+    Nearest-node / nearest-edge lookups for one city graph.
+
+    Coordinates are projected to a local equirectangular plane (meters) centred on the
+    city, so distances are isotropic at city scale, and indexed with a KD-tree. All
+    query methods take an (k, 2) array of (lat, lon) points and answer them in one
+    batched call.
+
+    With a `nodes` mask (e.g. the largest strongly connected component), only those nodes,
+    and the edges between them, are candidates; results are still graph node indices.
+    '''
+
+    def __init__(self, G, sample_spacing_m=25.0, nodes=None):
+        self.G = G
+        self.lat0, self.lon0 = (float(c) for c in G.coords.mean(axis=0))
+        self._kx = EARTH_RADIUS_M * math.cos(math.radians(self.lat0)) * math.pi / 180.0
+        self._ky = EARTH_RADIUS_M * math.pi / 180.0
+        self.xy = self.project(G.coords)
+        self.nodes = None if nodes is None or nodes.all() else np.flatnonzero(nodes)
+        self.tree = cKDTree(self.xy if self.nodes is None else self.xy[self.nodes])
+        self.sample_spacing_m = sample_spacing_m
+        self._edge_tree = None  # built on first edge query
+        self._segments = None
+
+    @property
+    def nbytes(self):
+        total = self.xy.nbytes + self.tree.data.nbytes + self.tree.indices.nbytes
+        if self.nodes is not None:
+            total += self.nodes.nbytes
+        if self._edge_tree is not None and self._edge_tree[0] is not None:
+            tree, sample_seg = self._edge_tree
+            total += tree.data.nbytes + tree.indices.nbytes + sample_seg.nbytes
+            total += sum(a.nbytes for a in self._segments)
+        return total
+
+    def project(self, points):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        return np.column_stack(((points[:, 1] - self.lon0) * self._kx,
+                                (points[:, 0] - self.lat0) * self._ky))
+
+    def nearest(self, points):
+        '''Nearest node per point -> (node_idx int64[k], dist_m float64[k]).'''
+        dist, idx = self.tree.query(self.project(points), k=1)
+        return self._node(idx), dist
+
+    def knn(self, points, k):
+        '''k nearest nodes per point -> (node_idx int64[p, k], dist_m float64[p, k]).'''
+        dist, idx = self.tree.query(self.project(points), k=k)
+        return self._node(idx).reshape(-1, k), dist.reshape(-1, k)
+
+    def radius(self, points, radius_m):
+        '''Nodes within `radius_m` of each point -> list of int64 arrays.'''
+        hits = self.tree.query_ball_point(self.project(points), r=radius_m)
+        return [np.sort(self._node(np.asarray(h, dtype=np.int64))) for h in hits]
+
+    def _node(self, idx):
+        idx = np.asarray(idx, dtype=np.int64)
+        return idx if self.nodes is None else self.nodes[idx]
+
+    def nearest_edge(self, points):
+        '''
+        Nearest edge per point, following the edges' shapes (G.shape_points) when the graph
+        has them.
+        Returns (edge_idx int64[k], frac float64[k], dist_m float64[k]) where `frac` is the
+        position of the projection along the edge's length from its source (0) to its
+        target (1).
+        '''
+        tree, sample_seg = self._edge_index()
+        q = self.project(points)
+        edges = np.full(len(q), -1, dtype=np.int64)
+        fracs = np.zeros(len(q))
+        dists = np.full(len(q), np.inf)
+        if tree is None:
+            return edges, fracs, dists
+
+        # The nearest sample bounds the nearest segment distance; any segment at that
+        # distance has a sample within spacing / 2 more, so the ball holds the answer.
+        d0, _ = tree.query(q, k=1)
+        balls = tree.query_ball_point(q, r=d0 + self.sample_spacing_m / 2.0 + 1e-6)
+        seg_edge, seg_a, seg_b, seg_before, edge_len = self._segments
+        for i, ball in enumerate(balls):
+            cand = np.unique(sample_seg[ball])
+            a, b = seg_a[cand], seg_b[cand]
+            ab = b - a
+            denom = np.einsum("ij,ij->i", ab, ab)
+            t = np.where(denom > 0, np.einsum("ij,ij->i", q[i] - a, ab) / np.where(denom > 0, denom, 1.0), 0.0)
+            t = np.clip(t, 0.0, 1.0)
+            d = np.hypot(*(a + ab * t[:, None] - q[i]).T)
+            j = int(np.argmin(d))
+            seg = cand[j]
+            along = seg_before[seg] + t[j] * np.sqrt(denom[j])
+            edges[i], dists[i] = seg_edge[seg], d[j]
+            fracs[i] = along / edge_len[seg] if edge_len[seg] > 0 else 0.0
+        return edges, fracs, dists
+
+    def snap_to_edge(self, points):
+        '''
+        Endpoint (node index) nearest to the projection on the nearest edge, per point; the
+        nearest node when there is no edge to snap to (an edgeless graph).
+        '''
+        edges, fracs, _ = self.nearest_edge(points)
+        src, dst = self._edge_ends
+        nodes = np.empty(len(edges), dtype=np.int64)
+        found = edges >= 0
+        e = edges[found]
+        nodes[found] = np.where(fracs[found] < 0.5, src[e], dst[e])
+        if not found.all():
+            nodes[~found] = self.nearest(self._points(points)[~found])[0]
+        return nodes
+
+    @staticmethod
+    def _points(points):
+        return np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+    def _edge_index(self):
+        if self._edge_tree is None:
+            G = self.G
+            src = G.edge_sources()
+            dst = G.targets
+            self._edge_ends = (src, dst)
+            edge_ids = np.arange(G.num_edges, dtype=np.int64)
+            if self.nodes is not None:
+                inside = np.zeros(G.num_nodes, dtype=bool)
+                inside[self.nodes] = True
+                edge_ids = np.flatnonzero(inside[src] & inside[dst])
+            if len(edge_ids) == 0:
+                self._edge_tree = (None, None)
+                return self._edge_tree
+            self._segments = self._edge_segments(edge_ids, src, dst)
+            seg_edge, seg_a, seg_b, _, _ = self._segments
+            # sample every segment at <= sample_spacing_m, endpoints included
+            seg_len = np.hypot(*(seg_b - seg_a).T)
+            n_samples = np.ceil(seg_len / self.sample_spacing_m).astype(np.int64) + 1
+            sample_seg = np.repeat(np.arange(len(seg_edge)), n_samples)
+            starts = np.cumsum(n_samples) - n_samples
+            step = np.arange(len(sample_seg)) - np.repeat(starts, n_samples)
+            t = step / np.repeat(np.maximum(n_samples - 1, 1), n_samples)
+            a, b = seg_a[sample_seg], seg_b[sample_seg]
+            samples = a + (b - a) * t[:, None]
+            self._edge_tree = (cKDTree(samples), sample_seg)
+        return self._edge_tree
+
+    def _edge_segments(self, edge_ids, src, dst):
+        '''
+        Straight segments of the edges' polylines (source, inner shape points, target).
+        Returns (edge int64[m], a float64[m, 2], b float64[m, 2], length of the edge before
+        the segment float64[m], length of the whole edge float64[m]), in meters.
+        '''
+        G = self.G
+        if G.shape_offsets is None:
+            inner = np.zeros(len(edge_ids), dtype=np.int64)
+        else:
+            inner = (G.shape_offsets[edge_ids + 1] - G.shape_offsets[edge_ids]).astype(np.int64)
+        # every edge's vertices: source, inner points, target
+        n_vertices = inner + 2
+        first = np.cumsum(n_vertices) - n_vertices
+        last = first + n_vertices - 1
+        vertices = np.empty((int(n_vertices.sum()), 2))
+        vertices[first] = self.xy[src[edge_ids]]
+        vertices[last] = self.xy[dst[edge_ids]]
+        if inner.any():
+            rank = np.arange(int(inner.sum())) - np.repeat(np.cumsum(inner) - inner, inner)
+            points = np.repeat(G.shape_offsets[edge_ids], inner) + rank
+            vertices[np.repeat(first + 1, inner) + rank] = self.project(G.shape_points[points])
+        # a segment starts at every vertex but an edge's last
+        starts = np.ones(len(vertices), dtype=bool)
+        starts[last] = False
+        starts = np.flatnonzero(starts)
+        seg_edge = np.repeat(edge_ids, inner + 1)
+        seg_a, seg_b = vertices[starts], vertices[starts + 1]
+        seg_len = np.hypot(*(seg_b - seg_a).T)
+        # cumulative length of the edge before each segment
+        total = np.cumsum(seg_len)
+        edge_first_seg = np.cumsum(inner + 1) - (inner + 1)
+        offset = np.repeat(total[edge_first_seg] - seg_len[edge_first_seg], inner + 1)
+        before = total - seg_len - offset
+        edge_len = np.repeat(np.add.reduceat(seg_len, edge_first_seg), inner + 1)
+        return seg_edge, seg_a, seg_b, before, edge_len
@@ -0,0 +1,351 @@
+'''
+Tiled loading for regions too large to hold as one graph (TILED_CITIES).
+
+The ingest stores a grid key on every node (`tile`) and edge (`tile` of its source, `v_tile`
+of its target): tile_key() of the node's (lat, lon) on a grid of `cities.tile_deg` degrees.
+A TiledCity loads tiles from Postgres on demand and keeps them in an LRU bounded by bytes:
+the tiles around the points to snap, then the ones within a margin of the straight line
+between source and target (the corridor). Its A* works on (osmid, tile) pairs and loads the
+tile of any node it expands that is not resident yet, so a route can leave the corridor.
+Memory and cold-load time follow the area requests actually touch, not the region's size.
+'''
+import collections
+import heapq
+import math
+import threading
+import time
+
+import numpy as np
+
+from .a_star import count_work
+from .metrics import TILE_LOADS, TILE_LOAD_SECONDS, TILES_RESIDENT, TILE_MEMORY, TILE_EVICTIONS
+from .profiles import NUM_PROFILES, edge_weights
+from .spatial import SpatialIndex
+from .utils import haversine
+
+# col < 2**20: grids down to ~0.00035 degrees
+_COL_BITS = 20
+_KM_PER_DEG = 111.195
+# snapping looks this many tile rings around a point before giving up
+_MAX_SNAP_RING = 3
+
+
+class TilesChanged(RuntimeError):
+    '''The city was re-ingested while a request was using its tiles.'''
+
+
+def tile_key(lat, lon, tile_deg):
+    '''Grid key(s) of (lat, lon) point(s); same formula as the ingest.'''
+    row = np.floor((np.asarray(lat, dtype=np.float64) + 90.0) / tile_deg).astype(np.int64)
+    col = np.floor((np.asarray(lon, dtype=np.float64) + 180.0) / tile_deg).astype(np.int64)
+    return (row << _COL_BITS) | col
+
+
+def tile_bounds(key, tile_deg):
+    '''(lat_min, lon_min, lat_max, lon_max) of a tile.'''
+    row, col = int(key) >> _COL_BITS, int(key) & ((1 << _COL_BITS) - 1)
+    lat0, lon0 = row * tile_deg - 90.0, col * tile_deg - 180.0
+    return lat0, lon0, lat0 + tile_deg, lon0 + tile_deg
+
+
+class Tile:
+    '''
+    Nodes of one tile and their out-edges in CSR form. Edge targets are osmids with the
+    target's tile, since they may lie in other tiles.
+    '''
+
+    def __init__(self, key, node_ids, coords, offsets, targets, target_tiles, travel_time, temp_risk, security_risk):
+        self.key = key
+        self.node_ids = node_ids          # int64[k] sorted
+        self.coords = coords              # float64[k, 2] lat, lon
+        self.offsets = offsets            # int64[k + 1]
+        self.targets = targets            # int64[m] osmid
+        self.target_tiles = target_tiles  # int64[m]
+        self.travel_time = travel_time    # float32[m], and the risks, as in CSRGraph
+        self.temp_risk = temp_risk
+        self.security_risk = security_risk
+        self.index = SpatialIndex(self) if len(node_ids) else None
+        self._weights = [None] * NUM_PROFILES
+
+    @property
+    def nbytes(self):
+        total = sum(a.nbytes for a in (self.node_ids, self.coords, self.offsets, self.targets, self.target_tiles,
+                                       self.travel_time, self.temp_risk, self.security_risk))
+        total += sum(w.nbytes for w in self._weights if w is not None)
+        return total + (self.index.nbytes if self.index is not None else 0)
+
+    def weights(self, pid):
+        '''Per-edge cost under a profile, computed on first use.'''
+        w = self._weights[pid]
+        if w is None:
+            w = self._weights[pid] = edge_weights(self, pid)
+        return w
+
+    def position(self, osmid):
+        '''Index of `osmid` in this tile, or -1.'''
+        i = int(np.searchsorted(self.node_ids, osmid))
+        return i if i < len(self.node_ids) and self.node_ids[i] == osmid else -1
+
+
+def build_tiles(keys, nodes, edges):
+    '''
+    Tiles `keys` from node rows (tile, osmid, lat, lon) and edge rows (tile, u, v, v_tile,
+    travel_time, temp_risk, security_risk), as column arrays. Keys without rows get empty tiles.
+    '''
+    n_tile, osmid, lat, lon = nodes
+    e_tile, u, v, v_tile, tt, temp, sec = edges
+    n_order = np.lexsort((osmid, n_tile))
+    e_order = np.lexsort((v, u, e_tile))
+    n_tile, osmid, coords = n_tile[n_order], osmid[n_order], np.column_stack((lat, lon))[n_order]
+    e_tile, u, v, v_tile = e_tile[e_order], u[e_order], v[e_order], v_tile[e_order]
+    tt, temp, sec = tt[e_order], temp[e_order], sec[e_order]
+
+    tiles = {}
+    for key in keys:
+        nlo, nhi = np.searchsorted(n_tile, [key, key + 1])
+        elo, ehi = np.searchsorted(e_tile, [key, key + 1])
+        ids, sources = osmid[nlo:nhi], u[elo:ehi]
+        src = np.searchsorted(ids, sources)
+        # an edge whose source is not a node of its tile is dropped, like CSRGraph does
+        keep = np.zeros(len(sources), dtype=bool)
+        if len(ids):
+            keep = (src < len(ids)) & (ids[np.minimum(src, len(ids) - 1)] == sources)
+        offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src[keep], minlength=len(ids)), out=offsets[1:])
+        sel = np.arange(elo, ehi)[keep]
+        tiles[key] = Tile(key, ids.copy(), coords[nlo:nhi].copy(), offsets, v[sel], v_tile[sel],
+                          tt[sel], temp[sel], sec[sel])
+    return tiles
+
+
+class TiledCity:
+    '''Resident tiles of one city, an LRU of at most `budget_bytes` (0 = unlimited).'''
+
+    def __init__(self, city, db, budget_bytes, margin_km, recheck_sec=10.0):
+        self.city = city
+        self.db = db
+        self.budget_bytes = budget_bytes
+        self.margin_km = margin_km
+        self.recheck_sec = recheck_sec
+        self.version, self.tile_deg = self._tile_info()
+        self._checked = time.monotonic()
+        self._tiles = collections.OrderedDict()  # key -> Tile, least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # one load at a time per city; threads waiting for it then find their tiles resident
+        self._load_lock = threading.Lock()
+
+    def _tile_info(self):
+        version, tile_deg = self.db.tile_info(self.city)
+        if not tile_deg or tile_deg <= 0:
+            raise RuntimeError(f"City '{self.city}' was ingested without tiles (set TILE_DEG and re-ingest)")
+        return version, tile_deg
+
+    @property
+    def cache_version(self):
+        '''Route cache version: cached routes die with a re-ingest.'''
+        return f"tiles.{self.version}"
+
+    def refresh(self):
+        '''Drop all tiles if the city was re-ingested (checked at most every `recheck_sec`).'''
+        if time.monotonic() - self._checked < self.recheck_sec:
+            return
+        self._checked = time.monotonic()
+        version, tile_deg = self._tile_info()
+        if version != self.version:
+            self._reset(version, tile_deg)
+
+    def _reset(self, version, tile_deg):
+        with self._lock:
+            self.version, self.tile_deg = version, tile_deg
+            self._tiles.clear()
+            self._bytes = 0
+            TILES_RESIDENT.labels(city=self.city).set(0)
+            TILE_MEMORY.labels(city=self.city).set(0)
+
+    def tiles(self, keys, reason):
+        '''{key: Tile} for `keys`, loading the missing ones in one query.'''
+        keys = [int(k) for k in keys]
+        found = self._lookup(keys)
+        if len(found) < len(keys):
+            with self._load_lock:
+                found = self._lookup(keys)
+                missing = [k for k in keys if k not in found]
+                if missing:
+                    found.update(self._load(missing, reason))
+        return found
+
+    def _lookup(self, keys):
+        with self._lock:
+            found = {}
+            for k in keys:
+                tile = self._tiles.get(k)
+                if tile is not None:
+                    self._tiles.move_to_end(k)
+                    found[k] = tile
+            return found
+
+    def _load(self, keys, reason):
+        started = time.perf_counter()
+        version, nodes, edges = self.db.load_tiles(self.city, keys)
+        if version != self.version:
+            self._reset(version, self.tile_deg)
+            self._checked = 0.0  # re-read tile_deg too on the next request
+            raise TilesChanged(f"city '{self.city}' was re-ingested (data_version {version})")
+        loaded = build_tiles(keys, nodes, edges)
+        TILE_LOAD_SECONDS.labels(city=self.city).observe(time.perf_counter() - started)
+        TILE_LOADS.labels(city=self.city, reason=reason).inc(len(keys))
+        with self._lock:
+            for key, tile in loaded.items():
+                self._tiles[key] = tile
+                self._bytes += tile.nbytes
+            self._evict()
+        return loaded
+
+    def _evict(self):
+        # callers still hold the tiles they were handed: eviction only drops the LRU's reference
+        while self.budget_bytes > 0 and self._bytes > self.budget_bytes and len(self._tiles) > 1:
+            _, tile = self._tiles.popitem(last=False)
+            self._bytes -= tile.nbytes
+            TILE_EVICTIONS.labels(city=self.city).inc()
+        TILES_RESIDENT.labels(city=self.city).set(len(self._tiles))
+        TILE_MEMORY.labels(city=self.city).set(self._bytes)
+
+    def _ring(self, key, r):
+        row, col = key >> _COL_BITS, key & ((1 << _COL_BITS) - 1)
+        return [((row + dr) << _COL_BITS) | (col + dc) for dr in range(-r, r + 1) for dc in range(-r, r + 1)
+                if max(abs(dr), abs(dc)) == r]
+
+    def snap(self, points):
+        '''
+        Nearest node of each (lat, lon) point -> (osmid int64[k], tile int64[k]). ValueError
+        when a point has no node within a few tiles.
+        '''
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        osmids = np.zeros(len(points), dtype=np.int64)
+        keys = np.zeros(len(points), dtype=np.int64)
+        for i, (lat, lon) in enumerate(points):
+            center = int(tile_key(lat, lon, self.tile_deg))
+            # nodes outside the rings searched are at least r tile sides away
+            side_m = self.tile_deg * _KM_PER_DEG * 1000.0 * math.cos(math.radians(min(abs(lat) + self.tile_deg, 89.0)))
+            best = (math.inf, None, None)
+            for r in range(_MAX_SNAP_RING + 1):
+                for key, tile in self.tiles(self._ring(center, r), "snap").items():
+                    if tile.index is None:
+                        continue
+                    idx, dist = tile.index.nearest(points[i:i + 1])
+                    if dist[0] < best[0]:
+                        best = (dist[0], int(tile.node_ids[idx[0]]), key)
+                if best[0] <= r * side_m:
+                    break
+            if best[1] is None:
+                raise ValueError(f"no road within {_MAX_SNAP_RING} tiles of ({lat:.5f}, {lon:.5f})")
+            osmids[i], keys[i] = best[1], best[2]
+        return osmids, keys
+
+    def corridor(self, a, b):
+        '''Tile keys within margin_km of the straight line between (lat, lon) points a and b.'''
+        deg = self.tile_deg
+        margin_deg = self.margin_km / _KM_PER_DEG
+        kx = math.cos(math.radians((a[0] + b[0]) / 2.0))
+        lat0, lat1 = min(a[0], b[0]) - margin_deg, max(a[0], b[0]) + margin_deg
+        lon0, lon1 = min(a[1], b[1]) - margin_deg / kx, max(a[1], b[1]) + margin_deg / kx
+        rows = np.arange(math.floor((lat0 + 90.0) / deg), math.floor((lat1 + 90.0) / deg) + 1)
+        cols = np.arange(math.floor((lon0 + 180.0) / deg), math.floor((lon1 + 180.0) / deg) + 1)
+        rr, cc = np.meshgrid(rows, cols, indexing="ij")
+        # tile centres, in km on a local plane, against the segment a-b
+        cy = ((rr + 0.5) * deg - 90.0 - a[0]) * _KM_PER_DEG
+        cx = ((cc + 0.5) * deg - 180.0 - a[1]) * _KM_PER_DEG * kx
+        by, bx = (b[0] - a[0]) * _KM_PER_DEG, (b[1] - a[1]) * _KM_PER_DEG * kx
+        denom = bx * bx + by * by
+        t = np.clip((cx * bx + cy * by) / denom, 0.0, 1.0) if denom > 0 else np.zeros_like(cx)
+        dist = np.hypot(cx - t * bx, cy - t * by)
+        half_diag = deg * _KM_PER_DEG * math.hypot(1.0, kx) / 2.0
+        sel = dist <= self.margin_km + half_diag
+        return ((rr[sel].astype(np.int64) << _COL_BITS) | cc[sel].astype(np.int64)).tolist()
+
+    def geometry(self, pairs):
+        '''(osmid int64[k], coords float64[k, 2]) of a path of (osmid, tile) pairs.'''
+        pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        osmids, keys = pairs[:, 0], pairs[:, 1]
+        coords = np.zeros((len(pairs), 2))
+        for key, tile in self.tiles(np.unique(keys), "geometry").items():
+            mask = keys == key
+            coords[mask] = tile.coords[np.searchsorted(tile.node_ids, osmids[mask])]
+        return osmids, coords
+
+    def astar(self, s, s_tile, t, t_tile, pid, deadline_sec, stats=None):
+        '''
+        A* from osmid s to osmid t under profile `pid` with a time budget, loading tiles as the
+        search reaches them. On timeout returns no path (reason "timeout"): a route ending short
+        of the target is not a route, and the tiles hold no base-profile fallback to finish with.
+        Returns: ((osmid, tile) pairs, total_cost, expanded_count, degraded, reason, suboptimality_bound)
+        '''
+        start_time = time.perf_counter()
+        resident = self.tiles([s_tile, t_tile], "snap")
+        dst_lat, dst_lon = resident[t_tile].coords[resident[t_tile].position(t)]
+        src_lat, src_lon = resident[s_tile].coords[resident[s_tile].position(s)]
+        resident.update(self.tiles(self.corridor((src_lat, src_lon), (dst_lat, dst_lon)), "corridor"))
+        deg = self.tile_deg
+
+        def heuristic(v, v_tile):
+            # optimistic travel time at 60 km/h, as build_heuristic; for a node whose tile is not
+            # resident, from the nearest point of its tile
+            tile = resident.get(v_tile)
+            j = tile.position(v) if tile is not None else -1
+            if j >= 0:
+                lat, lon = tile.coords[j]
+            else:
+                lat0, lon0, lat1, lon1 = tile_bounds(v_tile, deg)
+                lat, lon = min(max(dst_lat, lat0), lat1), min(max(dst_lon, lon0), lon1)
+            return haversine(lat, lon, dst_lat, dst_lon) / 16.6666667
+
+        open_set = [(heuristic(s, s_tile), 0.0, s, s_tile)]
+        came_from = {}
+        g_score = {s: 0.0}
+        expanded = pops = relaxed = 0
+
+        while open_set:
+            if time.perf_counter() - start_time > deadline_sec:
+                count_work(stats, pops + len(open_set), relaxed)
+                return [], math.inf, expanded, True, "timeout", None
+            _, g_current, current, current_tile = heapq.heappop(open_set)
+            pops += 1
+            if g_current > g_score[current]:
+                continue
+            expanded += 1
+            if current == t:
+                count_work(stats, pops + len(open_set), relaxed)
+                return self._path(came_from, current, s, s_tile), g_current, expanded, False, "", 1.0
+
+            tile = resident.get(current_tile)
+            if tile is None:
+                # the frontier reached a tile that is not resident: load it
+                tile = resident[current_tile] = self.tiles([current_tile], "frontier")[current_tile]
+            i = tile.position(current)
+            if i < 0:
+                continue  # edge to a node its tile does not have
+            lo, hi = tile.offsets[i], tile.offsets[i + 1]
+            relaxed += hi - lo
+            for neighbor, neighbor_tile, w in zip(tile.targets[lo:hi].tolist(), tile.target_tiles[lo:hi].tolist(),
+                                                  tile.weights(pid)[lo:hi].tolist()):
+                tentative_g = g_current + w
+                if tentative_g < g_score.get(neighbor, math.inf):
+                    came_from[neighbor] = (current, current_tile, neighbor_tile)
+                    g_score[neighbor] = tentative_g
+                    f = tentative_g + heuristic(neighbor, neighbor_tile)
+                    heapq.heappush(open_set, (f, tentative_g, neighbor, neighbor_tile))
+
+        count_work(stats, pops, relaxed)
+        return [], math.inf, expanded, True, "no_path", None
+
+    @staticmethod
+    def _path(came_from, node, s, s_tile):
+        if node == s:
+            return [(s, s_tile)]
+        pairs = [(node, came_from[node][2])]
+        while node in came_from:
+            node, node_tile, _ = came_from[node]
+            pairs.append((node, node_tile))
+        pairs.reverse()
+        return pairs
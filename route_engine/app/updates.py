@@ -0,0 +1,162 @@
+'''
+Live edge updates.
+
+An update is a batch of new `travel_time` / `temp_risk` / `security_risk` values for edges
+u -> v (osmids; parallel edges all get the value). Batches are appended to a per-city Redis
+list keyed on the city's `data_version`, whose length is the update sequence number, and
+the city is announced on EDGES_CHANNEL. A subscriber thread in every worker (both engines)
+then applies whatever it has not applied yet; a worker loading the city later replays the
+list. A re-ingest bumps `data_version`, which starts an empty list. Lists do not expire: a
+worker loading any later version deletes those of older versions (prune).
+
+The route cache key carries "<data_version>.<seq>", so routes computed before an update
+are never served after it.
+'''
+import json
+import logging
+import threading
+import time
+
+import numpy as np
+from redis.exceptions import RedisError
+
+EDGES_CHANNEL = "route:edge_updates"
+FIELDS = ("travel_time", "temp_risk", "security_risk")
+
+log = logging.getLogger(__name__)
+
+
+def log_key(city, data_version):
+    return f"edges:{city}:{data_version}"
+
+
+def parse_batch(updates):
+    '''
+    [{"u": osmid, "v": osmid, "travel_time": .., ...}, ...] -> {"u": [...], "v": [...], field: [...]}.
+    Every update must set the same fields. ValueError when malformed.
+    '''
+    if not isinstance(updates, list) or not updates:
+        raise ValueError("updates must be a non-empty list")
+    if not all(isinstance(x, dict) for x in updates):
+        raise ValueError("every update must be an object")
+    fields = [f for f in FIELDS if f in updates[0]]
+    if not fields:
+        raise ValueError(f"updates must set at least one of {', '.join(FIELDS)}")
+    # a field set by only some updates has no value to write for the others
+    mixed = [f for f in FIELDS if any((f in x) != (f in fields) for x in updates)]
+    if mixed:
+        raise ValueError(f"every update must set the same fields; {', '.join(mixed)} set by only some")
+    try:
+        batch = {"u": [int(x["u"]) for x in updates], "v": [int(x["v"]) for x in updates]}
+        for f in fields:
+            batch[f] = [float(x[f]) for x in updates]
+    except (TypeError, KeyError, ValueError) as e:
+        raise ValueError("every update needs integer u, v and numeric values for the same fields") from e
+    for f in fields:
+        values = np.asarray(batch[f])
+        if not np.isfinite(values).all() or (values < 0).any():
+            raise ValueError(f"{f} values must be finite and non-negative")
+    return batch
+
+
+def resolve_edges(G, batch):
+    '''Edge indices touched by a batch, and for each the row of the batch it takes values from.'''
+    u = G.index_of(np.asarray(batch["u"], dtype=np.int64))
+    v = G.index_of(np.asarray(batch["v"], dtype=np.int64))
+    rows = np.flatnonzero((u >= 0) & (v >= 0))
+    lo, hi = G.edge_range(u[rows], v[rows])
+    counts = hi - lo
+    rows = np.repeat(rows, counts)
+    edges = np.repeat(lo, counts) + (np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts))
+    return edges, rows
+
+
+def apply_batch(G, profiles, batch):
+    '''Write a batch into G's edge attributes and the profile costs; returns the edge count.'''
+    edges, rows = resolve_edges(G, batch)
+    if len(edges) == 0:
+        return 0
+    for f in FIELDS:
+        if f not in batch:
+            continue
+        arr = getattr(G, f)
+        if not arr.flags.writeable:
+            # snapshot arrays are read-only mmaps: this worker gets a private copy
+            arr = arr.copy()
+            setattr(G, f, arr)
+        arr[edges] = np.asarray(batch[f], dtype=arr.dtype)[rows]
+    profiles.update_edges(edges)
+    return len(edges)
+
+
+class EdgeUpdates:
+    '''Per-worker view of the update log: publishes batches and applies them in order.'''
+
+    def __init__(self, redis):
+        self.r = redis
+        self.applied = {}  # city -> (data_version, seq)
+        self._lock = threading.Lock()
+
+    def version(self, city, data_version):
+        '''Cache version of a loaded city: "<data_version>.<seq>" once updates were applied.'''
+        seq = self.seq(city, data_version)
+        return f"{data_version}.{seq}" if seq else str(data_version)
+
+    def seq(self, city, data_version):
+        '''Number of update batches applied to the loaded city.'''
+        dv, seq = self.applied.get(city, (data_version, 0))
+        return seq if dv == data_version else 0
+
+    def forget(self, city):
+        '''The city was (re)loaded from its snapshot: no batch is applied to it yet.'''
+        with self._lock:
+            self.applied.pop(city, None)
+
+    def publish(self, city, data_version, batch):
+        '''Append a batch to the city's log and announce it; returns its sequence number.'''
+        seq = self.r.rpush(log_key(city, data_version), json.dumps(batch))
+        self.r.publish(EDGES_CHANNEL, json.dumps({"city": city, "data_version": data_version, "seq": seq}))
+        return seq
+
+    def prune(self, city, data_version):
+        '''Delete the city's update lists of versions before `data_version` (re-ingested since).'''
+        prefix = log_key(city, "")
+        stale = []
+        for key in self.r.scan_iter(match=f"{prefix}*"):
+            key = key.decode() if isinstance(key, bytes) else key
+            version = key[len(prefix):]
+            if version.isdigit() and int(version) < int(data_version):
+                stale.append(key)
+        if stale:
+            self.r.delete(*stale)
+        return len(stale)
+
+    def sync(self, city, data_version, G, profiles):
+        '''Apply every logged batch this worker has not applied yet; returns the applied seq.'''
+        with self._lock:
+            dv, seq = self.applied.get(city, (data_version, 0))
+            if dv != data_version:
+                seq = 0
+            raws = self.r.lrange(log_key(city, data_version), seq, -1)
+            for raw in raws:
+                apply_batch(G, profiles, json.loads(raw))
+                seq += 1
+                # published only after the costs are in place
+                self.applied[city] = (data_version, seq)
+            return seq
+
+    def listen(self, on_update):
+        '''Subscribe in a daemon thread; `on_update(city)` runs for every announced batch.'''
+        def run():
+            while True:
+                try:
+                    pubsub = self.r.pubsub(ignore_subscribe_messages=True)
+                    pubsub.subscribe(EDGES_CHANNEL)
+                    for msg in pubsub.listen():
+                        on_update(json.loads(msg["data"])["city"])
+                except RedisError as e:
+                    log.warning("edge update subscription lost (%s), reconnecting", e)
+                    time.sleep(1.0)
+                except Exception:
+                    log.exception("failed to apply edge updates")
+        threading.Thread(target=run, daemon=True, name="edge-updates").start()
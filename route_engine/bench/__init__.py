@@ -0,0 +1,4 @@
+'''
+Offline benchmark suite for the routing core: synthetic (or snapshot) graphs, in-process
+measurements, comparison against a stored baseline. Run from route_engine/: `python -m bench`.
+'''
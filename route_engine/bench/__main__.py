@@ -0,0 +1,162 @@
+'''
+python -m bench [--graph grid:10000 --graph planar:100000 --graph snapshot:/snapshots/bogota.graph]
+                [--queries 50] [--repeat 3] [--runs 3] [--seed 1] [--only search.] [--save-baseline]
+                [--gate-latency] [--json out.json]
+
+Runs every case on every graph, prints latency percentiles, nodes expanded, allocation peaks
+and peak RSS, and compares them with the stored baseline. The run fails (exit 1) when a case
+expands more nodes (search results are deterministic for a given graph, seed and query count)
+or allocates more. Latency depends on the machine and its load: a p50 slower than the
+baseline's by more than --tolerance and the noise floor is reported, and only fails the run
+with --gate-latency (on the machine that recorded the baseline).
+'''
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+
+import numpy as np
+
+from . import graphs
+from .cases import build_cases, measure
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_GRAPHS = ["grid:10000", "planar:10000"]
+# differences below these are noise, whatever the relative change
+MIN_DELTA_MS = 0.05
+MIN_DELTA_KB = 64.0
+# a p50 slowdown must also exceed this many times the p50 spread between runs (baseline or now)
+NOISE_FACTOR = 3.0
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0  # KB on Linux
+
+
+def host_info():
+    return {
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+    }
+
+
+def run(specs, queries, seed, only, repeat, runs):
+    results = {}
+    # a prefix is wanted when it and some --only prefix can name the same case
+    wanted = lambda prefix: not only or any(p.startswith(prefix) or prefix.startswith(p) for p in only)
+    for spec in specs:
+        started = time.perf_counter()
+        G = graphs.load(spec, seed)
+        print(f"[bench] {spec}: {G.num_nodes} nodes, {G.num_edges} edges, built in "
+              f"{time.perf_counter() - started:.1f}s", flush=True)
+        cases = {}
+        for name, calls in build_cases(G, queries, seed, wanted):
+            if only and not any(name.startswith(prefix) for prefix in only):
+                continue
+            cases[name] = measure(calls, repeat, runs)
+            print(format_row(name, cases[name]), flush=True)
+        results[spec] = {"cases": cases, "peak_rss_mb": peak_rss_mb()}
+        print(f"[bench] {spec}: peak RSS {results[spec]['peak_rss_mb']:.0f} MB", flush=True)
+    return results
+
+
+def format_row(name, s):
+    expanded = f"{s['expanded_mean']:>10.0f}" if "expanded_mean" in s else f"{'':>10}"
+    return (f"  {name:<34} n={s['n']:<5} p50={s['p50_ms']:>9.3f}ms p95={s['p95_ms']:>9.3f}ms "
+            f"p99={s['p99_ms']:>9.3f}ms exp={expanded} alloc={s['alloc_peak_kb']:>9.0f}KB")
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Regressions of `results` against `baseline`, as printable strings: (deterministic ones,
+    latency ones).
+    '''
+    regressions, slower = [], []
+    for spec, run_ in results.items():
+        base_cases = baseline.get(spec, {}).get("cases", {})
+        for name, s in run_["cases"].items():
+            b = base_cases.get(name)
+            if b is None:
+                continue
+            # p95/p99 of a few dozen queries hinge on single outliers: reported, not compared
+            noise = NOISE_FACTOR * max(b.get("p50_spread_ms", 0.0), s.get("p50_spread_ms", 0.0))
+            if s["p50_ms"] > b["p50_ms"] * (1 + tolerance) and s["p50_ms"] - b["p50_ms"] > max(MIN_DELTA_MS, noise):
+                slower.append(f"{spec} {name}: p50_ms {b['p50_ms']:.3f} -> {s['p50_ms']:.3f} (noise {noise:.3f})")
+            if s.get("expanded_mean", 0) > b.get("expanded_mean", 0) * 1.001 and "expanded_mean" in b:
+                regressions.append(f"{spec} {name}: expanded_mean {b['expanded_mean']:.0f} -> {s['expanded_mean']:.0f}")
+            if s["alloc_peak_kb"] > b["alloc_peak_kb"] * (1 + tolerance) and s["alloc_peak_kb"] - b["alloc_peak_kb"] > MIN_DELTA_KB:
+                regressions.append(f"{spec} {name}: alloc_peak_kb {b['alloc_peak_kb']:.0f} -> {s['alloc_peak_kb']:.0f}")
+    return regressions, slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the routing core.")
+    parser.add_argument("--graph", action="append", dest="graphs", metavar="SPEC",
+                        help="grid:<n>, planar:<n> or snapshot:<path> (repeatable; default: %s)" % ", ".join(DEFAULT_GRAPHS))
+    parser.add_argument("--queries", type=int, default=50, help="route queries / snap points per case")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per call; the fastest one counts")
+    parser.add_argument("--runs", type=int, default=3,
+                        help="passes per case; the fastest pass counts, their spread is the noise floor")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--only", action="append", metavar="PREFIX", help="only cases starting with PREFIX (repeatable)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown (default 0.25)")
+    parser.add_argument("--gate-latency", action="store_true", help="also fail on p50 slowdowns, not only report them")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline instead of comparing")
+    parser.add_argument("--json", metavar="PATH", help="also write the results to PATH")
+    args = parser.parse_args(argv)
+
+    params = {"queries": args.queries, "seed": args.seed, "repeat": args.repeat, "runs": args.runs}
+    results = run(args.graphs or DEFAULT_GRAPHS, args.queries, args.seed, args.only, args.repeat, args.runs)
+    doc = {"host": host_info(), "params": params, "graphs": results}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(doc, f, indent=1, sort_keys=True)
+
+    if args.save_baseline:
+        if os.path.exists(args.baseline):
+            # keep the baseline of graphs and cases this run did not cover
+            with open(args.baseline) as f:
+                old = json.load(f)
+            if old.get("params") == params:
+                for spec, run_ in results.items():
+                    cases = old["graphs"].get(spec, {}).get("cases", {})
+                    cases.update(run_["cases"])
+                    run_["cases"] = cases
+                doc["graphs"] = {**old["graphs"], **results}
+        with open(args.baseline, "w") as f:
+            json.dump(doc, f, indent=1, sort_keys=True)
+        print(f"[bench] baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"[bench] no baseline at {args.baseline}; record one with --save-baseline")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("params") != params:
+        print(f"[bench] baseline was recorded with {baseline.get('params')}, this run used {params}: not comparable")
+        return 2
+    if baseline.get("host") != doc["host"]:
+        print(f"[bench] warning: baseline host {baseline.get('host')} differs from this one {doc['host']}")
+    regressions, slower = compare(results, baseline["graphs"], args.tolerance)
+    if args.gate_latency:
+        regressions += slower
+    else:
+        for r in slower:
+            print(f"[bench] slower (not gated without --gate-latency): {r}")
+    for r in regressions:
+        print(f"[bench] REGRESSION {r}")
+    if regressions:
+        return 1
+    print("[bench] no regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+'''
+Benchmark cases. A case is a name and a list of zero-argument calls; every call is timed on
+its own, and the calls of search cases (A*, hierarchy queries, search_route) also report the
+nodes they expanded.
+'''
+import math
+import time
+import tracemalloc
+
+import numpy as np
+
+from app.alt import build_landmarks
+from app.config import Config
+from app.cache import encode, decode
+from app.cch import build_cch
+from app.ch import build_ch
+from app.main import build_weight_func, run_search, search_route
+from app.profiles import FLAGS, NUM_PROFILES, BASE_PROFILE, ProfileSet, profile_name
+from app.spatial import SpatialIndex
+
+SEARCH_MODES = ("astar", "bidirectional", "anytime")
+# A* modes that use ALT landmarks
+ALT_MODES = ("astar", "bidirectional")
+ALT_LANDMARKS = 16
+# base travel time and the most penalized profile
+SEARCH_PROFILES = (BASE_PROFILE, NUM_PROFILES - 1)
+# calls per case measured under tracemalloc (it slows every allocation down)
+ALLOC_SAMPLES = 3
+
+
+def constraints_of(pid):
+    return {flag: bool(pid >> bit & 1) for bit, flag in enumerate(FLAGS)}
+
+
+def build_cases(G, queries, seed, wanted=lambda name: True):
+    '''
+    [(name, [call, ...]), ...] for one graph; query endpoints and points are seeded. The
+    preprocessing of hierarchy and ALT cases (a CH build takes tens of seconds) only runs
+    when one of its cases is `wanted`.
+    '''
+    cfg = Config()
+    rng = np.random.default_rng(seed)
+    profiles = ProfileSet(G)
+    index = SpatialIndex(G)
+    index.nearest_edge(G.coords[:1])  # builds the edge index outside the measurements
+    pairs = rng.integers(0, G.num_nodes, (queries, 2)).tolist()
+    lo, hi = G.coords.min(axis=0), G.coords.max(axis=0)
+    points = lo + (hi - lo) * rng.random((queries, 2))
+    batch = lo + (hi - lo) * rng.random((1000, 2))
+
+    cases = []
+    for pid in range(NUM_PROFILES):
+        weight = build_weight_func(constraints_of(pid))
+        cases.append((f"weights.{profile_name(pid)}", [lambda: weight(G)] * 5))
+
+    for mode in SEARCH_MODES:
+        for pid in SEARCH_PROFILES:
+            calls = [lambda s=s, t=t, pid=pid, mode=mode: run_search(G, profiles, G.coords, pid, s, t, math.inf, mode, cfg)
+                     for s, t in pairs]
+            cases.append((f"search.{mode}.{profile_name(pid)}", calls))
+
+    if wanted("alt."):
+        landmarks = build_landmarks(G, {pid: profiles.weights[pid] for pid in SEARCH_PROFILES}, ALT_LANDMARKS)
+        alt_profiles = ProfileSet(G, landmarks=landmarks, weights=profiles.weights)
+        for mode in ALT_MODES:
+            for pid in SEARCH_PROFILES:
+                calls = [lambda s=s, t=t, pid=pid, mode=mode: run_search(G, alt_profiles, G.coords, pid, s, t, math.inf, mode, cfg)
+                         for s, t in pairs]
+                cases.append((f"alt.{mode}.{profile_name(pid)}", calls))
+
+    ch = cch = None
+    if wanted("ch.") or wanted("search_route."):
+        ch = build_ch(G, profiles.weights[BASE_PROFILE])
+        cases.append(("ch.query.base", [lambda s=s, t=t: ch.query(s, t) for s, t in pairs]))
+    if wanted("cch.") or wanted("search_route."):
+        cch = build_cch(G)
+        for pid in SEARCH_PROFILES:
+            cases.append((f"cch.customize.{profile_name(pid)}", [lambda pid=pid: cch.customize(G, profiles.weights[pid])]))
+        customized = {pid: cch.customize(G, profiles.weights[pid]) for pid in SEARCH_PROFILES}
+        for pid in SEARCH_PROFILES:
+            cases.append((f"cch.query.{profile_name(pid)}", [lambda s=s, t=t, h=customized[pid]: h.query(s, t) for s, t in pairs]))
+    if ch is not None and cch is not None:
+        # the request path: the witness CH for the base profile, the customized CCH for the others
+        routed = ProfileSet(G, ch=ch, cch=cch, weights=profiles.weights)
+        routed.customize_all()
+        for pid in SEARCH_PROFILES:
+            calls = [lambda s=s, t=t, pid=pid: search_route(G, routed, G.coords, pid, s, t, "astar", math.inf, time.perf_counter(), cfg)
+                     for s, t in pairs]
+            cases.append((f"search_route.{profile_name(pid)}", calls))
+
+    cases.append(("snap.nearest.1", [lambda p=p: index.nearest(p[None]) for p in points]))
+    cases.append(("snap.edge.1", [lambda p=p: index.snap_to_edge(p[None]) for p in points]))
+    cases.append(("snap.nearest.1000", [lambda: index.nearest(batch)] * 10))
+    cases.append(("snap.edge.1000", [lambda: index.snap_to_edge(batch)] * 10))
+
+    # cache values of real routes
+    routes = [run_search(G, profiles, G.coords, BASE_PROFILE, s, t, math.inf, "astar", cfg)
+              for s, t in pairs[:min(queries, 20)]]
+    raws = [encode(path, cost, expanded) for path, cost, expanded, *_ in routes]
+    cases.append(("cache.encode", [lambda r=r: encode(r[0], r[1], r[2]) for r in routes]))
+    cases.append(("cache.decode", [lambda raw=raw: decode(raw) for raw in raws]))
+    return cases
+
+
+def measure(calls, repeat=3, runs=3):
+    '''
+    Time the calls in `runs` passes (after one warmup call). In a pass every call runs
+    `repeat` times and its fastest run counts, which filters out scheduler noise; the
+    latencies are those of the fastest pass, and the spread of the passes' p50 is the
+    case's noise floor. Returns a dict of summary stats.
+    '''
+    calls[0]()
+    passes = np.full((max(1, runs), len(calls)), np.inf)
+    expanded = []
+    for run, times in enumerate(passes):
+        for r in range(repeat):
+            for i, call in enumerate(calls):
+                started = time.perf_counter()
+                result = call()
+                times[i] = min(times[i], time.perf_counter() - started)
+                # route searches and hierarchy queries: (path, cost, expanded, ...)
+                if run == 0 and r == 0 and isinstance(result, tuple) and len(result) in (5, 6):
+                    expanded.append(result[2])
+
+    peaks = []
+    for call in calls[:ALLOC_SAMPLES]:
+        tracemalloc.start()
+        call()
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    pass_p50 = np.percentile(passes, 50, axis=1) * 1000.0
+    ms = passes[int(np.argmin(pass_p50))] * 1000.0
+    stats = {
+        "n": len(calls),
+        "repeat": repeat,
+        "runs": len(passes),
+        "p50_spread_ms": float(pass_p50.max() - pass_p50.min()),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "alloc_peak_kb": max(peaks) / 1024.0,
+    }
+    if expanded:
+        stats["expanded_mean"] = float(np.mean(expanded))
+        stats["expanded_p95"] = float(np.percentile(expanded, 95))
+    return stats
@@ -0,0 +1,76 @@
+'''
+Deterministic benchmark graphs.
+
+`grid` is a perturbed Manhattan grid, `planar` the Delaunay triangulation of uniformly random
+points (a connected planar graph with irregular degrees, closer to a real street network).
+Both are two-way, roughly city-sized around Bogotá's coordinates, and carry seeded highway
+classes, lighting and risk attributes, so every constraint profile has distinct costs.
+'''
+import numpy as np
+from scipy.spatial import Delaunay
+
+from app.graph import CSRGraph
+from app.snapshot import load_snapshot
+
+# highway class -> (share of edges, speed m/s)
+HIGHWAYS = {"primary": (0.1, 13.9), "secondary": (0.2, 11.1), "tertiary": (0.2, 9.7), "residential": (0.5, 8.3)}
+LAT0, LON0 = 4.60, -74.10
+M_PER_DEG = 111320.0
+
+
+def grid(n, seed=0, spacing_m=80.0):
+    '''About n nodes on a side x side grid.'''
+    side = max(2, int(round(np.sqrt(n))))
+    rng = np.random.default_rng(seed)
+    r, c = np.divmod(np.arange(side * side), side)
+    jitter = rng.normal(0.0, spacing_m * 0.1, (side * side, 2))
+    xy = np.column_stack((c * spacing_m, r * spacing_m)) + jitter
+    idx = np.arange(side * side).reshape(side, side)
+    u = np.concatenate((idx[:, :-1].ravel(), idx[:-1, :].ravel()))
+    v = np.concatenate((idx[:, 1:].ravel(), idx[1:, :].ravel()))
+    return _build(f"grid{side * side}", xy, u, v, rng)
+
+
+def planar(n, seed=0, spacing_m=80.0):
+    '''Delaunay triangulation of n random points at the given mean spacing.'''
+    rng = np.random.default_rng(seed)
+    extent = spacing_m * np.sqrt(n)
+    xy = rng.uniform(0.0, extent, (n, 2))
+    tri = Delaunay(xy).simplices
+    pairs = np.concatenate((tri[:, [0, 1]], tri[:, [1, 2]], tri[:, [2, 0]]))
+    keys = np.unique(pairs.min(axis=1).astype(np.int64) * n + pairs.max(axis=1))
+    return _build(f"planar{n}", xy, keys // n, keys % n, rng)
+
+
+def load(spec, seed=0):
+    '''"grid:<n>", "planar:<n>" or "snapshot:<path>".'''
+    kind, _, arg = spec.partition(":")
+    if kind == "grid":
+        return grid(int(arg), seed)
+    if kind == "planar":
+        return planar(int(arg), seed)
+    if kind == "snapshot":
+        return load_snapshot(arg)[0]
+    raise ValueError(f"unknown graph spec {spec!r} (grid:<n>, planar:<n> or snapshot:<path>)")
+
+
+def _build(name, xy, u, v, rng):
+    # undirected segments (u, v) -> two-way edges with per-segment attributes
+    n, m = len(xy), len(u)
+    lat = LAT0 + xy[:, 1] / M_PER_DEG
+    lon = LON0 + xy[:, 0] / (M_PER_DEG * np.cos(np.radians(LAT0)))
+    length = np.hypot(*(xy[u] - xy[v]).T)
+    names = list(HIGHWAYS)
+    shares = np.array([HIGHWAYS[h][0] for h in names])
+    speeds = np.array([HIGHWAYS[h][1] for h in names])
+    hw = rng.choice(len(names), m, p=shares / shares.sum())
+    lit = rng.random(m) < 0.6
+    temp_risk = rng.beta(2.0, 5.0, m)
+    security_risk = rng.beta(2.0, 5.0, m)
+
+    both = lambda a: np.concatenate((a, a))
+    ids = np.arange(n, dtype=np.int64) + 1
+    return CSRGraph.from_edge_list(
+        name, ids, lat, lon, np.concatenate((ids[u], ids[v])), np.concatenate((ids[v], ids[u])),
+        both(length), both(length / speeds[hw]), both(temp_risk), both(security_risk),
+        both(lit), [names[h] for h in both(hw)])
@@ -0,0 +1,42 @@
+'''
+Shared fixtures of the route engine's unit tests.
+
+    python -m pytest tests
+'''
+import pathlib
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "route_engine"))
+
+from app.graph import CSRGraph  # noqa: E402
+from app.utils import haversine  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def random_graph():
+    '''
+    A seeded random directed graph with parallel edges and unreachable pairs. Travel times are
+    at least the straight-line distance at 60 km/h, so the A* heuristic stays admissible.
+    '''
+    rng = np.random.default_rng(7)
+    n, m = 200, 900
+    lat = 4.60 + rng.random(n) * 0.03
+    lon = -74.10 + rng.random(n) * 0.03
+    u = rng.integers(0, n, m)
+    # the last 10 nodes have no incoming edges: unreachable as targets
+    v = rng.integers(0, n - 10, m)
+    v = np.where(v == u, (v + 1) % (n - 10), v)
+    # parallel copies of some edges, with other costs
+    dup = rng.integers(0, m, 150)
+    u, v = np.concatenate((u, u[dup])), np.concatenate((v, v[dup]))
+    straight = np.array([haversine(lat[a], lon[a], lat[b], lon[b]) for a, b in zip(u, v)])
+    length = straight * (1.0 + rng.random(len(u)))
+    travel_time = length / rng.uniform(5.0, 16.0, len(u))
+    ids = np.arange(n, dtype=np.int64) + 100
+    return CSRGraph.from_edge_list(
+        "random", ids, lat, lon, ids[u], ids[v], length, travel_time,
+        rng.beta(2.0, 5.0, len(u)), rng.beta(2.0, 5.0, len(u)), rng.random(len(u)) < 0.5,
+        ["residential"] * len(u))
@@ -0,0 +1,225 @@
+'''
+Open-loop replay of a recorded request trace against one engine or nginx.
+
+    pip install -r tests/requirements-replay.txt
+    python tests/replay.py --target http://localhost:8080 --speed 10 request_logs/requests-*.jsonl*
+
+The trace is the engines' request log (REQUEST_LOG_DIR): JSONL records with "ts", "city",
+"points", "profile" and "deadline_ms". Files of several workers are merged by time. Every request
+is sent at its recorded offset / --speed from the start, whether or not earlier ones have been
+answered. Latency is measured from that intended send time, so queueing anywhere (nginx, the
+engines, this client falling behind) shows up in the percentiles; Locust's closed loop hides
+it, because a slow response delays that user's next request (coordinated omission).
+
+Per --window seconds (of replay time) it reports request count, latency percentiles from an HDR
+histogram, and the rates of degraded routes, timeouts (504 or reason "timeout"), other errors
+and cache hits (X-Cache other than "miss").
+'''
+import argparse
+import asyncio
+import collections
+import glob
+import json
+import sys
+import time
+
+import aiohttp
+from hdrh.histogram import HdrHistogram
+
+# same bit order as route_engine/app/profiles.py
+FLAGS = ("cold_chain", "high_value", "security_conditions")
+# latencies in microseconds, 1 us .. 10 min, 3 significant digits
+HIST_ARGS = (1, 600 * 1000 * 1000, 3)
+PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+
+def load_trace(patterns, skip_sec, duration_sec):
+    '''
+    [(offset seconds, request body)] sorted by offset, from the trace files matching `patterns`;
+    offsets count from the first record kept. Also returns the trace's sampling rate (or None).
+    '''
+    records, dropped, samples = [], 0, set()
+    paths = sorted({p for pattern in patterns for p in glob.glob(pattern)})
+    if not paths:
+        raise SystemExit(f"no trace files match {' '.join(patterns)}")
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                    (src_lat, src_lon), (dst_lat, dst_lon) = rec["points"]
+                    body = {
+                        "city": rec["city"],
+                        "source": {"lat": src_lat, "lon": src_lon},
+                        "target": {"lat": dst_lat, "lon": dst_lon},
+                        "constraints": {flag: bool(int(rec.get("profile", 0)) >> bit & 1) for bit, flag in enumerate(FLAGS)},
+                    }
+                    if "deadline_ms" in rec:
+                        body["deadline_ms"] = int(rec["deadline_ms"])
+                    records.append((float(rec["ts"]), body))
+                    if "sample" in rec:
+                        samples.add(float(rec["sample"]))
+                except (ValueError, KeyError, TypeError):
+                    dropped += 1  # cut-off lines, records without points
+    if dropped:
+        print(f"[replay] skipped {dropped} unusable trace lines", file=sys.stderr)
+    records.sort(key=lambda r: r[0])
+    if not records:
+        return [], None
+    first = records[0][0] + skip_sec
+    last = first + duration_sec if duration_sec else float("inf")
+    trace = [(ts - first, body) for ts, body in records if first <= ts < last]
+    return trace, (samples.pop() if len(samples) == 1 else None)
+
+
+class Window:
+    def __init__(self):
+        self.hist = HdrHistogram(*HIST_ARGS)
+        self.counts = collections.Counter()
+
+
+class Report:
+    '''Outcomes per window of replay time, plus the totals.'''
+
+    def __init__(self, window_sec):
+        self.window_sec = window_sec
+        self.windows = collections.defaultdict(Window)
+        self.total = Window()
+        self.max_send_lag = 0.0
+
+    def record(self, replay_offset, latency_sec, status, degraded, timeout, cache_hit, error):
+        us = max(1, int(latency_sec * 1e6))
+        for w in (self.windows[int(replay_offset // self.window_sec)], self.total):
+            w.hist.record_value(min(us, HIST_ARGS[1]))
+            c = w.counts
+            c["requests"] += 1
+            c[f"status_{status}" if status else "status_error"] += 1
+            c["ok"] += status == 200
+            c["degraded"] += degraded
+            c["timeout"] += timeout
+            c["error"] += error
+            c["cache_hit"] += cache_hit
+
+    def rows(self):
+        for idx in sorted(self.windows):
+            yield idx * self.window_sec, self.windows[idx]
+        yield None, self.total
+
+    def summary(self, w):
+        c, n = w.counts, max(1, w.counts["requests"])
+        row = {
+            "requests": c["requests"],
+            "max_ms": w.hist.get_max_value() / 1000.0,
+            "degraded_rate": c["degraded"] / n,
+            "timeout_rate": c["timeout"] / n,
+            "error_rate": c["error"] / n,
+            "cache_hit_rate": c["cache_hit"] / max(1, c["ok"]),
+            "status": {k[len("status_"):]: v for k, v in c.items() if k.startswith("status_")},
+        }
+        for p in PERCENTILES:
+            row[f"p{p:g}_ms"] = w.hist.get_value_at_percentile(p) / 1000.0
+        return row
+
+    def print(self, elapsed_sec):
+        header = f"{'window':>8} {'req':>7} {'rps':>7} " + " ".join(f"{'p%g' % p:>9}" for p in PERCENTILES) + \
+                 f" {'max':>9} {'degr%':>6} {'tmo%':>6} {'err%':>6} {'hit%':>6}"
+        print(header)
+        for start, w in self.rows():
+            s = self.summary(w)
+            span = self.window_sec if start is not None else max(elapsed_sec, 1e-9)
+            label = f"{start:>7g}s" if start is not None else f"{'total':>8}"
+            print(f"{label} {s['requests']:>7} {s['requests'] / span:>7.1f} "
+                  + " ".join(f"{s[f'p{p:g}_ms']:>7.1f}ms" for p in PERCENTILES)
+                  + f" {s['max_ms']:>7.1f}ms {100 * s['degraded_rate']:>6.2f} {100 * s['timeout_rate']:>6.2f}"
+                  f" {100 * s['error_rate']:>6.2f} {100 * s['cache_hit_rate']:>6.2f}")
+        if self.max_send_lag > 0.01:
+            print(f"[replay] the client fell up to {1000 * self.max_send_lag:.0f} ms behind schedule; "
+                  "latencies still count from the scheduled times")
+
+
+async def fire(session, url, body, offset, due, loop, report):
+    report.max_send_lag = max(report.max_send_lag, loop.time() - due)
+    status, degraded, timeout, cache_hit, error = 0, False, False, False, False
+    try:
+        async with session.post(url, json=body) as res:
+            status = res.status
+            cache_hit = res.headers.get("X-Cache", "miss") != "miss"
+            payload = await res.json(content_type=None) if status in (200, 504) else None
+        if status == 200:
+            degraded = bool(payload.get("degraded"))
+            timeout = payload.get("reason") == "timeout"
+        else:
+            timeout = status == 504
+            error = status != 504
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+        error = True
+    report.record(offset, loop.time() - due, status, degraded, timeout, cache_hit and status == 200, error)
+
+
+async def replay(trace, args, report):
+    url = args.target.rstrip("/") + "/route"
+    extra = {"geometry": args.geometry} if args.geometry else {}
+    # limit=0: no client-side connection cap, arrivals never wait for a free connection
+    connector = aiohttp.TCPConnector(limit=args.connections)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        loop = asyncio.get_running_loop()
+        start = loop.time() + 0.5
+        tasks = set()
+        for offset, body in trace:
+            replay_offset = offset / args.speed
+            due = start + replay_offset
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.create_task(fire(session, url, {**body, **extra}, replay_offset, due, loop, report))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+        return loop.time() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Open-loop replay of a request trace.")
+    parser.add_argument("traces", nargs="+", metavar="TRACE", help="trace files or globs (rotated files too)")
+    parser.add_argument("--target", required=True, help="base URL: nginx (http://localhost:8080) or one engine (http://localhost:5001)")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="time compression: 2 sends the trace's requests twice as fast (default 1)")
+    parser.add_argument("--skip", type=float, default=0.0, help="start this many trace seconds after its first record")
+    parser.add_argument("--duration", type=float, default=0.0, help="replay only this many trace seconds (0 = all)")
+    parser.add_argument("--window", type=float, default=60.0, help="report window in replay seconds (default 60)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="client timeout per request in seconds")
+    parser.add_argument("--connections", type=int, default=0, help="max open connections (default 0 = unlimited)")
+    parser.add_argument("--geometry", help="override the response geometry format, e.g. none or polyline")
+    parser.add_argument("--json", metavar="PATH", help="also write the per-window report to PATH")
+    args = parser.parse_args(argv)
+    if args.speed <= 0 or args.window <= 0:
+        parser.error("--speed and --window must be > 0")
+
+    trace, sample = load_trace(args.traces, args.skip, args.duration)
+    if not trace:
+        raise SystemExit("the trace has no requests in the selected range")
+    span = trace[-1][0] or 1.0
+    print(f"[replay] {len(trace)} requests over {span:.0f}s of trace, replayed in {span / args.speed:.0f}s "
+          f"({len(trace) / span * args.speed:.1f} req/s) against {args.target}")
+    if sample:
+        print(f"[replay] the trace sampled {100 * sample:g}% of requests: --speed {1 / sample:g} replays the "
+              f"recorded rate, --speed {2 / sample:g} twice that")
+
+    report = Report(args.window)
+    started = time.time()
+    elapsed = asyncio.run(replay(trace, args, report))
+    report.print(elapsed)
+    if args.json:
+        doc = {
+            "target": args.target, "speed": args.speed, "started": started, "window_sec": args.window,
+            "windows": [{"start_sec": start, **report.summary(w)} for start, w in report.rows() if start is not None],
+            "total": report.summary(report.total),
+        }
+        with open(args.json, "w") as f:
+            json.dump(doc, f, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
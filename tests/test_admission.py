@@ -0,0 +1,31 @@
+'''
+Admission decisions of route_engine/app/admission.py.
+
+    python -m pytest tests/test_admission.py
+'''
+import pytest
+
+from app.admission import AdmissionController, Rejected
+
+
+def controller():
+    return AdmissionController(capacity=1, min_budget_sec=0.15, headroom=3.0)
+
+
+def test_short_deadline_on_idle_engine_is_admitted():
+    admission = controller()
+    for remaining_sec in (0.1, 0.14):
+        ticket = admission.admit("bogota", 0, 5.0, remaining_sec)
+        assert ticket.budget_sec == remaining_sec
+        admission.done(ticket)
+
+
+def test_short_deadline_behind_a_backlog_is_rejected():
+    admission = controller()
+    first = admission.admit("bogota", 0, 5.0, 3.0)
+    admission.done(first, cpu_sec=0.5)  # 0.1 s/km
+    backlog = admission.admit("bogota", 0, 5.0, 3.0)
+    with pytest.raises(Rejected):
+        admission.admit("bogota", 0, 5.0, 0.6)
+    admission.done(backlog)
+    assert admission.admit("bogota", 0, 5.0, 0.6).budget_sec == 0.6
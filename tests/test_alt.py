@@ -0,0 +1,49 @@
+'''
+A* with ALT landmark bounds (route_engine/app/alt.py) against plain Dijkstra.
+
+    python -m pytest tests/test_alt.py
+'''
+import math
+
+import numpy as np
+import pytest
+
+from app.a_star import astar_with_deadline, bidirectional_astar_with_deadline, dijkstra
+from app.alt import build_landmarks
+from app.profiles import edge_weights
+
+PROFILES = (0, 5, 7)
+
+
+@pytest.fixture(scope="module")
+def landmarks(random_graph):
+    return build_landmarks(random_graph, {pid: edge_weights(random_graph, pid) for pid in PROFILES}, count=8)
+
+
+@pytest.mark.parametrize("pid", PROFILES)
+def test_alt_astar_costs_equal_dijkstra(random_graph, landmarks, pid):
+    G = random_graph
+    weights = edge_weights(G, pid)
+    for s, t in np.random.default_rng(pid).integers(0, G.num_nodes, (60, 2)).tolist():
+        _, expected = dijkstra(G, s, t, weights)
+        heuristic = landmarks.heuristic(pid, t, source=s, active=4)
+        path, cost, _, _, reason = astar_with_deadline(G, s, t, heuristic, weights, math.inf)
+        if math.isinf(expected):
+            assert path == [] and reason == "no_path"
+            continue
+        assert cost == pytest.approx(expected, rel=1e-9)
+        reverse = landmarks.reverse_heuristic(pid, s, target=t, active=4)
+        path, cost, *_ = bidirectional_astar_with_deadline(G, s, t, heuristic, reverse, weights, math.inf)
+        assert cost == pytest.approx(expected, rel=1e-9)
+
+
+@pytest.mark.parametrize("pid", PROFILES)
+def test_alt_bounds_are_admissible(random_graph, landmarks, pid):
+    G = random_graph
+    weights = edge_weights(G, pid)
+    t = 3
+    heuristic = landmarks.heuristic(pid, t)
+    for v in range(0, G.num_nodes, 7):
+        _, cost = dijkstra(G, v, t, weights)
+        if not math.isinf(cost):
+            assert heuristic(v) <= cost * (1 + 1e-6)
@@ -0,0 +1,36 @@
+'''
+Route cache value encoding (route_engine/app/cache.py).
+
+    python -m pytest tests/test_cache.py
+'''
+import struct
+
+import numpy as np
+import pytest
+
+from app.cache import decode, encode
+
+
+@pytest.mark.parametrize("path", [
+    [4, 17, 17, 2 ** 31 - 1, 0],
+    [],
+    [5, 2 ** 31, 2 ** 40 + 3],  # tiled cities' osmids
+    [-2 ** 31 - 1, 9],
+])
+def test_encode_decode_round_trip(path):
+    raw = encode(path, 123.456789, 4321)
+    decoded_path, cost, expanded = decode(raw)
+    assert decoded_path.tolist() == path
+    assert cost == 123.456789 and expanded == 4321
+
+
+def test_narrow_paths_take_four_bytes_per_node():
+    narrow, wide = encode([1, 2, 3], 1.0, 0), encode([1, 2, 2 ** 31], 1.0, 0)
+    assert len(wide) - len(narrow) == 3 * 4
+    assert decode(narrow)[0].dtype == np.dtype("<i4")
+    assert decode(wide)[0].dtype == np.dtype("<i8")
+
+
+def test_decode_unknown_format():
+    assert decode(struct.pack("<BdI", 0, 1.0, 2) + b"\0" * 8) is None
+    assert decode(struct.pack("<BdI", 9, 1.0, 2)) is None
@@ -0,0 +1,49 @@
+'''
+Customizable Contraction Hierarchy queries (route_engine/app/cch.py) against plain Dijkstra.
+
+    python -m pytest tests/test_cch.py
+'''
+import math
+
+import numpy as np
+import pytest
+
+from app.a_star import dijkstra
+from app.cch import build_cch
+from app.profiles import NUM_PROFILES, edge_weights
+
+
+@pytest.fixture(scope="module")
+def topology(random_graph):
+    return build_cch(random_graph)
+
+
+@pytest.mark.parametrize("pid", [0, 1, 6, NUM_PROFILES - 1])
+def test_customized_costs_equal_dijkstra(random_graph, topology, pid):
+    G = random_graph
+    weights = edge_weights(G, pid)
+    hierarchy = topology.customize(G, weights)
+    unreachable = 0
+    for s, t in np.random.default_rng(pid).integers(0, G.num_nodes, (60, 2)).tolist():
+        path, cost, _, degraded, _ = hierarchy.query(s, t)
+        _, expected = dijkstra(G, s, t, weights)
+        if math.isinf(expected):
+            unreachable += 1
+            assert not path and math.isinf(cost)
+            continue
+        assert not degraded
+        assert cost == pytest.approx(expected, rel=1e-9)
+        assert path[0] == s and path[-1] == t
+        lo, hi = G.edge_range(np.asarray(path[:-1]), np.asarray(path[1:]))
+        assert (hi > lo).all()
+        assert sum(weights[a:b].min() for a, b in zip(lo, hi)) == pytest.approx(expected, rel=1e-9)
+    assert unreachable < 60
+
+
+def test_customizations_are_independent(random_graph, topology):
+    # one topology serves every profile: customizing another must not change a hierarchy
+    G = random_graph
+    base = topology.customize(G, edge_weights(G, 0))
+    before = base.query(0, 5)[1]
+    topology.customize(G, edge_weights(G, NUM_PROFILES - 1))
+    assert base.query(0, 5)[1] == before
@@ -0,0 +1,40 @@
+'''
+Contraction Hierarchy queries (route_engine/app/ch.py) against plain Dijkstra.
+
+    python -m pytest tests/test_ch.py
+'''
+import math
+
+import numpy as np
+import pytest
+
+from app.a_star import dijkstra
+from app.ch import build_ch
+from app.profiles import edge_weights
+
+
+def pairs(G, k=60, seed=3):
+    return np.random.default_rng(seed).integers(0, G.num_nodes, (k, 2)).tolist()
+
+
+@pytest.mark.parametrize("pid", [0, 3, 7])
+def test_ch_costs_equal_dijkstra(random_graph, pid):
+    G = random_graph
+    weights = edge_weights(G, pid)
+    ch = build_ch(G, weights)
+    unreachable = 0
+    for s, t in pairs(G):
+        path, cost, _, degraded, _ = ch.query(s, t)
+        _, expected = dijkstra(G, s, t, weights)
+        if math.isinf(expected):
+            unreachable += 1
+            assert path == [] and math.isinf(cost)
+            continue
+        assert not degraded
+        assert cost == pytest.approx(expected, rel=1e-9)
+        # the unpacked path is a path of G with that cost
+        assert path[0] == s and path[-1] == t
+        lo, hi = G.edge_range(np.asarray(path[:-1]), np.asarray(path[1:]))
+        assert (hi > lo).all()
+        assert sum(weights[a:b].min() for a, b in zip(lo, hi)) == pytest.approx(expected, rel=1e-9)
+    assert 0 < unreachable < len(pairs(G))
@@ -0,0 +1,46 @@
+'''
+Douglas-Peucker simplification and encoded polylines (route_engine/app/geometry.py).
+
+    python -m pytest tests/test_geometry.py
+'''
+import numpy as np
+import pytest
+
+from app.geometry import decode_polyline, encode_polyline, simplify
+
+# the worked example of Google's polyline algorithm description
+GOOGLE_POINTS = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+GOOGLE_ENCODED = "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+
+def test_encode_known_vector():
+    assert encode_polyline(GOOGLE_POINTS) == GOOGLE_ENCODED
+
+
+def test_decode_known_vector():
+    assert np.allclose(decode_polyline(GOOGLE_ENCODED), GOOGLE_POINTS)
+
+
+@pytest.mark.parametrize("precision", [5, 6])
+def test_round_trip(precision):
+    rng = np.random.default_rng(precision)
+    points = np.column_stack((rng.uniform(-90, 90, 300), rng.uniform(-180, 180, 300)))
+    points = np.round(points, precision)
+    decoded = decode_polyline(encode_polyline(points, precision), precision)
+    assert np.allclose(decoded, points, atol=0.5 * 10.0 ** -precision)
+
+
+def test_empty():
+    assert encode_polyline([]) == ""
+    assert decode_polyline("").shape == (0, 2)
+
+
+def test_simplify_keeps_points_off_the_line():
+    # 1 km east along the equator with one 50 m bump in the middle
+    lon = np.linspace(0.0, 0.009, 11)
+    lat = np.zeros(11)
+    lat[5] = 50 / 111195.0
+    points = np.column_stack((lat, lon))
+    assert simplify(points, 10).tolist() == [0, 4, 5, 6, 10]
+    assert simplify(points, 100).tolist() == [0, 10]
+    assert simplify(points, 0).tolist() == list(range(11))
@@ -0,0 +1,40 @@
+'''
+Live edge update batches (route_engine/app/updates.py).
+
+    python -m pytest tests/test_updates.py
+'''
+import math
+
+import pytest
+
+from app.updates import parse_batch
+
+
+def test_parse_batch():
+    batch = parse_batch([
+        {"u": 1, "v": 2, "travel_time": 30, "security_risk": 0.5},
+        {"u": "3", "v": 4, "travel_time": "12.5", "security_risk": 0},
+    ])
+    assert batch == {"u": [1, 3], "v": [2, 4], "travel_time": [30.0, 12.5], "security_risk": [0.5, 0.0]}
+
+
+@pytest.mark.parametrize("updates, message", [
+    (None, "non-empty list"),
+    ({"u": 1, "v": 2, "travel_time": 3}, "non-empty list"),
+    ([], "non-empty list"),
+    ([{"u": 1, "v": 2, "travel_time": 3}, [3, 4, 5]], "must be an object"),
+    ([{"u": 1, "v": 2}], "at least one of"),
+    ([{"u": 1, "v": 2, "speed": 3}], "at least one of"),
+    ([{"u": 1, "v": 2, "travel_time": 3}, {"u": 2, "v": 3, "temp_risk": 1}], "travel_time, temp_risk set by only some"),
+    ([{"u": 1, "v": 2, "travel_time": 3}, {"u": 2, "v": 3, "travel_time": 1, "temp_risk": 1}], "temp_risk set by only some"),
+    ([{"v": 2, "travel_time": 3}], "integer u, v"),
+    ([{"u": "a", "v": 2, "travel_time": 3}], "integer u, v"),
+    ([{"u": 1, "v": 2, "travel_time": "fast"}], "numeric values"),
+    ([{"u": 1, "v": 2, "travel_time": None}], "numeric values"),
+    ([{"u": 1, "v": 2, "travel_time": -1}], "travel_time values must be finite and non-negative"),
+    ([{"u": 1, "v": 2, "temp_risk": math.inf}], "temp_risk values must be finite"),
+    ([{"u": 1, "v": 2, "security_risk": "nan"}], "security_risk values must be finite"),
+])
+def test_parse_batch_rejects(updates, message):
+    with pytest.raises(ValueError, match=message):
+        parse_batch(updates)